@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Benchmark the sketch clustering engine of the cluster module against CD-HIT-EST.
+
+Plasmids are clustered once by cd-hit-est and once by the sketch engine. Agreement is reported as the adjusted Rand
+index of both partitions, along with the precision and recall of co-clustered plasmid pairs of the sketch engine
+compared to cd-hit-est.
+
+Usage: cluster_agreement.py --db db.json [--min-sequence-identity 90] [--max-sequence-length-difference 1000] [--threads 8]
+"""
+import argparse
+import logging
+import math
+import multiprocessing as mp
+import shutil
+import tempfile
+import time
+
+from collections import Counter
+from pathlib import Path
+
+import tadrep.cluster as tcl
+import tadrep.config as cfg
+import tadrep.io as tio
+
+
+def count_pairs(sizes):
+    return sum(math.comb(size, 2) for size in sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark agreement of the sketch clustering engine with cd-hit-est')
+    parser.add_argument('--db', required=True, help='TaDReP database (db.json)')
+    parser.add_argument('--min-sequence-identity', type=int, default=90, dest='min_sequence_identity', help='Minimal plasmid sequence identity in percent (default = 90)')
+    parser.add_argument('--max-sequence-length-difference', type=int, default=1000, dest='max_sequence_length_difference', help='Maximal plasmid sequence length difference in basepairs (default = 1000)')
+    parser.add_argument('--threads', type=int, default=mp.cpu_count(), help='Number of threads (default = number of available CPUs)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    work_path = Path(tempfile.mkdtemp()).resolve()
+    cfg.output_path = work_path
+    cfg.tmp_path = work_path
+    cfg.threads = args.threads
+    cfg.cluster_sequence_identity_threshold = args.min_sequence_identity / 100
+    cfg.cluster_length_threshold = args.max_sequence_length_difference
+
+    plasmids = list(tio.load_data(Path(args.db))['plasmids'].values())
+
+    start = time.monotonic()
+    cdhit_clusters = tcl.cluster_cdhit(plasmids)
+    cdhit_time = time.monotonic() - start
+
+    start = time.monotonic()
+    sketch_clusters = tcl.cluster_sketches(plasmids)
+    sketch_time = time.monotonic() - start
+
+    cdhit_labels = {member: cluster['id'] for cluster in cdhit_clusters for member in cluster['members']}
+    sketch_labels = {member: cluster['id'] for cluster in sketch_clusters for member in cluster['members']}
+    shared_pairs = count_pairs(Counter((cdhit_labels[plasmid['id']], sketch_labels[plasmid['id']]) for plasmid in plasmids).values())
+    cdhit_pairs = count_pairs(len(cluster['members']) for cluster in cdhit_clusters)
+    sketch_pairs = count_pairs(len(cluster['members']) for cluster in sketch_clusters)
+    expected_pairs = cdhit_pairs * sketch_pairs / math.comb(len(plasmids), 2) if len(plasmids) > 1 else 0.0
+    mean_pairs = (cdhit_pairs + sketch_pairs) / 2
+    ari = (shared_pairs - expected_pairs) / (mean_pairs - expected_pairs) if mean_pairs != expected_pairs else 1.0
+    precision = shared_pairs / sketch_pairs if sketch_pairs > 0 else 1.0
+    recall = shared_pairs / cdhit_pairs if cdhit_pairs > 0 else 1.0
+    representatives = len({cluster['representative'] for cluster in cdhit_clusters} & {cluster['representative'] for cluster in sketch_clusters})
+
+    print(f'plasmids: {len(plasmids)}, cd-hit clusters: {len(cdhit_clusters)}, sketch clusters: {len(sketch_clusters)}, shared representatives: {representatives}')
+    print(f'adjusted Rand index: {ari:.3f}, pair precision: {precision:.3f}, pair recall: {recall:.3f}')
+    print(f'cd-hit time: {cdhit_time:.1f} s, sketch time: {sketch_time:.1f} s')
+    shutil.rmtree(work_path)
+
+
+if __name__ == '__main__':
+    main()
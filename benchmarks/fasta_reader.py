@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Benchmark the native Fasta parser of tadrep.io against the Biopython parser.
+
+Both parsers import all sequences of a (compressed) Fasta file, e.g. the PLSDB plasmid sequences.
+Runtimes are reported per parser and the imported sequences are checked for equality.
+
+Usage: fasta_reader.py --fasta plsdb.fna.bz2 [--threads 8] [--repeats 3]
+"""
+import argparse
+import hashlib
+import logging
+import multiprocessing as mp
+import time
+
+from pathlib import Path
+
+import tadrep.io as tio
+
+
+def run(fasta_path, parser, threads):
+    digest = hashlib.sha256()
+    sequences = 0
+    bases = 0
+    start = time.perf_counter()
+    for contig in tio.iter_sequences(fasta_path, sequence=True, parser=parser, threads=threads):
+        digest.update(f"{contig['id']}\t{contig['description']}\t{contig['sequence']}\n".encode())
+        sequences += 1
+        bases += contig['length']
+    return time.perf_counter() - start, sequences, bases, digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the native Fasta parser against Biopython')
+    parser.add_argument('--fasta', required=True, help='(Compressed) Fasta file')
+    parser.add_argument('--threads', type=int, default=mp.cpu_count(), help='Number of decompression threads of the native parser (default = number of available CPUs)')
+    parser.add_argument('--repeats', type=int, default=1, help='Number of repeats per parser (default = 1)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    fasta_path = Path(args.fasta).resolve()
+    results = {}
+    for name, threads in [('biopython', 0), ('native', 0), ('native', args.threads)]:
+        runtimes = []
+        for repeat in range(args.repeats):
+            runtime, sequences, bases, digest = run(fasta_path, name, threads)
+            runtimes.append(runtime)
+        results[(name, threads)] = (min(runtimes), digest)
+        print(f'{name}\tthreads={threads}\tsequences={sequences}\tbases={bases}\truntime={min(runtimes):.2f} s\tthroughput={bases / min(runtimes) / 1e6:.1f} Mbp/s')
+
+    biopython_runtime, biopython_digest = results[('biopython', 0)]
+    for (name, threads), (runtime, digest) in results.items():
+        if(name == 'native'):
+            print(f"native (threads={threads}) speedup: {biopython_runtime / runtime:.2f}x, identical: {'yes' if digest == biopython_digest else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Benchmark the in-process k-mer index inc-type engine of the characterize module against the Blast+ search.
+
+Inc-types of all plasmids are searched once with blastn and once with the k-mer index. Agreement is reported as the
+fraction of plasmids with identical inc-type sets, along with the recall and precision of inc-type assignments
+of the k-mer index compared to blastn.
+
+Usage: inc_types_agreement.py --db db.json --inc-types inc-types.fasta [--threads 8]
+"""
+import argparse
+import logging
+import multiprocessing as mp
+import shutil
+import tempfile
+import time
+
+from pathlib import Path
+
+import tadrep.characterize as tc
+import tadrep.config as cfg
+import tadrep.io as tio
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark agreement of the k-mer index inc-type engine with blastn')
+    parser.add_argument('--db', required=True, help='TaDReP database (db.json)')
+    parser.add_argument('--inc-types', required=True, dest='inc_types', help='Inc-types (inc-types.fasta)')
+    parser.add_argument('--threads', type=int, default=mp.cpu_count(), help='Number of threads (default = number of available CPUs)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    work_path = Path(tempfile.mkdtemp()).resolve()
+    cfg.output_path = work_path
+    cfg.tmp_path = work_path
+    cfg.threads = args.threads
+    shutil.copyfile(args.inc_types, work_path.joinpath('inc-types.fasta'))
+
+    plasmids = list(tio.load_data(Path(args.db))['plasmids'].values())
+    fasta_path = work_path.joinpath('db.fasta')
+    tio.export_sequences(plasmids, fasta_path)
+
+    start = time.monotonic()
+    blastn_hits = tc.search_inc_types(fasta_path)
+    blastn_time = time.monotonic() - start
+
+    start = time.monotonic()
+    kmer_hits = tc.search_inc_types_kmer(plasmids)
+    kmer_time = time.monotonic() - start
+
+    print('plasmid\tblastn inc-types\tk-mer inc-types\tagreement')
+    agreements, shared_total, blastn_total, kmer_total = 0, 0, 0, 0
+    for plasmid in plasmids:
+        blastn_types = {hit['type'] for hit in blastn_hits.get(plasmid['id'], [])}
+        kmer_types = {hit['type'] for hit in kmer_hits.get(plasmid['id'], [])}
+        agreement = blastn_types == kmer_types
+        if(not agreement):
+            print(f"{plasmid['id']}\t{','.join(sorted(blastn_types))}\t{','.join(sorted(kmer_types))}\t{agreement}")
+        agreements += agreement
+        shared_total += len(blastn_types & kmer_types)
+        blastn_total += len(blastn_types)
+        kmer_total += len(kmer_types)
+
+    recall = shared_total / blastn_total if blastn_total > 0 else 1.0
+    precision = shared_total / kmer_total if kmer_total > 0 else 1.0
+    print(f'plasmids: {len(plasmids)}, agreement: {agreements / len(plasmids):.3f}, recall: {recall:.3f}, precision: {precision:.3f}')
+    print(f'blastn time: {blastn_time:.1f} s, k-mer time: {kmer_time:.1f} s')
+    shutil.rmtree(work_path)
+
+
+if __name__ == '__main__':
+    main()
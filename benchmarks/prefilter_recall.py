@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Benchmark the k-mer sketch reference prefilter of the detect module against a full Blast+ search.
+
+For each genome, reference plasmids are detected once searching all references and once searching only references
+selected by the prefilter. Recall is reported as the fraction of plasmids detected by the full search that are also
+detected with the prefilter.
+
+Usage: prefilter_recall.py --db db.json --genomes genome-1.fna genome-2.fna ... [--min-containment 5] [--threads 8]
+"""
+import argparse
+import logging
+import multiprocessing as mp
+import shutil
+import tempfile
+import time
+
+from pathlib import Path
+
+import tadrep.blast as tb
+import tadrep.config as cfg
+import tadrep.io as tio
+import tadrep.plasmids as tp
+import tadrep.sketch as tsk
+
+
+def detect(genome_path, reference_plasmids, reference_ids=None):
+    hits = tb.search_contigs(genome_path, cfg.threads, reference_ids)
+    filtered_hits = tb.filter_contig_hits(genome_path.stem, hits, reference_plasmids)
+    detected_plasmids = tp.detect_reference_plasmids(genome_path.stem, filtered_hits, reference_plasmids)
+    return {plasmid['reference'] for plasmid in detected_plasmids}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark recall of the k-mer sketch reference prefilter')
+    parser.add_argument('--db', required=True, help='TaDReP database (db.json)')
+    parser.add_argument('--genomes', required=True, nargs='+', help='Draft genome paths')
+    parser.add_argument('--min-containment', type=int, default=5, help='Minimal sketch containment in percent (default = 5)')
+    parser.add_argument('--threads', type=int, default=mp.cpu_count(), help='Number of threads (default = number of available CPUs)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    work_path = Path(tempfile.mkdtemp()).resolve()
+    cfg.output_path = work_path
+    cfg.tmp_path = work_path
+    cfg.references_path = work_path.joinpath('references')
+    cfg.threads = args.threads
+    cfg.shards = 1
+    cfg.min_containment = args.min_containment / 100
+    cfg.min_contig_coverage = 0.9
+    cfg.min_contig_identity = 0.9
+    cfg.min_plasmid_coverage = 0.8
+    cfg.min_plasmid_identity = 0.9
+
+    db_data = tio.load_data(Path(args.db))
+    reference_plasmids = {}
+    for cluster in db_data['clusters']:
+        reference_plasmid = db_data['plasmids'][cluster['representative']].copy()
+        reference_plasmid.update(cluster)
+        reference_plasmids[cluster['id']] = reference_plasmid
+    tb.setup_reference_db(reference_plasmids)
+    start = time.monotonic()
+    tb.setup_reference_sketches(reference_plasmids)
+    print(f'references: {len(reference_plasmids)}, sketching: {time.monotonic() - start:.1f} s')
+
+    print('genome\tfull plasmids\tprefilter plasmids\tselected references\trecall\tfull time [s]\tprefilter time [s]')
+    full_total, found_total, full_time_total, prefilter_time_total = 0, 0, 0.0, 0.0
+    for genome_path in [Path(genome).resolve() for genome in args.genomes]:
+        start = time.monotonic()
+        full_plasmids = detect(genome_path, reference_plasmids)
+        full_time = time.monotonic() - start
+
+        start = time.monotonic()
+        genome_hashes = tsk.sketch_sequences(contig['sequence'] for contig in tio.iter_sequences(genome_path))
+        reference_ids = tb.select_references(genome_path.stem, genome_hashes)
+        prefilter_plasmids = detect(genome_path, reference_plasmids, reference_ids)
+        prefilter_time = time.monotonic() - start
+
+        found = len(full_plasmids & prefilter_plasmids)
+        recall = found / len(full_plasmids) if len(full_plasmids) > 0 else 1.0
+        print(f'{genome_path.stem}\t{len(full_plasmids)}\t{len(prefilter_plasmids)}\t{len(reference_ids)}\t{recall:.3f}\t{full_time:.1f}\t{prefilter_time:.1f}')
+        full_total += len(full_plasmids)
+        found_total += found
+        full_time_total += full_time
+        prefilter_time_total += prefilter_time
+
+    recall = found_total / full_total if full_total > 0 else 1.0
+    print(f'total\t{full_total}\t{found_total}\t-\t{recall:.3f}\t{full_time_total:.1f}\t{prefilter_time_total:.1f}')
+    print(f'recall loss: {(1 - recall) * 100:.2f}%')
+    shutil.rmtree(work_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -28,6 +28,7 @@ setup(
     zip_safe=False,
     install_requires=[
         'biopython >= 1.78',
+        'numpy >= 1.20',
         'xopen >= 1.5.0',
         'pyrodigal >= 2.1.0',
         'matplotlib >= 3.7',
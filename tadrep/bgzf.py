@@ -0,0 +1,82 @@
+import logging
+import struct
+import zlib
+
+
+log = logging.getLogger('BGZF')
+
+
+MAX_BLOCK_INPUT = 0xff00  # maximal uncompressed block size as by htslib
+COMPRESSION_LEVEL = 6
+BUFFER_SIZE = 1 << 20
+HEADER = struct.Struct('<4BI2BH2BHH')  # gzip member header with BGZF extra field
+EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+class BgzfWriter:
+    """Write blocked gzip (BGZF) files and their .gzi block indexes.
+
+    Uncompressed data is buffered and compressed in blocks of at most 65280 bytes,
+    compatible with htslib (samtools faidx, bgzip) and Biopython.
+    """
+
+    def __init__(self, path, level=COMPRESSION_LEVEL):
+        self.path = path
+        self.level = level
+        self.fh = path.open('wb', buffering=BUFFER_SIZE)
+        self.buffer = bytearray()
+        self.compressed_offset = 0
+        self.uncompressed_offset = 0  # uncompressed offset of the buffer start
+        self.blocks = []  # compressed and uncompressed offsets of all blocks except the first one
+
+    def write(self, data):
+        self.buffer += data.encode() if isinstance(data, str) else data
+        while(len(self.buffer) >= MAX_BLOCK_INPUT):
+            self.write_block(self.buffer[:MAX_BLOCK_INPUT])
+            del self.buffer[:MAX_BLOCK_INPUT]
+
+    def tell(self):
+        """Return the uncompressed offset of all data written so far."""
+        return self.uncompressed_offset + len(self.buffer)
+
+    def write_block(self, data):
+        if(self.compressed_offset > 0):
+            self.blocks.append((self.compressed_offset, self.uncompressed_offset))
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(bytes(data)) + compressor.flush()
+        block_size = HEADER.size + len(compressed) + 8
+        self.fh.write(HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, block_size - 1))
+        self.fh.write(compressed)
+        self.fh.write(struct.pack('<2I', zlib.crc32(data) & 0xffffffff, len(data)))
+        self.compressed_offset += block_size
+        self.uncompressed_offset += len(data)
+
+    def close(self):
+        """Flush remaining data, write the EOF marker block and the .gzi index."""
+        if(len(self.buffer) > 0):
+            self.write_block(self.buffer)
+            self.buffer = bytearray()
+        self.fh.write(EOF_BLOCK)
+        self.fh.close()
+        with self.path.with_name(f'{self.path.name}.gzi').open('wb') as fh:
+            fh.write(struct.pack('<Q', len(self.blocks)))
+            for compressed_offset, uncompressed_offset in self.blocks:
+                fh.write(struct.pack('<2Q', compressed_offset, uncompressed_offset))
+        log.debug('written: path=%s, # blocks=%i, size=%i', self.path, len(self.blocks) + 1, self.uncompressed_offset)
+
+    def abort(self):
+        """Close the file without completing it and remove it, so that no truncated file or index remains."""
+        self.fh.close()
+        for path in [self.path, self.path.with_name(f'{self.path.name}.gzi')]:
+            if(path.exists()):
+                path.unlink()
+        log.debug('aborted: path=%s', self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if(exc_type is None):
+            self.close()
+        else:
+            self.abort()
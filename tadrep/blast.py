@@ -1,66 +1,346 @@
+import concurrent.futures as cf
+import hashlib
+import itertools
 import logging
 
 import tadrep.config as cfg
+import tadrep.io as tio
+import tadrep.sketch as tsk
 import tadrep.utils as tu
 
 
 log = logging.getLogger('BLAST')
 
 
+REFERENCE_DB_SUFFIXES = ['.nhr', '.nin', '.nsq']
+
+reference_dbs = []  # Blast+ database paths of all reference shards
+reference_db_size = 0  # total length of all reference plasmids
+reference_ordinals = {}  # reference plasmid ordinals within an unsharded database
+reference_shards = []  # reference plasmid IDs per shard
+reference_hash = None  # content hash of all clusters and representative sequences
+reference_sketches = None  # FracMinHash sketches of all representative sequences
+
+
+############################################################################
+# Setup cached reference plasmid database
+############################################################################
+def calc_reference_hash(reference_plasmids):
+    """Calculate a content hash of all clusters and their representative sequences."""
+    reference_hash = hashlib.sha256()
+    for reference_id in sorted(reference_plasmids.keys()):
+        reference_plasmid = reference_plasmids[reference_id]
+        reference_hash.update(f"{reference_id}\t{reference_plasmid['representative']}\n".encode())
+        reference_hash.update(reference_plasmid['sequence'].encode())
+        reference_hash.update(b'\n')
+    return reference_hash.hexdigest()
+
+
+def setup_reference_db(reference_plasmids):
+    """Build Blast+ database shards of all reference plasmids or reuse cached ones if the reference set did not change."""
+    global reference_dbs, reference_db_size, reference_ordinals, reference_shards, reference_hash
+    references_path = cfg.references_path
+    hash_path = references_path.with_suffix('.sha256')
+    shards = split_shards(reference_plasmids, cfg.shards)
+    reference_shards = [set(shard) for shard in shards]
+    reference_ordinals = {reference_id: ordinal for ordinal, reference_id in enumerate(reference_plasmids.keys())}  # subject order of an unsharded database
+    reference_db_size = sum(reference_plasmid['length'] for reference_plasmid in reference_plasmids.values())
+    if(len(shards) == 1):
+        reference_dbs = [references_path]
+    else:
+        reference_dbs = [references_path.with_name(f'{references_path.name}-{shard}') for shard in range(len(shards))]
+    reference_hash = calc_reference_hash(reference_plasmids)
+    cache_key = f'{reference_hash}\t{len(shards)}'
+
+    if(hash_path.is_file() and hash_path.read_text().strip() == cache_key):
+        if(all(db_path.with_suffix(suffix).is_file() for db_path in reference_dbs for suffix in REFERENCE_DB_SUFFIXES)):
+            log.info('reuse cached reference db: path=%s, # shards=%i, key=%s', references_path, len(reference_dbs), cache_key)
+            return False
+        log.debug('cached reference db incomplete: path=%s', references_path)
+
+    hash_path.unlink(missing_ok=True)  # invalidate cache until database is completely built
+    for db_path, shard in zip(reference_dbs, shards):
+        fasta_path = db_path.with_suffix('.fna')
+        tio.export_sequences([reference_plasmids[reference_id] for reference_id in shard], fasta_path)
+        cmd_makeblastdb = [
+            'makeblastdb',
+            '-in', str(fasta_path),
+            '-dbtype', 'nucl',
+            '-parse_seqids',
+            '-title', 'tadrep-references',
+            '-out', str(db_path)
+        ]
+        log.debug('cmd=%s', cmd_makeblastdb)
+        tu.run_cmd(cmd_makeblastdb, cfg.tmp_path)
+        log.info('built reference db: path=%s, # references=%i', db_path, len(shard))
+    hash_path.write_text(f'{cache_key}\n')
+    log.info('built reference db: path=%s, # shards=%i, key=%s', references_path, len(reference_dbs), cache_key)
+    return True
+
+
+def setup_reference_sketches(reference_plasmids):
+    """Compute FracMinHash sketches of all representative sequences or reuse cached ones if the reference set did not change."""
+    global reference_sketches
+    sketch_path = cfg.references_path.with_name(f'{cfg.references_path.name}.sketch.npz')
+    reference_sketches = tsk.import_sketches(sketch_path, reference_hash)
+    if(reference_sketches is not None):
+        log.info('reuse cached reference sketches: path=%s', sketch_path)
+        return False
+
+    reference_ids = list(reference_plasmids.keys())
+    with cf.ThreadPoolExecutor(max_workers=cfg.threads) as pool:
+        sketches = pool.map(tsk.sketch_sequence, [reference_plasmids[reference_id]['sequence'] for reference_id in reference_ids])
+        sketches = dict(zip(reference_ids, sketches))
+    tsk.export_sketches(sketches, sketch_path, reference_hash)
+    reference_sketches = tsk.import_sketches(sketch_path, reference_hash)
+    return True
+
+
+def select_references(genome, genome_hashes):
+    """Select reference plasmids sufficiently contained within a genome sketch by FracMinHash containment."""
+    containment = tsk.calc_containment(reference_sketches, genome_hashes)
+    selected_reference_ids = {reference_id for reference_id, reference_containment in zip(reference_sketches['ids'], containment) if reference_containment >= cfg.min_containment}
+    log.info('prefilter references: genome=%s, # hashes=%i, # selected=%i, # references=%i', genome, len(genome_hashes), len(selected_reference_ids), len(reference_sketches['ids']))
+    return selected_reference_ids
+
+
+def write_seqidlist(reference_ids, seqidlist_path):
+    with seqidlist_path.open('w') as fh:
+        for reference_id in sorted(reference_ids):
+            fh.write(f'{reference_id}\n')
+    return seqidlist_path
+
+
+def split_shards(reference_plasmids, shards):
+    """Split reference plasmids into shards balanced by total sequence length, assigning longest plasmids first."""
+    shards = max(min(shards, len(reference_plasmids)), 1)
+    if(shards == 1):
+        return [list(reference_plasmids.keys())]
+    reference_ids = sorted(reference_plasmids.keys(), key=lambda reference_id: (-reference_plasmids[reference_id]['length'], reference_id))
+    shard_ids = [[] for shard in range(shards)]
+    shard_lengths = [0] * shards
+    for reference_id in reference_ids:
+        shard = shard_lengths.index(min(shard_lengths))
+        shard_ids[shard].append(reference_id)
+        shard_lengths[shard] += reference_plasmids[reference_id]['length']
+    log.debug('split shards: # shards=%i, lengths=%s', shards, shard_lengths)
+    return shard_ids
+
+
 ############################################################################
 # Setup and run blastn search
 ############################################################################
-def search_contigs(genome_path, blast_output_path):
+def search_contigs(genome_path, threads, reference_ids=None, index=0):
+    """Search contigs of a single genome and lazily yield raw hits as they are reported by blastn.
+
+    If reference_ids are provided, only these reference plasmids are searched.
+    """
+    searches = [(db_path, None) for db_path in reference_dbs]  # database and optional seqidlist per shard
+    if(reference_ids is not None):
+        searches = []
+        for shard_index, (db_path, shard) in enumerate(zip(reference_dbs, reference_shards)):
+            shard_reference_ids = shard.intersection(reference_ids)
+            if(len(shard_reference_ids) > 0):
+                seqidlist_path = write_seqidlist(shard_reference_ids, cfg.tmp_path.joinpath(f'{genome_path.stem}-{index}-{shard_index}.seqids'))
+                searches.append((db_path, seqidlist_path))
+        if(len(searches) == 0):
+            return
+    if(len(searches) == 1):
+        db_path, seqidlist_path = searches[0]
+        hits = parse_hits(run_blastn(genome_path, db_path, threads, seqidlist_path))
+    else:
+        hits = search_shards(genome_path, searches, threads)
+    for qseqid, hit in hits:
+        hit['contig_id'] = f"{genome_path.stem}-{qseqid}"
+        yield hit
+
+
+def search_shards(genome_path, searches, threads):
+    """Search all reference shards concurrently and merge their hits.
 
+    Shards are searched without culling and the merged hits are culled once, in the order a single search against an
+    unsharded database would process them. All shards compute e-values for the total reference length (-dbsize),
+    but Blast+ derives the length adjustment of the effective search space from the number of sequences per shard,
+    so e-values may differ marginally from an unsharded search and hits close to the e-value threshold can differ.
+    """
+    shard_threads = max(threads // len(searches), 1)
+    with cf.ThreadPoolExecutor(max_workers=len(searches)) as pool:
+        futures = [pool.submit(search_shard, genome_path, db_path, shard_threads, seqidlist_path) for db_path, seqidlist_path in searches]
+    merged_hits = [hit for future in futures for hit in future.result()]
+    culled_hits = cull_hits(merged_hits)
+    log.debug('merged shard hits: genome=%s, # shards=%i, # merged-hits=%i, # culled-hits=%i', genome_path.stem, len(searches), len(merged_hits), len(culled_hits))
+    return culled_hits
+
+
+def search_shard(genome_path, db_path, threads, seqidlist_path=None):
+    return list(parse_hits(run_blastn(genome_path, db_path, threads, seqidlist_path, culling=False)))
+
+
+def cull_hits(hits):
+    """Apply Blast+ query culling (-culling_limit 1) to unculled (qseqid, hit) tuples of multiple searches.
+
+    Hits are processed in Blast+ order, i.e. grouped per reference plasmid by ascending best e-value and reference ordinal
+    and by descending score within each reference plasmid. A hit is discarded if it is dominated by an already retained hit
+    of the same query. Retained hits dominated by a newly retained hit are removed.
+    """
+    hits_per_query = {}
+    for qseqid, hit in hits:
+        hits_per_query.setdefault(qseqid, []).append(hit)
+
+    culled_hits = []
+    for qseqid, query_hits in hits_per_query.items():
+        retained_hits = []
+        for hit in sort_hits(query_hits):
+            if(any(dominates(retained_hit, hit) for retained_hit in retained_hits)):
+                continue
+            retained_hits = [retained_hit for retained_hit in retained_hits if not dominates(hit, retained_hit)]
+            retained_hits.append(hit)
+        retained_hits.sort(key=lambda k: (-k['score'], k['contig_start']))
+        culled_hits.extend((qseqid, hit) for hit in retained_hits)
+    return culled_hits
+
+
+def sort_hits(hits):
+    """Sort hits of a single query as Blast+ hit lists: reference plasmids by best e-value, hits of each reference plasmid by score."""
+    hits_per_reference = {}
+    for hit in hits:
+        hits_per_reference.setdefault(hit['reference_plasmid_id'], []).append(hit)
+    reference_ids = sorted(hits_per_reference.keys(), key=lambda reference_id: (
+        min(hit['evalue'] for hit in hits_per_reference[reference_id]),
+        -max(hit['score'] for hit in hits_per_reference[reference_id]),
+        reference_ordinals.get(reference_id, 0)
+    ))
+    return [hit for reference_id in reference_ids for hit in sorted(hits_per_reference[reference_id], key=lambda k: (-k['score'], k['contig_start']))]
+
+
+def dominates(hit_a, hit_b):
+    """Test if hit_a dominates hit_b on the query, following the Blast+ culling criterion.
+
+    A hit can only be dominated if at least half of its query range overlaps the dominating hit.
+    Domination is then decided by a weighted criterion of relative score (2x) and query range length (1x) differences.
+    """
+    begin_a, end_a, score_a = hit_a['contig_start'] - 1, hit_a['contig_end'], hit_a['score']
+    begin_b, end_b, score_b = hit_b['contig_start'] - 1, hit_b['contig_end'], hit_b['score']
+    length_a = end_a - begin_a
+    length_b = end_b - begin_b
+    overlap = min(end_a, end_b) - max(begin_a, begin_b)
+    if(2 * overlap < length_b):
+        return False
+    d = 4 * score_a * length_a + 2 * score_a * length_b - 2 * score_b * length_a - 4 * score_b * length_b
+    if((score_a == score_b and begin_a == begin_b and length_a == length_b) or d == 0):  # tie breakers
+        if(score_a != score_b):
+            return score_a > score_b
+        return reference_ordinals.get(hit_a['reference_plasmid_id'], 0) < reference_ordinals.get(hit_b['reference_plasmid_id'], 0)
+    return d > 0
+
+
+def search_contigs_batch(genome_paths, batch_query_path, threads):
+    """Search contigs of multiple genomes within a single blastn run and lazily yield raw hits grouped per genome index.
+
+    Blastn reports hits in query order and contigs of each genome are written consecutively,
+    so hits of each genome arrive as a single contiguous group.
+    If the reference prefilter is enabled, the union of all selected reference plasmids is searched without culling.
+    Hits of each genome are then restricted to its own selected reference plasmids and culled afterwards,
+    so that reference plasmids selected for other genomes neither add nor cull hits.
+    """
+    genome_reference_ids = []  # selected reference plasmids per genome
+    with batch_query_path.open('w') as fh:  # write genome-tagged contigs into a single query file
+        for index, genome_path in enumerate(genome_paths):
+            contig_sketches = []
+            for contig in tio.iter_sequences(genome_path):  # stream contigs
+                fh.write(f">g{index}_{contig['original-id']}\n{contig['sequence']}\n")
+                if(cfg.prefilter):
+                    contig_sketches.append(tsk.sketch_sequence(contig['sequence']))
+            if(cfg.prefilter):
+                genome_reference_ids.append(select_references(genome_path.stem, tsk.merge_sketches(contig_sketches)))
+    log.info('wrote batch query: path=%s, # genomes=%i', batch_query_path, len(genome_paths))
+
+    seqidlist_path = None
+    if(cfg.prefilter):
+        selected_reference_ids = set().union(*genome_reference_ids)
+        if(len(selected_reference_ids) == 0):
+            return
+        seqidlist_path = write_seqidlist(selected_reference_ids, cfg.tmp_path.joinpath('batch.seqids'))
+    tagged_hits = (split_genome_tag(qseqid, hit, genome_paths) for qseqid, hit in parse_hits(run_blastn(batch_query_path, reference_dbs[0], threads, seqidlist_path, culling=not cfg.prefilter)))
+    for index, group in itertools.groupby(tagged_hits, key=lambda tagged_hit: tagged_hit[0]):
+        if(cfg.prefilter):
+            yield index, filter_genome_hits(group, genome_reference_ids[index])
+        else:
+            yield index, (hit for _, hit in group)
+
+
+def filter_genome_hits(tagged_hits, reference_ids):
+    """Restrict unculled (genome index, hit) tuples of a single genome to its selected reference plasmids and cull them per contig."""
+    hits = [(hit['contig_id'], hit) for _, hit in tagged_hits if hit['reference_plasmid_id'] in reference_ids]
+    return [hit for contig_id, hit in cull_hits(hits)]
+
+
+def split_genome_tag(qseqid, hit, genome_paths):
+    genome_tag, contig_id = qseqid.split('_', maxsplit=1)
+    index = int(genome_tag[1:])
+    hit['contig_id'] = f"{genome_paths[index].stem}-{contig_id}"
+    return index, hit
+
+
+def run_blastn(query_path, db_path, threads, seqidlist_path=None, culling=True):
     cmd_blast = [
         'blastn',
-        '-query', str(genome_path),
-        '-subject', str(cfg.output_path.joinpath('references.fna')),
-        '-culling_limit', '1',
+        '-query', str(query_path),
+        '-db', str(db_path),
         '-evalue', '1E-5',
-        '-num_threads', str(cfg.blast_threads),
-        '-outfmt', '6 qseqid qstart qend qlen sseqid sstart send length nident sstrand evalue bitscore',
-        '-out', str(blast_output_path)
+        '-num_threads', str(threads),
+        '-outfmt', '6 qseqid qstart qend qlen sseqid sstart send length nident sstrand evalue bitscore score'
     ]
+    if(culling):  # sharded searches are culled after merging all shards
+        cmd_blast.extend(['-culling_limit', '1'])
+    if(seqidlist_path is not None):  # restrict search to selected reference plasmids
+        cmd_blast.extend(['-seqidlist', str(seqidlist_path)])
+    if(len(reference_dbs) > 1 or seqidlist_path is not None):  # compute e-values for the entire reference set
+        cmd_blast.extend(['-dbsize', str(reference_db_size)])
     log.debug('cmd=%s', cmd_blast)
+    return tu.stream_cmd(cmd_blast, cfg.tmp_path)
 
-    tu.run_cmd(cmd_blast, cfg.tmp_path)
-
-    hits = []
-    with blast_output_path.open('r') as fh:
-        for line in fh:
-            (qseqid, qstart, qend, qlen, sseqid, sstart, send, length, nident, sstrand, evalue, bitscore) = line.strip().split('\t')
-            hit = {
-                'contig_id': f"{genome_path.stem}-{qseqid}",
-                'contig_start': int(qstart),
-                'contig_end': int(qend),
-                'contig_length': int(qlen),
-                'reference_plasmid_id': sseqid,
-                'reference_plasmid_start': int(sstart),
-                'reference_plasmid_end': int(send),
-                'length': int(length),
-                'strand': '+' if sstrand == 'plus' else '-',
-                'coverage': int(length) / int(qlen),
-                'perc_identity': int(nident) / int(length),
-                'num_identity': int(nident),
-                'evalue': float(evalue),
-                'bitscore': float(bitscore)
-            }
-            if(hit['strand'] == '-'):
-                hit['reference_plasmid_start'], hit['reference_plasmid_end'] = hit['reference_plasmid_end'], hit['reference_plasmid_start']
-            hits.append(hit)
-    log.info('raw blast hits: genome=%s, # hits=%i', genome_path.stem, len(hits))
-    return hits
+
+def parse_hits(lines):
+    for line in lines:
+        (qseqid, qstart, qend, qlen, sseqid, sstart, send, length, nident, sstrand, evalue, bitscore, score) = line.strip().split('\t')
+        hit = {
+            'contig_id': None,
+            'contig_start': int(qstart),
+            'contig_end': int(qend),
+            'contig_length': int(qlen),
+            'reference_plasmid_id': sseqid,
+            'reference_plasmid_start': int(sstart),
+            'reference_plasmid_end': int(send),
+            'length': int(length),
+            'strand': '+' if sstrand == 'plus' else '-',
+            'coverage': int(length) / int(qlen),
+            'perc_identity': int(nident) / int(length),
+            'num_identity': int(nident),
+            'evalue': float(evalue),
+            'bitscore': float(bitscore),
+            'score': int(score)
+        }
+        if(hit['strand'] == '-'):
+            hit['reference_plasmid_start'], hit['reference_plasmid_end'] = hit['reference_plasmid_end'], hit['reference_plasmid_start']
+        yield qseqid, hit
 
 
 ############################################################################
 # Parse and filter contig hits
 ############################################################################
 def filter_contig_hits(genome, raw_hits, reference_plasmids):
+    """Filter raw hits by contig coverage and identity.
+
+    Raw hits are consumed in a single pass and might be provided lazily, e.g. streamed from blastn.
+    Only hits passing the identity filter are retained.
+    """
+    raw_hits_count = 0
     filtered_hits = 0
     filtered_hits_per_ref_plasmid = {}
     edge_hits_per_ref_plasmid = {}
     for hit in raw_hits:
+        raw_hits_count += 1
         reference_plasmid_id = hit['reference_plasmid_id']
         if(hit['perc_identity'] >= cfg.min_contig_identity):
             reference_plasmid = reference_plasmids[reference_plasmid_id]
@@ -112,5 +392,5 @@ def filter_contig_hits(genome, raw_hits, reference_plasmids):
                         edge_hit_a['contig_id'], edge_hit_a['reference_plasmid_id'], alignment_sum, contig_ident, contig_cov
                     )
 
-    log.info('filtered blast hits: genome=%s, # raw-hits=%i, # filtered-hits=%i', genome, len(raw_hits), filtered_hits)
+    log.info('filtered blast hits: genome=%s, # raw-hits=%i, # filtered-hits=%i', genome, raw_hits_count, filtered_hits)
     return filtered_hits_per_ref_plasmid
@@ -0,0 +1,88 @@
+import logging
+
+from Bio.Seq import Seq
+
+import tadrep.sequence as tsq
+
+
+log = logging.getLogger('CDS')
+
+
+TRANSLATION_TABLE = 11
+
+
+def pack_cds(genes, translation_table=TRANSLATION_TABLE):
+    """Pack (start, stop, strand, partial begin, partial end) tuples of CDS into columns.
+
+    Coordinates are stored as lists, strands and partial flags as strings of one character per CDS.
+    Amino acid sequences are not stored but translated on demand, see translate_cds().
+    """
+    starts, stops, strands, partial_begins, partial_ends = [], [], [], [], []
+    for start, stop, strand, partial_begin, partial_end in genes:
+        starts.append(start)
+        stops.append(stop)
+        strands.append(strand)
+        partial_begins.append('1' if partial_begin else '0')
+        partial_ends.append('1' if partial_end else '0')
+    return {
+        'start': starts,
+        'stop': stops,
+        'strand': ''.join(strands),
+        'partial_begin': ''.join(partial_begins),
+        'partial_end': ''.join(partial_ends),
+        'translation_table': translation_table
+    }
+
+
+def count_cds(cds):
+    """Return the number of CDS of packed CDS columns or a list of CDS as written by former versions."""
+    return len(cds) if isinstance(cds, list) else len(cds['start'])
+
+
+def iter_cds(cds):
+    """Iterate over CDS of packed CDS columns or a list of CDS as dicts with start, stop, strand and partial flags."""
+    if(isinstance(cds, list)):
+        yield from cds
+        return
+    for i in range(len(cds['start'])):
+        yield {
+            'start': cds['start'][i],
+            'stop': cds['stop'][i],
+            'strand': cds['strand'][i],
+            'partial_begin': cds['partial_begin'][i] == '1',
+            'partial_end': cds['partial_end'][i] == '1'
+        }
+
+
+def translate_cds(sequence, cds):
+    """Return amino acid sequences of all CDS, either materialized ones or translated lazily from the plasmid sequence."""
+    if(isinstance(cds, list)):
+        if(all('aa' in hit for hit in cds)):
+            return [hit['aa'] for hit in cds]
+        translation_table = TRANSLATION_TABLE
+    else:
+        if('aa' in cds):
+            return cds['aa']
+        translation_table = cds['translation_table']
+    return [translate(sequence, hit, translation_table) for hit in iter_cds(cds)]
+
+
+def materialize_translations(plasmid):
+    """Store amino acid sequences of all CDS in the packed CDS columns of a plasmid, e.g. for exports."""
+    cds = plasmid['cds']
+    if(isinstance(cds, list) or 'aa' in cds):
+        return
+    cds['aa'] = translate_cds(plasmid['sequence'], cds)
+
+
+def translate(sequence, hit, translation_table=TRANSLATION_TABLE):
+    """Translate a CDS with start codons translated to methionine and a terminal stop as by Pyrodigal."""
+    nucleotides = sequence[hit['start'] - 1:hit['stop']]
+    if(hit['strand'] == '-'):
+        nucleotides = tsq.reverse_complement(nucleotides)
+    nucleotides = nucleotides[:len(nucleotides) - len(nucleotides) % 3]  # partial CDS might end within a codon
+    aa = str(Seq(nucleotides).translate(table=translation_table))
+    start_codon = not hit.get('partial_begin', False) if hit['strand'] == '+' else not hit.get('partial_end', False)
+    if(start_codon and len(aa) > 0):
+        aa = f'M{aa[1:]}'
+    return aa
@@ -1,20 +1,33 @@
+import collections
+import hashlib
 import logging
 import sys
+import threading
+import concurrent.futures as cf
 
 import pyrodigal
 
+import tadrep.cds as tcd
 import tadrep.io as tio
 import tadrep.config as cfg
+import tadrep.replicon as trp
+import tadrep.stats as tst
 import tadrep.utils as tu
 
 
 log = logging.getLogger('CHARACTERIZE')
 
 
+GeneFinder = getattr(pyrodigal, 'GeneFinder', None) or pyrodigal.OrfFinder  # OrfFinder was renamed to GeneFinder in Pyrodigal v3
+gene_finders = threading.local()  # gene finder per worker thread
+
+CHARACTERISTICS = ['length', 'gc_content', 'gc_skew', 'n_content', 'composition', 'inc_types', 'cds', 'characterization']  # keys written per plasmid
+
+
 def characterize():
     # load json from output path
-    db_path = cfg.output_path.joinpath('db.json')
-    db_data = tio.load_data(db_path)
+    db_path = tio.get_db_path(cfg.output_path)
+    db_data = tio.load_db(db_path)
 
     # check if data is available
     if(not db_data):
@@ -24,39 +37,86 @@ def characterize():
         log.error('Failed to load Plasmids from %s', db_path)
         sys.exit(f'ERROR: Failed to load Plasmids from {db_path}! Maybe file is empty?')
 
-    # write multifasta
-    fasta_path = cfg.tmp_path.joinpath('db.fasta')
-    tio.export_sequences(db_data['plasmids'].values(), fasta_path)
-
-    # search inc_types for all plasmids
-    inc_types_per_plasmid = search_inc_types(fasta_path)
-
-    for id, plasmid in db_data['plasmids'].items():
+    # select plasmids lacking a characterization of the current sequence and inc-types
+    inc_types_hash = tu.calc_file_hash(get_inc_types_path())
+    plasmids = []
+    for plasmid in db_data['plasmids'].values():
+        characterization = calc_characterization_hash(plasmid['sequence'], inc_types_hash, cfg.inc_type_engine)
+        if(cfg.incremental and plasmid.get('characterization', None) == characterization and all(key in plasmid for key in CHARACTERISTICS)):
+            if(not cfg.store_translations or 'aa' in plasmid['cds']):
+                continue
+        plasmid['characterization'] = characterization
+        plasmids.append(plasmid)
+    log.info('characterize: # plasmids=%i, # pending=%i', len(db_data['plasmids']), len(plasmids))
+    if(len(plasmids) < len(db_data['plasmids'])):
+        cfg.verbose_print(f'Skip {len(db_data["plasmids"]) - len(plasmids)} already characterized plasmids')
+    if(len(plasmids) == 0):
+        print('All plasmids are already characterized')
+        return
+
+    # search inc_types for pending plasmids
+    if(cfg.inc_type_engine == 'kmer'):
+        inc_types_per_plasmid = search_inc_types_kmer(plasmids)
+    else:
+        fasta_path = cfg.tmp_path.joinpath('db.fasta')  # write multifasta
+        tio.export_sequences(plasmids, fasta_path)
+        inc_types_per_plasmid = search_inc_types(fasta_path)
+
+    statistics_per_plasmid = calc_statistics(plasmids)
+
+    for plasmid, plasmid_cds in predict_genes(plasmids):  # parallel gene prediction
+        statistics = statistics_per_plasmid[plasmid['id']]
         plasmid['length'] = len(plasmid['sequence'])
-        plasmid['gc_content'] = calc_gc_content(plasmid['sequence'])
+        plasmid['gc_content'] = statistics['gc_content']
+        plasmid['gc_skew'] = statistics['gc_skew']
+        plasmid['n_content'] = statistics['n_content']
+        plasmid['composition'] = statistics['composition']
         plasmid['inc_types'] = inc_types_per_plasmid.get(plasmid['id'], [])
-        plasmid['cds'] = gene_prediction(plasmid['sequence'])  # gene prediction
+        plasmid['cds'] = plasmid_cds
+        if(cfg.store_translations):
+            tcd.materialize_translations(plasmid)
 
         inc_types = ','.join([inc['type'] for inc in plasmid['inc_types']])
-        cfg.verbose_print(f"{plasmid['id']}:\tLength: {plasmid['length']:8}\tGC: {plasmid['gc_content']:3.2}\tCDS: {len(plasmid['cds']):5}\tInc Types: {inc_types}")
-        log.info('Plasmid: %s, len: %d, gc: %f, cds: %d, inc_types: %d', plasmid['id'], plasmid['length'], plasmid['gc_content'], len(plasmid['cds']), len(plasmid['inc_types']))
+        cfg.verbose_print(f"{plasmid['id']}:\tLength: {plasmid['length']:8}\tGC: {plasmid['gc_content']:3.2}\tCDS: {tcd.count_cds(plasmid['cds']):5}\tInc Types: {inc_types}")
+        log.info('Plasmid: %s, len: %d, gc: %f, cds: %d, inc_types: %d', plasmid['id'], plasmid['length'], plasmid['gc_content'], tcd.count_cds(plasmid['cds']), len(plasmid['inc_types']))
 
     # update json
     print('Writing JSON...')
-    tio.export_json(db_data, db_path)
+    tio.update_db(db_data, db_path, [('plasmids', plasmid['id'], key) for plasmid in plasmids for key in CHARACTERISTICS])  # write characteristics of characterized plasmids only
 
 
-def calc_gc_content(sequence):
-    return (sequence.count('C') + sequence.count('G')) / float(len(sequence))
+def calc_characterization_hash(sequence, inc_types_hash, inc_type_engine):
+    """Hash a plasmid sequence together with the inc-types reference and search engine it is characterized with."""
+    characterization_hash = hashlib.sha256(sequence.encode())
+    characterization_hash.update(inc_types_hash.encode())
+    characterization_hash.update(inc_type_engine.encode())
+    return characterization_hash.hexdigest()
 
 
-def search_inc_types(db_path):
-    """Search for incompatibility motifs."""
+def calc_statistics(plasmids):
+    """Calculate composition statistics of plasmids in batches, in parallel for multiple batches."""
+    lengths = [len(plasmid['sequence']) for plasmid in plasmids]
+    batch_size = min(tst.BATCH_SIZE, max(1, -(-sum(lengths) // cfg.threads)))  # at least one batch per thread
+    batches = list(tst.iter_batches(plasmids, lengths, batch_size))
+    statistics_per_plasmid = {}
+    with cf.ThreadPoolExecutor(max_workers=cfg.threads) as tpe:
+        for batch, batch_statistics in zip(batches, tpe.map(lambda batch: tst.calc_statistics([plasmid['sequence'] for plasmid in batch]), batches)):
+            for plasmid, statistics in zip(batch, batch_statistics):
+                statistics_per_plasmid[plasmid['id']] = statistics
+    return statistics_per_plasmid
+
+
+def get_inc_types_path():
     inc_types = cfg.output_path.joinpath('inc-types.fasta')
     if(not inc_types.is_file()):
         log.debug("Inc_types reference not found!")
         sys.exit("ERROR: Inc_types reference not found! Please import with '--inc-types PATH_TO_FASTA' or download it with subcommand setup!")
+    return inc_types
 
+
+def search_inc_types(db_path):
+    """Search for incompatibility motifs."""
+    inc_types = get_inc_types_path()
     tmp_output_path = cfg.tmp_path.joinpath('db.inc.blast.out')
     inc_types_cmd = [
         'blastn',
@@ -70,11 +130,10 @@ def search_inc_types(db_path):
     ]
     tu.run_cmd(inc_types_cmd, cfg.output_path)
 
-    hits_per_plasmid = {}
+    hits = []
     with tmp_output_path.open('r') as fh:
         for line in fh:
             cols = line.rstrip().split('\t')
-            plasmid_id = cols[1]
             hit = {
                 'type': cols[0],
                 'start': int(cols[2]),
@@ -84,25 +143,45 @@ def search_inc_types(db_path):
                 'coverage': float(cols[6]) / 100,
                 'bitscore': int(float(cols[7]))
             }
-            if(hit['coverage'] >= 0.6):
-                hits_per_pos = hits_per_plasmid.get(plasmid_id, {})
-                hit_pos = hit['end'] if hit['strand'] == '+' else hit['start']
-                if(hit_pos in hits_per_pos):
-                    former_hit = hits_per_pos[hit_pos]
-                    if(hit['bitscore'] > former_hit['bitscore']):
-                        hits_per_pos[hit_pos] = hit
-                        log.info(
-                            'inc-type: hit! contig=%s, type=%s, start=%d, end=%d, strand=%s',
-                            plasmid_id, hit['type'], hit['start'], hit['end'], hit['strand']
-                        )
-                else:
+            hits.append((cols[1], hit))
+    return filter_inc_type_hits(hits)
+
+
+def search_inc_types_kmer(plasmids):
+    """Search for incompatibility motifs with an in-process k-mer index, in parallel for multiple plasmids."""
+    index = trp.build_index((inc_type['original-id'], inc_type['sequence']) for inc_type in tio.iter_sequences(get_inc_types_path()))
+
+    hits = []
+    with cf.ThreadPoolExecutor(max_workers=cfg.threads) as tpe:
+        for plasmid, plasmid_hits in zip(plasmids, tpe.map(lambda plasmid: trp.search_sequence(index, plasmid['sequence']), plasmids)):
+            for inc_type, hit in plasmid_hits:
+                hits.append((plasmid['id'], {'type': inc_type, **hit}))
+    return filter_inc_type_hits(hits)
+
+
+def filter_inc_type_hits(hits):
+    """Select the best inc-type hits per position and type from (plasmid id, hit) tuples."""
+    hits_per_plasmid = {}
+    for plasmid_id, hit in hits:
+        if(hit['coverage'] >= 0.6):
+            hits_per_pos = hits_per_plasmid.get(plasmid_id, {})
+            hit_pos = hit['end'] if hit['strand'] == '+' else hit['start']
+            if(hit_pos in hits_per_pos):
+                former_hit = hits_per_pos[hit_pos]
+                if(hit['bitscore'] > former_hit['bitscore']):
                     hits_per_pos[hit_pos] = hit
                     log.info(
                         'inc-type: hit! contig=%s, type=%s, start=%d, end=%d, strand=%s',
                         plasmid_id, hit['type'], hit['start'], hit['end'], hit['strand']
                     )
-                hits_per_plasmid[plasmid_id] = hits_per_pos
-    
+            else:
+                hits_per_pos[hit_pos] = hit
+                log.info(
+                    'inc-type: hit! contig=%s, type=%s, start=%d, end=%d, strand=%s',
+                    plasmid_id, hit['type'], hit['start'], hit['end'], hit['strand']
+                )
+            hits_per_plasmid[plasmid_id] = hits_per_pos
+
     filtered_hits_per_plasmid = {}
     for plasmid_id, hits in hits_per_plasmid.items():  # remove potential smaller partial hits
         hits_per_inc = {}
@@ -118,16 +197,37 @@ def search_inc_types(db_path):
     return filtered_hits_per_plasmid
 
 
+def predict_genes(plasmids):
+    """Predict genes of plasmids in a thread pool, yielding (plasmid, cds) tuples in input order.
+
+    The number of futures waiting in the pool is bounded, so that predicted genes are consumed while others are predicted.
+    """
+    max_pending = 4 * cfg.threads
+    pending = collections.deque()
+    with cf.ThreadPoolExecutor(max_workers=cfg.threads) as pool:
+        for plasmid in plasmids:
+            pending.append((plasmid, pool.submit(gene_prediction, plasmid['sequence'])))
+            if(len(pending) >= max_pending):
+                plasmid, future = pending.popleft()
+                yield plasmid, future.result()
+        while(len(pending) > 0):
+            plasmid, future = pending.popleft()
+            yield plasmid, future.result()
+
+
+def get_gene_finder():
+    """Return a gene finder of the current thread, created once per thread and reused for all plasmids."""
+    gene_finder = getattr(gene_finders, 'gene_finder', None)
+    if(gene_finder is None):
+        gene_finder = GeneFinder(meta=True, closed=True)
+        gene_finders.gene_finder = gene_finder
+    return gene_finder
+
+
 def gene_prediction(plasmid_sequence):
-    plasmid_cds = []
-    orffinder = pyrodigal.OrfFinder(meta=True, closed=True)
-    for prediction in orffinder.find_genes(plasmid_sequence.encode()):
-        hit = {
-            'start': prediction.begin,
-            'stop': prediction.end,
-            'strand': '+' if prediction.strand == 1 else '-',
-            'aa': prediction.translate()
-        }
-        plasmid_cds.append(hit)
-
-    return plasmid_cds
+    gene_finder = get_gene_finder()
+    genes = gene_finder.find_genes(plasmid_sequence.encode())
+    return tcd.pack_cds(
+        [(gene.begin, gene.end, '+' if gene.strand == 1 else '-', gene.partial_begin, gene.partial_end) for gene in genes],
+        genes[0].translation_table if len(genes) > 0 else tcd.TRANSLATION_TABLE  # all genes are predicted by the same metagenomic model
+    )
@@ -1,24 +1,160 @@
+import bisect
 import logging
+import sys
+import concurrent.futures as cf
+
+import numpy as np
 
 import tadrep.io as tio
 import tadrep.config as cfg
+import tadrep.sequence as tsq
+import tadrep.sketch as tsk
 import tadrep.utils as tu
 
 
 log = logging.getLogger('CLUSTER')
 
 
+CHUNK_SIZE = 256  # plasmids per thread compared in parallel to representatives of former chunks
+
+
 def cluster_plasmids():
     # load json
-    db_path = cfg.output_path.joinpath('db.json')
-    db_data = tio.load_data(db_path)
+    db_path = tio.get_db_path(cfg.output_path)
+    db_data = tio.load_db(db_path)
+
+    if(cfg.incremental and len(db_data.get('clusters', [])) > 0):
+        changes = update_clusters(db_data)
+        if(changes is None):
+            return
+    else:
+        # cluster sequences
+        if(cfg.skip_cluster):
+            clusters = cluster_duplicates(db_data['plasmids'])
+        elif(cfg.cluster_engine == 'sketch'):
+            clusters = cluster_sketches(list(db_data['plasmids'].values()))
+        else:
+            clusters = cluster_cdhit(db_data['plasmids'].values())
+        db_data['clusters'] = clusters
+        changes = [('clusters',)]
+
+        cfg.verbose_print('Detected plasmid clusters:')
+        for cluster in clusters:
+            print_cluster(cluster)
+
+    # write json
+    tio.update_db(db_data, db_path, changes)
+
+
+def update_clusters(db_data):
+    """Assign plasmids not yet member of any cluster to existing clusters or new clusters.
+
+    Only new plasmids are compared to existing representatives and among each other. Existing clusters keep their ids,
+    representatives and found_in hits. Returns database changes or None if there are no new plasmids.
+    """
+    clusters = db_data['clusters']
+    clustered_ids = {member for cluster in clusters for member in cluster['members']}
+    plasmid_ids = [id for id in db_data['plasmids'] if id not in clustered_ids]
+    missing_representatives = [cluster['representative'] for cluster in clusters if cluster['representative'] not in db_data['plasmids']]
+    if(len(missing_representatives) > 0):
+        log.error('missing cluster representatives: %s', missing_representatives)
+        sys.exit(f"ERROR: Cluster representatives {', '.join(missing_representatives)} not found in database! Please recluster all plasmids without '--incremental'.")
+    log.info('incremental clustering: # plasmids=%i, # new=%i, # clusters=%i', len(db_data['plasmids']), len(plasmid_ids), len(clusters))
+    if(len(plasmid_ids) == 0):
+        print('All plasmids are already clustered')
+        return None
+
+    representative_ids = [cluster['representative'] for cluster in clusters]
+    if(cfg.skip_cluster):
+        new_representatives, members = assign_duplicates(db_data['plasmids'], plasmid_ids, representative_ids)
+    else:
+        plasmids = [db_data['plasmids'][id] for id in plasmid_ids]
+        representative_plasmids = [db_data['plasmids'][id] for id in representative_ids]
+        if(cfg.cluster_engine == 'sketch'):
+            new_representatives, members = assign_sketches(plasmids, representative_plasmids)
+        else:
+            new_representatives, members = assign_cdhit(plasmids, representative_plasmids)
+
+    changes = []
+    cfg.verbose_print('Updated plasmid clusters:')
+    for position, cluster in enumerate(clusters):
+        assigned = members.get(cluster['representative'], [])
+        if(len(assigned) > 0):
+            cluster['members'].extend(assigned)
+            changes.append(('clusters', position, 'members'))
+            print_cluster(cluster)
+    cluster_number = max([int(cluster['id'][1:]) for cluster in clusters if cluster['id'][1:].isdigit()], default=-1) + 1
+    for representative in new_representatives:
+        cluster = {
+            'id': f'p{cluster_number}',
+            'representative': representative,
+            'members': members[representative]
+        }
+        clusters.append(cluster)
+        cluster_number += 1
+        print_cluster(cluster)
+    if(len(new_representatives) > 0):  # new clusters cannot be journaled as positional changes
+        changes = [('clusters',)]
+    cfg.verbose_print(f'Assigned {len(plasmid_ids)} new plasmids: {len(plasmid_ids) - len(new_representatives)} to existing and {len(new_representatives)} to new clusters')
+    return changes
+
 
+def cluster_duplicates(plasmids):
+    """Create one cluster per plasmid or per distinct sequence without any alignment, see assign_duplicates()."""
+    representatives, members = assign_duplicates(plasmids, plasmids)
+    clusters = []
+    for cluster_id, representative in enumerate(representatives):
+        clusters.append({
+            'id': f'p{cluster_id}',
+            'representative': representative,
+            'members': members[representative]
+        })
+    log.info('skipped clustering: # plasmids=%i, # clusters=%i', len(plasmids), len(clusters))
+    return clusters
+
+
+def assign_duplicates(plasmids, ids, representative_ids=()):
+    """Assign plasmids to new clusters in a single pass, each plasmid to its own cluster.
+
+    If duplicates are collapsed, plasmids with identical sequences on either strand as a representative or a former
+    plasmid are assigned to its cluster via an index of canonical sequence hashes. Plasmid records are only loaded
+    to collapse duplicates. Returns ids of new representatives and assigned plasmids, as by assign_sketches().
+    """
+    representatives_per_hash = {}
+    if(cfg.collapse_duplicates):
+        for representative_id in representative_ids:
+            representatives_per_hash.setdefault(get_sequence_hash(plasmids[representative_id]), representative_id)
+
+    new_representatives = []
+    members = {}
+    for id in ids:
+        representative = None
+        if(cfg.collapse_duplicates):
+            sequence_hash = get_sequence_hash(plasmids[id])
+            representative = representatives_per_hash.setdefault(sequence_hash, id)
+        if(representative is None or representative == id):
+            new_representatives.append(id)
+            representative = id
+        members.setdefault(representative, []).append(id)
+    return new_representatives, members
+
+
+def get_sequence_hash(plasmid):
+    return plasmid['hash'] if 'hash' in plasmid else tsq.calc_canonical_hash(plasmid['sequence'])  # hash plasmids of former versions
 
+
+def print_cluster(cluster):
+    members = ', '.join(cluster['members'])
+    cfg.verbose_print(f"Cluster {cluster['id']}\n\tsize: {len(cluster['members'])}\n\trepresentative: {cluster['representative']}\n\tmembers: {members}")
+    log.info('cluster: %s, size: %d, rep: %s, members: %s', cluster['id'], len(cluster['members']), cluster['representative'], cluster['members'])
+
+
+def cluster_cdhit(plasmids):
+    """Cluster plasmids by CD-HIT-EST."""
     # write multifasta
     fasta_path = cfg.tmp_path.joinpath('plasmids.extracted.fna')
-    tio.export_sequences(db_data['plasmids'].values(), fasta_path)
+    tio.export_sequences(plasmids, fasta_path)
 
-    # cluster sequences
     cmd_cdhitest = [
         'cd-hit-est',
         '-i', str(fasta_path),
@@ -36,11 +172,61 @@ def cluster_plasmids():
     ]
     log.debug('cmd=%s', cmd_cdhitest)
     tu.run_cmd(cmd_cdhitest, cfg.tmp_path)
+    return parse_clusters(cfg.tmp_path.joinpath('plasmids.clustered.clstr'))
+
+
+def assign_cdhit(plasmids, representative_plasmids):
+    """Assign plasmids to representatives by CD-HIT-EST-2D and cluster remaining plasmids by CD-HIT-EST.
+
+    Returns ids of new representatives and ids of assigned plasmids per representative id, as by assign_sketches().
+    """
+    representatives_path = cfg.tmp_path.joinpath('plasmids.representatives.fna')
+    tio.export_sequences(representative_plasmids, representatives_path)
+    fasta_path = cfg.tmp_path.joinpath('plasmids.new.fna')
+    tio.export_sequences(plasmids, fasta_path)
 
-    # parse clusters
+    cmd_cdhitest2d = [
+        'cd-hit-est-2d',
+        '-i', str(representatives_path),
+        '-i2', str(fasta_path),
+        '-o', str(cfg.tmp_path.joinpath('plasmids.assigned')),
+        '-G', '1',  # use global sequence identity
+        '-c', str(cfg.cluster_sequence_identity_threshold),  # sequence identity threshold
+        '-S', str(cfg.cluster_length_threshold),  # sequence length threshold of shorter new sequences in bps
+        '-S2', str(cfg.cluster_length_threshold),  # sequence length threshold of longer new sequences in bps
+        '-AL', str(cfg.cluster_length_threshold),  # aligntment length threshold in bps
+        '-g', '1',  # cluster to the most similar cluster (slower but more accurate)
+        '-r', '1',  # do +/+ and +/- alignments
+        '-mask', 'NX',  # mask N and X letters
+        '-d', '0',  # provide entire Fasta identifier in cluster description file
+        '-M', '0',  # allow unlimited memory consumption
+        '-T', str(cfg.threads)
+    ]
+    log.debug('cmd=%s', cmd_cdhitest2d)
+    tu.run_cmd(cmd_cdhitest2d, cfg.tmp_path)
+
+    plasmid_positions = {plasmid['id']: position for position, plasmid in enumerate(plasmids)}
+    members = {}
+    for cluster in parse_clusters(cfg.tmp_path.joinpath('plasmids.assigned.clstr')):
+        assigned = [member for member in cluster['members'] if member in plasmid_positions]
+        if(len(assigned) > 0):
+            members[cluster['representative']] = sorted(assigned, key=lambda member: plasmid_positions[member])
+    assigned_ids = {member for assigned in members.values() for member in assigned}
+
+    new_representatives = []
+    remaining_plasmids = [plasmid for plasmid in plasmids if plasmid['id'] not in assigned_ids]
+    if(len(remaining_plasmids) > 0):
+        for cluster in cluster_cdhit(remaining_plasmids):
+            new_representatives.append(cluster['representative'])
+            members[cluster['representative']] = sorted(cluster['members'], key=lambda member: plasmid_positions[member])
+    return new_representatives, members
+
+
+def parse_clusters(clusters_path):
+    """Parse clusters of a CD-HIT cluster description file."""
     clusters = []
     current_cluster = None
-    with cfg.tmp_path.joinpath('plasmids.clustered.clstr').open('r') as fh:
+    with clusters_path.open('r') as fh:
         for line in fh:
             line = line.strip()
             if line.startswith('>'):
@@ -58,14 +244,89 @@ def cluster_plasmids():
                     current_cluster['representative'] = plasmid_id
         if current_cluster is not None:
             clusters.append(current_cluster)
+    return clusters
 
-    db_data['clusters'] = clusters
 
-    cfg.verbose_print('Detected plasmid clusters:')
-    for cluster in clusters:
-        members = ', '.join(cluster['members'])
-        cfg.verbose_print(f"Cluster {cluster['id']}\n\tsize: {len(cluster['members'])}\n\trepresentative: {cluster['representative']}\n\tmembers: {members}")
-        log.info('cluster: %s, size: %d, rep: %s, members: %s', cluster['id'], len(cluster['members']), cluster['representative'], cluster['members'])
-    
-    # write json
-    tio.export_json(db_data, db_path)
\ No newline at end of file
+def cluster_sketches(plasmids):
+    """Cluster plasmids greedily by sketch identities, similar to CD-HIT-EST."""
+    representatives, members = assign_sketches(plasmids)
+    clusters = []
+    for cluster_id, representative in enumerate(representatives):
+        clusters.append({
+            'id': f'p{cluster_id}',
+            'representative': representative,
+            'members': members[representative]
+        })
+    log.info('sketch clustering: # plasmids=%i, # clusters=%i', len(plasmids), len(clusters))
+    return clusters
+
+
+def assign_sketches(plasmids, representative_plasmids=()):
+    """Assign plasmids greedily to representatives by sketch identities.
+
+    Plasmids are processed by decreasing length and assigned to the most similar representative of at most
+    the maximal length difference and at least the minimal sequence identity, otherwise they become new representatives.
+    Chunks of plasmids are compared to all former representatives in parallel and afterwards to new representatives
+    of the same chunk, so that assignments do not depend on the number of threads.
+
+    Returns ids of new representatives in the order of their creation and ids of assigned plasmids
+    per representative id in the order of the given plasmids.
+    """
+    items = list(representative_plasmids) + list(plasmids)
+    offset = len(representative_plasmids)
+    lengths = [len(item['sequence']) for item in items]
+    with cf.ThreadPoolExecutor(max_workers=cfg.threads) as tpe:
+        sketches = list(tpe.map(lambda item: tsk.sketch_sequence(item['sequence']), items))
+        hashes = [tsq.calc_canonical_hash(item['sequence']) if len(sketch) == 0 else None for item, sketch in zip(items, sketches)]  # compare unsketched short plasmids exactly
+        comparison = (lengths, sketches, hashes)
+
+        representatives = sorted(range(offset), key=lambda i: -lengths[i])  # item indices of representatives by decreasing length
+        representative_lengths = [-lengths[i] for i in representatives]  # negative lengths for bisection
+        new_representatives = []
+        members = {}
+        order = sorted(range(offset, len(items)), key=lambda i: (-lengths[i], i))
+        chunk_size = CHUNK_SIZE * cfg.threads
+        for chunk_start in range(0, len(order), chunk_size):
+            chunk = order[chunk_start:chunk_start + chunk_size]
+            chunk_matches = list(tpe.map(lambda i: find_representative(i, representatives, representative_lengths, comparison), chunk))
+            chunk_representatives, chunk_representative_lengths = [], []
+            for i, (representative, identity) in zip(chunk, chunk_matches):
+                chunk_representative, chunk_identity = find_representative(i, chunk_representatives, chunk_representative_lengths, comparison)
+                if(chunk_representative is not None and (representative is None or chunk_identity > identity)):
+                    representative = chunk_representative
+                if(representative is None):
+                    chunk_representatives.append(i)
+                    chunk_representative_lengths.append(-lengths[i])
+                    new_representatives.append(i)
+                    representative = i
+                members.setdefault(representative, []).append(i)
+            for i in chunk_representatives:  # keep representatives sorted by decreasing length
+                position = bisect.bisect_right(representative_lengths, -lengths[i])
+                representatives.insert(position, i)
+                representative_lengths.insert(position, -lengths[i])
+
+    return [items[i]['id'] for i in new_representatives], {items[representative]['id']: [items[i]['id'] for i in sorted(assigned)] for representative, assigned in members.items()}
+
+
+def find_representative(i, representatives, representative_lengths, comparison):
+    """Return the most similar representative of a plasmid within the length and identity thresholds and its identity."""
+    lengths, sketches, hashes = comparison
+    first = bisect.bisect_left(representative_lengths, -(lengths[i] + cfg.cluster_length_threshold))
+    last = bisect.bisect_right(representative_lengths, -(lengths[i] - cfg.cluster_length_threshold))
+    best_representative, best_identity = None, 0.0
+    for representative in representatives[first:last]:
+        if(lengths[representative] >= lengths[i]):
+            identity = calc_identity(sketches[i], sketches[representative], hashes[i], hashes[representative])
+        else:
+            identity = calc_identity(sketches[representative], sketches[i], hashes[representative], hashes[i])
+        if(identity >= cfg.cluster_sequence_identity_threshold and identity > best_identity):
+            best_representative, best_identity = representative, identity
+    return best_representative, best_identity
+
+
+def calc_identity(sketch, representative_sketch, sequence_hash, representative_hash):
+    """Estimate the identity of a plasmid to a longer sequence from the containment of its sketch (Mash containment)."""
+    if(len(sketch) == 0):
+        return 1.0 if sequence_hash is not None and sequence_hash == representative_hash else 0.0
+    containment = np.count_nonzero(np.isin(sketch, representative_sketch, assume_unique=True)) / len(sketch)
+    return containment ** (1 / tsk.KMER_SIZE)
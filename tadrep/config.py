@@ -27,6 +27,8 @@ prefix = None
 # database setup
 force = False
 db_type = 'refseq'
+db_format = None
+db_compact = False
 
 # extraction setup
 # Input
@@ -38,11 +40,15 @@ header = None
 
 # characterize setup
 db_local_path = None
+inc_type_engine = 'blastn'
+store_translations = False
 
 # cluster setup
 cluster_sequence_identity_threshold = None
 cluster_length_threshold= None
 skip_cluster = False
+collapse_duplicates = False
+cluster_engine = 'cd-hit'
 
 # detection setup
 # Input
@@ -50,6 +56,9 @@ genome_path = []
 summary_path = None
 db_path = None
 db_data = None
+references_path = None
+cohort_path = None
+output_format = 'fasta'
 
 # workflow configuration
 min_contig_coverage = None
@@ -57,10 +66,14 @@ min_contig_identity = None
 min_plasmid_coverage = None
 min_plasmid_identity = None
 gap_sequence_length = None
+batch = False
+shards = 1
+prefilter = False
+min_containment = None
+incremental = False
 
 # multithreading
 lock = None
-blast_threads = None
 
 # visualize setup
 plot_style = 'arrow'
@@ -114,12 +127,16 @@ def setup(args):
 
 
 def setup_database(args):
-    global force, db_type
+    global force, db_type, db_format, db_compact
 
     force = args.force
     log.info('force = %s', force)
     db_type = args.type
     log.info('db_type = %s', db_type)
+    db_format = args.convert
+    log.info('db_format = %s', db_format)
+    db_compact = args.compact
+    log.info('db_compact = %s', db_compact)
 
 
 def setup_extract(args):
@@ -152,14 +169,15 @@ def setup_extract(args):
 
 
 def setup_characterize(args):
-    global db_local_path
+    global db_local_path, incremental, inc_type_engine, store_translations
 
     if(args.database):
         db_global_path = tu.check_file_permission(args.database, 'database')
-        db_local_path = output_path.joinpath('db.json')
-        shutil.copyfile(db_global_path, db_local_path)
-        verbose_print(f'Imported JSON from {db_global_path}')
-        log.debug('Copied file from %s to %s', db_global_path, db_local_path)
+        db_local_path = tio.get_db_path(output_path)
+        if(db_global_path.resolve() != db_local_path.resolve()):
+            tio.export_db(tio.load_db(db_global_path), db_local_path)  # replace local database in its current format
+        verbose_print(f'Imported database from {db_global_path}')
+        log.debug('Imported database from %s to %s', db_global_path, db_local_path)
 
     if(args.inc_types):
         inc_types_path = tu.check_file_permission(args.inc_types, 'inc-types')
@@ -168,9 +186,16 @@ def setup_characterize(args):
         verbose_print(f'Imported inc-types from {inc_types_path}')
         log.debug('Copied file from %s to %s', inc_types_path, db_local_path)
 
+    inc_type_engine = args.inc_type_engine
+    log.info('inc_type_engine=%s', inc_type_engine)
+    store_translations = args.store_translations
+    log.info('store_translations=%s', store_translations)
+    incremental = args.incremental
+    log.info('incremental=%s', incremental)
+
 
 def setup_cluster(args):
-    global skip_cluster, cluster_sequence_identity_threshold, cluster_length_threshold
+    global skip_cluster, collapse_duplicates, cluster_sequence_identity_threshold, cluster_length_threshold, cluster_engine, incremental
 
     cluster_sequence_identity_threshold = args.min_sequence_identity / 100
     log.info('cluster-sequence-identity-threshold=%0.3f', cluster_sequence_identity_threshold)
@@ -178,15 +203,23 @@ def setup_cluster(args):
     cluster_length_threshold = args.max_sequence_length_difference
     log.info('cluster-length-threshold=%d', cluster_length_threshold)
 
-    if(args.skip):
+    cluster_engine = args.engine
+    log.info('cluster-engine=%s', cluster_engine)
+
+    incremental = args.incremental
+    log.info('incremental=%s', incremental)
+
+    if(args.skip or args.collapse_duplicates):
         skip_cluster = True
-        verbose_print('Skipping clustering')
+        collapse_duplicates = args.collapse_duplicates
+        verbose_print('Skipping clustering, collapsing duplicate plasmids' if collapse_duplicates else 'Skipping clustering')
     log.info('skip_clusters=%s', skip_cluster)
+    log.info('collapse_duplicates=%s', collapse_duplicates)
 
 
 def setup_detect(args):
     # input / output path configurations
-    global genome_path, summary_path, db_path, db_data
+    global genome_path, summary_path, db_path, db_data, references_path, cohort_path, output_format
 
     if(not args.genome):
         log.error('genome file not provided!')
@@ -197,17 +230,26 @@ def setup_detect(args):
     summary_path = output_path.joinpath('summary.tsv')
     log.info('summary_path=%s', summary_path)
 
-    db_path = output_path.joinpath('db.json')
+    db_path = tio.get_db_path(output_path)
     log.info('db_path=%s', db_path)
 
-    db_data = tio.load_data(db_path)
+    references_path = output_path.joinpath('references')
+    log.info('references_path=%s', references_path)
+
+    cohort_path = output_path.joinpath('cohort.json')
+    log.info('cohort_path=%s', cohort_path)
+
+    output_format = args.output_format
+    log.info('output_format=%s', output_format)
+
+    db_data = tio.load_db(db_path)
 
     if(not db_data):
         log.debug("No data in %s", db_path)
         sys.exit(f"ERROR: No data available in {db_path}")
 
     # workflow configuration
-    global min_contig_coverage, min_contig_identity, min_plasmid_coverage, min_plasmid_identity, gap_sequence_length
+    global min_contig_coverage, min_contig_identity, min_plasmid_coverage, min_plasmid_identity, gap_sequence_length, batch, shards, prefilter, min_containment, incremental
     min_contig_coverage = args.min_contig_coverage / 100
     log.info('min-contig-coverage=%0.3f', min_contig_coverage)
     min_contig_identity = args.min_contig_identity / 100
@@ -218,14 +260,27 @@ def setup_detect(args):
     log.info('min-plasmid-identity=%0.3f', min_plasmid_identity)
     gap_sequence_length = args.gap_sequence_length
     log.info('gap-sequence-length=%i', gap_sequence_length)
+    batch = args.batch
+    log.info('batch=%s', batch)
+    shards = args.shards
+    if(shards < 1):
+        log.error('wrong shards value!')
+        sys.exit('ERROR: Wrong parameter value for shards!')
+    if(batch and shards > 1):
+        log.warning('batch mode ignores reference shards: shards=%i', shards)
+        verbose_print('Info: Reference shards are not supported in batch mode! Searching a single reference database.')
+        shards = 1
+    log.info('shards=%i', shards)
+    incremental = args.incremental
+    log.info('incremental=%s', incremental)
+    prefilter = args.prefilter
+    log.info('prefilter=%s', prefilter)
+    min_containment = args.min_containment / 100
+    log.info('min-containment=%0.3f', min_containment)
 
     # multithreading
-    global lock, blast_threads
+    global lock
     lock = mp.Lock()
-    blast_threads = threads // len(genome_path)
-    if(blast_threads == 0):
-        blast_threads = 1
-    log.info('blast-threads=%i', blast_threads)
 
 
 def setup_visualize(args):
@@ -3,6 +3,7 @@ import shutil
 import sys
 
 import tadrep.io as tio
+import tadrep.store as ts
 import tadrep.config as cfg
 import tadrep.database.refseq as dr
 import tadrep.database.plsdb as dp
@@ -42,7 +43,7 @@ def create_database():
     print('Create JSON database...')
     json_path = db_output_path.joinpath(f'{cfg.db_type}.json')
     log.info('JSON database: name=%s, path=%s', json_path.stem, json_path)
-    db_plasmids = tio.import_sequences(fasta_tmp_path, sequence=True)
+    db_plasmids = tio.import_sequences(fasta_tmp_path, sequence=True, threads=cfg.threads)
     json_plasmids = {}
 
     for plasmid in db_plasmids.values():
@@ -55,3 +56,37 @@ def create_database():
     tio.export_json(db_data, json_path)
 
     print(f'Database successfully created\nDatabase path: {db_output_path}')
+
+
+def convert_database():
+    source_path = tio.get_db_path(cfg.output_path)
+    target_path = cfg.output_path.joinpath(tio.DB_STORE if cfg.db_format == 'sqlite' else tio.DB_JSON)
+    if(not source_path.is_file()):
+        log.error('database not found! path=%s', source_path)
+        sys.exit(f'ERROR: No database found in {cfg.output_path}!')
+    if(source_path == target_path):
+        print(f'Database {source_path} is already in {cfg.db_format} format')
+        return
+
+    print(f'Convert database {source_path.name} to {target_path.name}...')
+    db_data = tio.load_db(source_path)
+    tio.export_db(db_data, target_path)
+    if(source_path.suffix == '.sqlite'):
+        db_data['plasmids'].close()
+        source_path.with_suffix(ts.SEQUENCE_SUFFIX).unlink()
+    elif(tio.get_journal_path(source_path).is_file()):
+        tio.get_journal_path(source_path).unlink()
+    source_path.unlink()  # converted database replaces source database
+    log.info('converted database: source=%s, target=%s', source_path, target_path)
+    print(f'Database successfully converted\nDatabase path: {target_path}')
+
+
+def compact_database():
+    db_path = tio.get_db_path(cfg.output_path)
+    if(not db_path.is_file()):
+        log.error('database not found! path=%s', db_path)
+        sys.exit(f'ERROR: No database found in {cfg.output_path}!')
+    print(f'Compact database {db_path.name}...')
+    tio.compact_db(db_path)
+    log.info('compacted database: path=%s', db_path)
+    print(f'Database successfully compacted\nDatabase path: {db_path}')
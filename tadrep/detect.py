@@ -1,12 +1,20 @@
+import contextlib
+import hashlib
 import logging
 import sys
 import concurrent.futures as cf
-import numpy as np
 
+from pathlib import Path
+
+import tadrep.cds as tcd
 import tadrep.config as cfg
 import tadrep.io as tio
+import tadrep.utils as tu
+import tadrep.bgzf as tbgzf
 import tadrep.blast as tb
 import tadrep.plasmids as tp
+import tadrep.scheduler as tsc
+import tadrep.sketch as tsk
 
 
 log = logging.getLogger('DETECTION')
@@ -38,97 +46,257 @@ def detect_and_reconstruct():
         reference_plasmid = cfg.db_data['plasmids'][cluster['representative']].copy()
         reference_plasmid.update(cluster)
         reference_plasmids[cluster['id']] = reference_plasmid
-    references_path = cfg.output_path.joinpath('references.fna')
-    tio.export_sequences(reference_plasmids.values(), references_path)
 
     cfg.verbose_print(f"Found {len(reference_plasmids)} representative plasmid(s)")
     log.info("Found %d representative plasmid(s)", len(reference_plasmids))
 
+    # Build or reuse cached Blast+ reference database
+    if(tb.setup_reference_db(reference_plasmids)):
+        cfg.verbose_print('Built reference database')
+    else:
+        cfg.verbose_print('Reuse cached reference database')
+    if(cfg.prefilter):
+        if(tb.setup_reference_sketches(reference_plasmids)):
+            cfg.verbose_print('Built reference sketches')
+        else:
+            cfg.verbose_print('Reuse cached reference sketches')
+
 
 
+    ############################################################################
+    # Setup cohort
+    # - merge genomes into previously analyzed cohort (incremental mode)
+    # - skip genomes with unchanged content, references and thresholds
+    ############################################################################
+    cohort, pending_samples = setup_cohort()
+    pending_genomes = [Path(cohort[sample]['path']) for sample in pending_samples]
+    if(len(pending_genomes) < len(cohort)):
+        cfg.verbose_print(f'Skip {len(cohort) - len(pending_genomes)} previously analyzed genome(s)')
+        log.info('skip previously analyzed genomes: # genomes=%i, # pending=%i', len(cohort), len(pending_genomes))
+
     ############################################################################
     # Prepare summary output file
     # - create file
     # - write header into file
+    # - append plasmids of genomes as soon as they and all preceding genomes are analyzed
     ############################################################################
-    plasmid_dict = {}
-    plasmid_string_summary = []
+    samples = list(cohort.keys())
+    sample_indices = {sample: genome_index for genome_index, sample in enumerate(samples)}
+    plasmid_genomes = {}  # sparse presence/absence: reference id -> indices of genomes the plasmid was detected in
     plasmids_detected = {}
 
-    cfg.verbose_print('Analyze genome sequences...')
-    futures = []
-    with cf.ThreadPoolExecutor(max_workers=cfg.threads) as pool:
-        for index, genome_path in enumerate(cfg.genome_path):
-            futures.append(pool.submit(detect_plasmids, genome_path, reference_plasmids, index))
-
-    for future in futures:
-        genome_index, plasmid_summary = future.result()
-        for plasmid in plasmid_summary:
-            reference_id = plasmid['reference']
-            if(reference_id not in plasmids_detected):
-                plasmids_detected[reference_id] = {k: plasmid[k] for k in ['id', 'reference', 'length']}
-                plasmids_detected[reference_id]['found_in'] = {}
-            plasmids_detected[reference_id]['found_in'][plasmid['genome']] = plasmid['hits']
-
-            # Create string for plasmid summary
-            plasmid_string_summary.append(f"{plasmid['genome']}\t{plasmid['reference']}\t{plasmid['coverage']:.3f}\t{plasmid['identity']:.3f}\t{len(plasmid['hits'])}\t{','.join([hit['contig_id'] for hit in plasmid['hits']])}\n")
-
-            if(reference_id not in plasmid_dict):
-                plasmid_dict[reference_id] = [0] * len(cfg.genome_path)
-                log.info('Plasmid added: id=%s', reference_id)
-            plasmid_dict[reference_id][genome_index] = 1
-
-    with cfg.summary_path.open('w') as fh:
-        fh.write(f'# {len(cfg.genome_path)} draft genome(s), {len(reference_plasmids)} reference plasmid(s)\n')
-        fh.write('Genome\tPlasmid\tCoverage\tIdentity\tContigs\tContig IDs\n')
-        for line in plasmid_string_summary:
-            fh.write(line)
-
-    if(plasmid_dict):
-        write_cohort_table(plasmid_dict)
-        write_plasmids_info(plasmid_dict, reference_plasmids)
+    with cfg.summary_path.open('w') as fh_summary:
+        fh_summary.write(f'# {len(cohort)} draft genome(s), {len(reference_plasmids)} reference plasmid(s)\n')
+        fh_summary.write('Genome\tPlasmid\tCoverage\tIdentity\tContigs\tContig IDs\n')
+        pending = set(pending_samples)
+        completed_genomes = {}  # genome index -> plasmids of analyzed genomes, buffered to write summary rows in input order
+        for sample, genome in cohort.items():  # previously analyzed genomes
+            if(sample not in pending):
+                completed_genomes[sample_indices[sample]] = genome['plasmids']
+        next_genome_index = add_completed_genomes(completed_genomes, 0, plasmid_genomes, plasmids_detected, fh_summary)
+
+        cfg.verbose_print('Analyze genome sequences...')
+        genome_sizes = [genome_path.stat().st_size for genome_path in pending_genomes]
+        tsc.setup(cfg.threads, genome_sizes)  # distribute cores dynamically across genomes
+        futures = []
+        with cf.ThreadPoolExecutor(max_workers=cfg.threads) as pool:
+            if(cfg.batch and len(pending_genomes) > 0):
+                cfg.verbose_print(f'Search {len(pending_genomes)} genome(s) in a single batch...')
+                batch_query_path = cfg.tmp_path.joinpath('batch.fna')
+                searched_genomes = set()
+                cores, acquire_time = tsc.acquire_cores(sum(genome_sizes))  # single blastn run uses the entire core budget
+                try:
+                    for index, hits in tb.search_contigs_batch(pending_genomes, batch_query_path, cores):  # filter streamed hits per genome and detect plasmids while blastn is still running
+                        genome_path = pending_genomes[index]
+                        filtered_hits = tb.filter_contig_hits(genome_path.stem, hits, reference_plasmids)
+                        futures.append(pool.submit(detect_plasmids, genome_path, reference_plasmids, index, filtered_hits))
+                        searched_genomes.add(index)
+                finally:
+                    tsc.release_cores(cores, acquire_time)
+                for index, genome_path in enumerate(pending_genomes):
+                    if(index not in searched_genomes):  # genomes without any hits
+                        futures.append(pool.submit(detect_plasmids, genome_path, reference_plasmids, index, {}))
+            else:
+                for index in sorted(range(len(pending_genomes)), key=lambda i: genome_sizes[i], reverse=True):  # start largest genomes first
+                    futures.append(pool.submit(detect_plasmids, pending_genomes[index], reference_plasmids, index))
+
+            for future in cf.as_completed(futures):  # consume results as soon as genomes are analyzed
+                index, plasmid_summary = future.result()
+                sample = pending_samples[index]
+                cohort[sample]['plasmids'] = [{k: v for k, v in plasmid.items() if k != 'sequence'} for plasmid in plasmid_summary]
+                completed_genomes[sample_indices[sample]] = cohort[sample]['plasmids']
+                next_genome_index = add_completed_genomes(completed_genomes, next_genome_index, plasmid_genomes, plasmids_detected, fh_summary)
+                fh_summary.flush()
+    utilization = tsc.get_utilization()
+    cfg.verbose_print(f"CPU utilization: {utilization['cpu_utilization'] * 100:.1f}% of {cfg.threads} core(s), core allocation: {utilization['allocation'] * 100:.1f}%, wall time: {utilization['wall_time']:.1f} s")
+
+    if(plasmid_genomes):
+        plasmid_genomes = {reference_id: plasmid_genomes[reference_id] for reference_id in reference_plasmids.keys() if reference_id in plasmid_genomes}  # order plasmids as in database
+        write_cohort_table(plasmid_genomes, samples)
+        write_plasmids_info(plasmid_genomes, reference_plasmids)
 
     if(plasmids_detected):
-        for reference_id, plasmid_data in plasmids_detected.items():
-            for cluster in cfg.db_data['clusters']:
-                if cluster['id'] == reference_id:
-                    cluster['found_in'] = plasmid_data['found_in']
-        tio.export_json(cfg.db_data, cfg.db_path)
+        changes = []
+        for cluster_index, cluster in enumerate(cfg.db_data['clusters']):
+            if(cluster['id'] in plasmids_detected):
+                found_in = plasmids_detected[cluster['id']]['found_in']
+                cluster['found_in'] = {sample: found_in[sample] for sample in samples if sample in found_in}  # genome order independent of completion order
+                changes.append(('clusters', cluster_index, 'found_in'))
+        tio.update_db(cfg.db_data, cfg.db_path, changes)  # write detected hits only
+
+    tio.export_json({'genomes': cohort}, cfg.cohort_path)
+
+
+def add_completed_genomes(completed_genomes, genome_index, plasmid_genomes, plasmids_detected, fh_summary):
+    """Add plasmids of consecutive completed genomes starting at genome_index and return the index of the next genome to add.
+
+    Genomes completing ahead of a preceding genome stay buffered, so that summary rows do not depend on completion order.
+    """
+    while(genome_index in completed_genomes):
+        add_genome_plasmids(completed_genomes.pop(genome_index), genome_index, plasmid_genomes, plasmids_detected, fh_summary)
+        genome_index += 1
+    return genome_index
+
+
+def add_genome_plasmids(plasmids, genome_index, plasmid_genomes, plasmids_detected, fh_summary):
+    """Append plasmids detected in a genome to the cohort summary and register them in the sparse presence/absence sets."""
+    for plasmid in plasmids:
+        reference_id = plasmid['reference']
+        if(reference_id not in plasmids_detected):
+            plasmids_detected[reference_id] = {k: plasmid[k] for k in ['id', 'reference', 'length']}
+            plasmids_detected[reference_id]['found_in'] = {}
+        plasmids_detected[reference_id]['found_in'][plasmid['genome']] = plasmid['hits']
+
+        fh_summary.write(f"{plasmid['genome']}\t{plasmid['reference']}\t{plasmid['coverage']:.3f}\t{plasmid['identity']:.3f}\t{len(plasmid['hits'])}\t{','.join([hit['contig_id'] for hit in plasmid['hits']])}\n")
+
+        if(reference_id not in plasmid_genomes):
+            plasmid_genomes[reference_id] = set()
+            log.info('Plasmid added: id=%s', reference_id)
+        plasmid_genomes[reference_id].add(genome_index)
+
+
+def setup_cohort():
+    """Merge provided genomes into the cohort of previously analyzed genomes and select genomes to be (re-)analyzed.
+
+    Each genome is keyed by its file content hash, the reference set hash, all detection thresholds and the output format
+    and prefix of its plasmid files.
+    In incremental mode, genomes with an unchanged key are skipped and their stored results are reused.
+    Files with unchanged path, size and modification time are not rehashed.
+    """
+    stored_cohort = tio.load_data(cfg.cohort_path).get('genomes', {}) if cfg.incremental else {}
+    genome_paths = {}
+    for sample, genome in stored_cohort.items():
+        genome_path = Path(genome['path'])
+        if(genome_path.is_file()):
+            genome_paths[sample] = genome_path
+        else:
+            log.warning('cohort genome not available, removed from cohort: genome=%s, path=%s', sample, genome_path)
+            cfg.verbose_print(f'Warning: genome {sample} not available ({genome_path}), removed from cohort!')
+    for genome_path in cfg.genome_path:
+        genome_paths[genome_path.stem] = genome_path
+
+    parameters = f'{tb.reference_hash}\t{cfg.min_contig_coverage}\t{cfg.min_contig_identity}\t{cfg.min_plasmid_coverage}\t{cfg.min_plasmid_identity}\t{cfg.gap_sequence_length}\t{cfg.prefilter}\t{cfg.min_containment}\t{cfg.output_format}\t{cfg.prefix}'
+    file_stats = {sample: genome_path.stat() for sample, genome_path in genome_paths.items()}
+    file_hashes = {}
+    for sample, genome_path in genome_paths.items():  # reuse content hashes of files with unchanged path, size and modification time
+        genome = stored_cohort.get(sample, None)
+        if(genome is not None and 'file_hash' in genome and genome['path'] == str(genome_path) and genome.get('size', None) == file_stats[sample].st_size and genome.get('mtime', None) == file_stats[sample].st_mtime_ns):
+            file_hashes[sample] = genome['file_hash']
+    hashed_samples = [sample for sample in genome_paths.keys() if sample not in file_hashes]
+    with cf.ThreadPoolExecutor(max_workers=cfg.threads) as pool:
+        file_hashes.update(zip(hashed_samples, pool.map(tu.calc_file_hash, [genome_paths[sample] for sample in hashed_samples])))
+    log.debug('hashed genome files: # genomes=%i, # hashed=%i', len(genome_paths), len(hashed_samples))
+
+    cohort = {}
+    pending_samples = []
+    for sample, genome_path in genome_paths.items():
+        file_hash = file_hashes[sample]
+        key = hashlib.sha256(f'{file_hash}\t{parameters}'.encode()).hexdigest()
+        genome = stored_cohort.get(sample, None)
+        if(genome is None or genome['key'] != key):
+            genome = {
+                'path': str(genome_path),
+                'key': key,
+                'plasmids': []
+            }
+            pending_samples.append(sample)
+        else:
+            log.debug('skip genome: genome=%s, key=%s', sample, key)
+        genome['path'] = str(genome_path)
+        genome['file_hash'] = file_hash
+        genome['size'] = file_stats[sample].st_size
+        genome['mtime'] = file_stats[sample].st_mtime_ns
+        cohort[sample] = genome
+    return cohort, pending_samples
 
 
-def detect_plasmids(genome, reference_plasmids, index):
+def detect_plasmids(genome, reference_plasmids, index, filtered_hits=None):
     log_pool = logging.getLogger('PROCESS')
 
-    # Import draft genome contigs
+    # Index draft genome contigs, sequences are fetched on demand
     try:
-        contigs = tio.import_sequences(genome, sequence=True)
-        log_pool.info('imported genome contigs: genome=%s, # contigs=%i', genome, len(contigs))
+        contigs = tio.index_sequences(genome)
+        log_pool.info('indexed genome contigs: genome=%s, # contigs=%i', genome, len(contigs))
     except ValueError:
         log_pool.error('wrong genome file format!', exc_info=True)
         sys.exit('ERROR: wrong genome file format!')
 
     sample = genome.stem
-    blast_output_path = cfg.tmp_path.joinpath(f'{sample}-{index}-blastn.tsv')
-    hits = tb.search_contigs(genome, blast_output_path)  # plasmid raw hits
-    filtered_hits = tb.filter_contig_hits(sample, hits, reference_plasmids)  # plasmid hits filtered by coverage and identity
+    if(filtered_hits is None):  # not yet searched in batch mode
+        reference_ids = None
+        if(cfg.prefilter):  # prefilter reference plasmids by sketch containment
+            genome_hashes = tsk.sketch_sequences(sequence for contig_id, sequence in tio.fetch_sequences(genome, contigs))
+            reference_ids = tb.select_references(sample, genome_hashes)
+        cores, acquire_time = tsc.acquire_cores(genome.stat().st_size)
+        log_pool.debug('blast search: genome=%s, cores=%i', sample, cores)
+        try:
+            hits = tb.search_contigs(genome, cores, reference_ids, index)  # plasmid raw hits streamed from blastn
+            filtered_hits = tb.filter_contig_hits(sample, hits, reference_plasmids)  # plasmid hits filtered by coverage and identity
+        finally:
+            tsc.release_cores(cores, acquire_time)
     detected_plasmids = tp.detect_reference_plasmids(sample, filtered_hits, reference_plasmids)  # detect reference plasmids above cov/id thresholds
 
+    # Fetch sequences of contigs of detected plasmids only
+    plasmid_contig_ids = {hit['contig_id'] for plasmid in detected_plasmids for hit in plasmid['hits']}
+    for contig_id, sequence in tio.fetch_sequences(genome, contigs, plasmid_contig_ids):
+        contigs[contig_id]['sequence'] = sequence
+    log_pool.debug('fetched contig sequences: genome=%s, # contigs=%i', sample, len(plasmid_contig_ids))
+
     # Write output files
     sample_summary_path = cfg.output_path.joinpath(f'{sample}-summary.tsv')
-    with sample_summary_path.open('w') as ssp:
+    with sample_summary_path.open('w') as ssp, contextlib.ExitStack() as writers:  # complete or remove BGZF files and indexes
         ssp.write("plasmid\tcontig\tcontig start\tcontig end\tcontig length\tcoverage[%]\tidentity[%]\talignment length\tstrand\tplasmid start\tplasmid end\tplasmid length\n")
 
+        if(cfg.output_format == 'bgzf' and len(detected_plasmids) > 0):  # per genome multi Fasta files of all plasmids
+            genome_prefix = f'{cfg.prefix}-{sample}' if cfg.prefix else sample
+            plasmids_contigs_path = cfg.output_path.joinpath(f'{genome_prefix}-contigs.fna.gz')
+            plasmids_pseudosequences_path = cfg.output_path.joinpath(f'{genome_prefix}-pseudo.fna.gz')
+            contigs_writer = writers.enter_context(tbgzf.BgzfWriter(plasmids_contigs_path))
+            pseudosequences_writer = writers.enter_context(tbgzf.BgzfWriter(plasmids_pseudosequences_path))
+            contigs_fai_lines = []
+            pseudosequences_fai_lines = []
+
         for plasmid in detected_plasmids:
             plasmid_contigs_sorted = tp.reconstruct_plasmid(plasmid, contigs)
-            prefix = f"{cfg.prefix}-{sample}-{plasmid['reference']}" if cfg.prefix else f"{sample}-{plasmid['reference']}"
-            plasmid_contigs_path = cfg.output_path.joinpath(f'{prefix}-contigs.fna')
-            tio.export_sequences(plasmid_contigs_sorted, plasmid_contigs_path, description=True, wrap=True)
-            plasmid_pseudosequence_path = cfg.output_path.joinpath(f'{prefix}-pseudo.fna')
-            tio.export_sequences([plasmid], plasmid_pseudosequence_path, description=True, wrap=True)
+            if(cfg.output_format == 'bgzf'):
+                plasmid_contigs = [{**contig, 'id': f"{plasmid['reference']}|{contig['id']}"} for contig in plasmid_contigs_sorted]  # contigs might be part of multiple plasmids
+                tio.export_sequences_bgzf(contigs_writer, plasmid_contigs, contigs_fai_lines, description=True)
+                tio.export_sequences_bgzf(pseudosequences_writer, [plasmid], pseudosequences_fai_lines, description=True)
+            else:
+                prefix = f"{cfg.prefix}-{sample}-{plasmid['reference']}" if cfg.prefix else f"{sample}-{plasmid['reference']}"
+                plasmid_contigs_path = cfg.output_path.joinpath(f'{prefix}-contigs.fna')
+                tio.export_sequences(plasmid_contigs_sorted, plasmid_contigs_path, description=True, wrap=True)
+                plasmid_pseudosequence_path = cfg.output_path.joinpath(f'{prefix}-pseudo.fna')
+                tio.export_sequences([plasmid], plasmid_pseudosequence_path, description=True, wrap=True)
 
             # Write detailed plasmid hits to sample summary file
             for hit in plasmid['hits']:
                 ssp.write(f"{plasmid['reference']}\t{hit['contig_id']}\t{hit['contig_start']}\t{hit['contig_end']}\t{hit['contig_length']}\t{hit['coverage']:.3f}\t{hit['perc_identity']:.3f}\t{hit['length']}\t{hit['strand']}\t{hit['reference_plasmid_start']}\t{hit['reference_plasmid_end']}\t{plasmid['length']}\n")
+    if(cfg.output_format == 'bgzf' and len(detected_plasmids) > 0):
+        tio.export_fai(contigs_fai_lines, plasmids_contigs_path)
+        tio.export_fai(pseudosequences_fai_lines, plasmids_pseudosequences_path)
+    for contig_id in plasmid_contig_ids:  # release contig sequences
+        contigs[contig_id]['sequence'] = None
 
     cfg.lock.acquire()
     log_pool.debug('lock acquired: genome=%s, index=%s', sample, index)
@@ -149,28 +317,30 @@ def detect_plasmids(genome, reference_plasmids, index):
     return index, detected_plasmids
 
 
-def write_cohort_table(plasmid_dict):
+def write_cohort_table(plasmid_genomes, samples):
+    """Write the plasmid presence/absence table row by row from sparse sets of genome indices per plasmid."""
+    genome_plasmids = {}  # invert sparse matrix: genome index -> columns of detected plasmids
+    for column, genome_indices in enumerate(plasmid_genomes.values()):
+        for genome_index in genome_indices:
+            genome_plasmids.setdefault(genome_index, []).append(column)
+
     plasmid_cohort_path = cfg.output_path.joinpath('plasmids.distribution.tsv')
     with plasmid_cohort_path.open('w') as fh:
-        plasmid_order = []  # write plasmid header
-        for plasmid in plasmid_dict.keys():
-            plasmid_order.append(plasmid_dict[plasmid])
+        for plasmid in plasmid_genomes.keys():  # write plasmid header
             fh.write(f'\t{plasmid}')
         fh.write('\n')
 
-        transposed_plasmid_order = np.array(plasmid_order).T.tolist()  # transpose information for easier writing
-        for num_genome, genome in enumerate(cfg.genome_path):  # mark which plasmid was found for each draft genome
-            sample = genome.stem
-            fh.write(f'{sample}')
-            for plasmid in transposed_plasmid_order[num_genome]:
-                fh.write(f'\t{"1" if plasmid else "0"}')
-            fh.write('\n')
+        for genome_index, sample in enumerate(samples):  # mark which plasmid was found for each draft genome
+            row = ['0'] * len(plasmid_genomes)
+            for column in genome_plasmids.get(genome_index, []):
+                row[column] = '1'
+            fh.write(f'{sample}\t' + '\t'.join(row) + '\n')
 
 
-def write_plasmids_info(plasmid_dict, reference_plasmids):
+def write_plasmids_info(plasmid_genomes, reference_plasmids):
     plasmid_info_path = cfg.output_path.joinpath('plasmids.info.tsv')
     with plasmid_info_path.open('w') as fh:
         fh.write('Plasmid\tRepresentative\tLength\tGC\tCDS\tINC_Types\n')
-        for plasmid_id in plasmid_dict.keys():
+        for plasmid_id in plasmid_genomes.keys():
             plasmid_inc_types = ', '.join([inc_type['type'] for inc_type in reference_plasmids[plasmid_id]['inc_types']]) if len(reference_plasmids[plasmid_id]["inc_types"]) > 0 else "-"
-            fh.write(f"{reference_plasmids[plasmid_id]['id']}\t{reference_plasmids[plasmid_id]['representative']}\t{reference_plasmids[plasmid_id]['length']}\t{reference_plasmids[plasmid_id]['gc_content']}\t{len(reference_plasmids[plasmid_id]['cds'])}\t{plasmid_inc_types:>}\n")
+            fh.write(f"{reference_plasmids[plasmid_id]['id']}\t{reference_plasmids[plasmid_id]['representative']}\t{reference_plasmids[plasmid_id]['length']}\t{reference_plasmids[plasmid_id]['gc_content']}\t{tcd.count_cds(reference_plasmids[plasmid_id]['cds'])}\t{plasmid_inc_types:>}\n")
@@ -1,99 +1,172 @@
+import heapq
 import logging
 import sys
+import concurrent.futures as cf
 
 import tadrep.config as cfg
 import tadrep.io as tio
+import tadrep.utils as tu
+import tadrep.sequence as tsq
+import tadrep.store as ts
 
 log = logging.getLogger('EXTRACT')
 
 
 def extract():
     # get existing json existing_plasmid_dict
-    json_output_path = cfg.output_path.joinpath('db.json')
-    db_data = tio.load_data(json_output_path)
+    json_output_path = tio.get_db_path(cfg.output_path)
+    db_data = tio.load_db(json_output_path)
     plasmid_dict = db_data.get('plasmids', {})      # are previous sequences available
-    file_list = db_data.get('files', [])              # which files were already extracted from
-    
+    file_paths = set(db_data.get('files', []))      # which files were already extracted from by former versions
+    file_hashes = db_data.get('file_hashes', {})    # which files were already extracted from: content checksum -> path
+
     # update plasmid count
     number_of_plasmids = len(plasmid_dict.keys())
     cfg.verbose_print(f'Loaded {number_of_plasmids} previously extracted plasmids')
     log.info('Loaded %d previously extracted plasmids from file %s', number_of_plasmids, json_output_path)
 
     new_plasmids = {}
-
-    # load sequences
-    for input_file in cfg.files_to_extract:
-        # check if file was already extracted
-        if(str(input_file) in file_list):
+    updated_plasmid_ids = set()  # previously extracted plasmids with additional sources
+    hashed_plasmid_ids = set()  # previously extracted plasmids of former versions without hash
+    plasmid_ids_per_hash = {}  # canonical sequence hash -> plasmid id
+    if(isinstance(plasmid_dict, ts.PlasmidStore)):  # look up hashes without loading records and sequences
+        plasmid_hashes = plasmid_dict.get_hashes()
+    else:
+        plasmid_hashes = {id: plasmid.get('hash', None) for id, plasmid in plasmid_dict.items()}
+    for id, sequence_hash in plasmid_hashes.items():
+        if(sequence_hash is None):  # hash plasmids of former versions once and store the hash
+            plasmid = plasmid_dict[id]
+            sequence_hash = tsq.calc_canonical_hash(plasmid['sequence'])
+            plasmid['hash'] = sequence_hash
+            plasmid_dict[id] = plasmid
+            hashed_plasmid_ids.add(id)
+        plasmid_ids_per_hash.setdefault(sequence_hash, id)
+    if(len(hashed_plasmid_ids) > 0):
+        log.info('hashed plasmids of former versions: # plasmids=%i', len(hashed_plasmid_ids))
+
+    # check if files were already extracted from by content checksum
+    with cf.ThreadPoolExecutor(max_workers=cfg.threads) as pool:
+        input_file_hashes = list(pool.map(tu.calc_file_hash, cfg.files_to_extract))
+    pending_files = []
+    new_file_hashes = []
+    pending_file_hashes = set()
+    for input_file, file_hash in zip(cfg.files_to_extract, input_file_hashes):
+        if(file_hash in file_hashes or str(input_file) in file_paths or file_hash in pending_file_hashes):
             cfg.verbose_print(f'Skipping {input_file.name}, already extracted from!')
             log.info('Skipping %s, already extracted from!', input_file)
             continue
-    
-        # add complete filepath to extracted files
-        file_list.append(str(input_file))
-
-        # import sequence
-        imported_sequences = tio.import_sequences(input_file, sequence=True)
-        imported_sequences = imported_sequences.values()
-        log.info('File: %s, sequences: %d', input_file.name, len(imported_sequences))
-
-        # call genome/draft/plasmid methods
-        extracted_plasmids = []
-        if(cfg.file_type == 'genome'):
-            extracted_plasmids = filter_longest(imported_sequences)
-        elif(cfg.file_type == 'draft'):
-            extracted_plasmids = filter_by_header(imported_sequences)
-            extracted_plasmids = [plasmid for plasmid in extracted_plasmids if plasmid['length'] <= cfg.max_length]  # apply length filter
-        else:  # plasmid
-            extracted_plasmids = imported_sequences
-        
-        # add file name and new id to plasmids
-        cfg.verbose_print(f'File: {input_file.name}, detected plasmids: {len(extracted_plasmids)}')
-        log.info('File: %s, plasmids detected: %d', input_file.name, len(extracted_plasmids))
-        for plasmid in extracted_plasmids:
-            plasmid['file'] = input_file.name
-            new_plasmids[plasmid['id']] = plasmid
+        pending_files.append(input_file)
+        new_file_hashes.append(file_hash)
+        pending_file_hashes.add(file_hash)
+
+    # extract plasmid candidates of all files in parallel processes
+    with cf.ProcessPoolExecutor(max_workers=cfg.threads) as pool:
+        futures = [pool.submit(extract_file, input_file, cfg.file_type, cfg.header, cfg.discard_longest, cfg.max_length) for input_file in pending_files]
+        for input_file, file_hash, future in zip(pending_files, new_file_hashes, futures):  # consume in input order
+            try:
+                extracted_plasmids = future.result()
+            except ValueError as e:
+                log.error('extraction failed: file=%s', input_file, exc_info=True)
+                sys.exit(f'ERROR: {e}')
+            file_hashes[file_hash] = str(input_file)
+
+            # add file name and new id to plasmids
+            cfg.verbose_print(f'File: {input_file.name}, detected plasmids: {len(extracted_plasmids)}')
+            log.info('File: %s, plasmids detected: %d', input_file.name, len(extracted_plasmids))
+            duplicates = 0
+            for plasmid in extracted_plasmids:
+                source = {'file': input_file.name, 'id': plasmid['id']}
+                existing_id = plasmid_ids_per_hash.get(plasmid['hash'], None)
+                if(existing_id is not None):  # identical sequence on either strand, store source only
+                    existing_plasmid = new_plasmids[existing_id] if existing_id in new_plasmids else plasmid_dict[existing_id]
+                    sources = existing_plasmid.get('sources', [{'file': existing_plasmid['file'], 'id': existing_plasmid['id']}])
+                    existing_plasmid['sources'] = sources + [source]
+                    if(existing_id not in new_plasmids):
+                        plasmid_dict[existing_id] = existing_plasmid
+                        updated_plasmid_ids.add(existing_id)
+                    duplicates += 1
+                    log.debug('duplicate plasmid: id=%s, file=%s, duplicate-of=%s', plasmid['id'], input_file.name, existing_id)
+                else:
+                    plasmid['sources'] = [source]
+                    plasmid_ids_per_hash[plasmid['hash']] = plasmid['id']
+                    new_plasmids[plasmid['id']] = plasmid
+            if(duplicates > 0):
+                cfg.verbose_print(f'File: {input_file.name}, duplicated plasmids: {duplicates}')
+                log.info('File: %s, duplicated plasmids: %d', input_file.name, duplicates)
 
     # update existing_plasmid_dict
     plasmid_dict.update(new_plasmids)
     cfg.verbose_print(f'New plasmids extracted: {len(new_plasmids)}')
     cfg.verbose_print(f'Total plasmids extracted: {len(plasmid_dict)}')
     log.info('Total plasmids extracted: %d', len(plasmid_dict))
-    
+
     # export to json
+    changes = [('plasmids', id) for id in new_plasmids.keys()] + [('plasmids', id, 'sources') for id in updated_plasmid_ids]
+    changes += [('plasmids', id, 'hash') for id in hashed_plasmid_ids]
+    if('file_hashes' in db_data):
+        changes += [('file_hashes', file_hash) for file_hash in new_file_hashes]  # new entries only
+    else:
+        changes.append(('file_hashes',))
     db_data['plasmids'] = plasmid_dict
-    db_data['files'] = file_list
-    tio.export_json(db_data, json_output_path)
-
-
-def filter_by_header(sequences):
+    db_data['file_hashes'] = file_hashes
+    tio.update_db(db_data, json_output_path, changes)  # write new plasmids, sources and files only
+
+
+def extract_file(input_file, file_type, header, discard_longest, max_length):
+    """Extract plasmid candidates of a single file streaming its sequences, so that only candidates are kept in memory.
+
+    All parameters are passed explicitly as this function runs in a worker process.
+    """
+    sequences = tio.iter_sequences(input_file, sequence=True)
+    if(file_type == 'genome'):
+        extracted_plasmids = filter_longest(sequences, discard_longest)
+    elif(file_type == 'draft'):
+        extracted_plasmids = [plasmid for plasmid in filter_by_header(sequences, header) if plasmid['length'] <= max_length]  # apply length filter
+    else:  # plasmid
+        extracted_plasmids = list(sequences)
+    for plasmid in extracted_plasmids:
+        plasmid['file'] = input_file.name
+        plasmid['hash'] = tsq.calc_canonical_hash(plasmid['sequence'])
+    log.info('File: %s, plasmids extracted: %d', input_file.name, len(extracted_plasmids))
+    return extracted_plasmids
+
+
+def filter_by_header(sequences, header=None):
     # search headers for 'plasmid' 'complete', 'circular=true' or custom string
     description_headers = ['plasmid', 'complete', 'circular=true']
 
-    filtered_sequences = []
     for sequence in sequences:
         # test if id contains custom string
-        if(cfg.header):
-            if(cfg.header in sequence['id']):
-                filtered_sequences.append(sequence)
+        if(header):
+            if(header in sequence['id']):
+                yield sequence
         else:
             # test description for predefined headers
             if(any(description in sequence['description'].lower() for description in description_headers)):
-                filtered_sequences.append(sequence)
-
-    return filtered_sequences
-
-
-def filter_longest(plasmids):
-    log.info('Discard %d longest sequences from %d entries', cfg.discard_longest, len(plasmids))
-    cfg.verbose_print(f'Discard {cfg.discard_longest} longest sequences from {len(plasmids)} entries')
+                yield sequence
+
+
+def filter_longest(plasmids, discard_longest):
+    """Discard the n longest sequences, only keeping the n longest sequences seen so far besides all shorter candidates."""
+    longest = []  # min-heap of the n longest sequences seen so far, among equal lengths earlier sequences count as longer
+    filtered_plasmids = []
+    count = 0
+    for index, plasmid in enumerate(plasmids):
+        count += 1
+        entry = (plasmid['length'], -index, plasmid)
+        if(len(longest) < discard_longest):
+            heapq.heappush(longest, entry)
+        elif(discard_longest > 0 and entry[:2] > longest[0][:2]):
+            filtered_plasmids.append(heapq.heapreplace(longest, entry))
+        else:
+            filtered_plasmids.append(entry)
+    log.info('Discard %d longest sequences from %d entries', discard_longest, count)
 
     # Error if discard too high
-    if(cfg.discard_longest > len(plasmids)):
-        log.error('Can not discard %d sequences from %d present!', cfg.discard_longest, len(plasmids))
-        sys.exit('ERROR: Can not discard more sequences than present!')
-    
-    # sort dict entries by length and discard longest
-    filtered_plasmids = sorted(plasmids, key=lambda x: x['length'], reverse=True)[cfg.discard_longest:]
-
-    return filtered_plasmids
+    if(discard_longest > count):
+        log.error('Can not discard %d sequences from %d present!', discard_longest, count)
+        raise ValueError('Can not discard more sequences than present!')
+
+    # sort entries by length and original order
+    filtered_plasmids.sort(key=lambda entry: entry[:2], reverse=True)
+    return [plasmid for length, index, plasmid in filtered_plasmids]
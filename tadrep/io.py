@@ -1,37 +1,211 @@
 import logging
 import json
+import os
+import uuid
 
 from Bio import SeqIO
 from xopen import xopen
 
+import tadrep.sequence as tsq
+import tadrep.store as ts
+
 
 log = logging.getLogger('IO')
 
 
 FASTA_LINE_WRAPPING = 60
+DB_JSON = 'db.json'
+DB_STORE = 'db.sqlite'
+FASTA_PARSER = 'native'
+FASTA_CHUNK_SIZE = 1 << 20
+
+UPPER_CASE = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyz', b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
 
 
-def import_sequences(contigs_path, sequence=False):
+def import_sequences(contigs_path, sequence=False, parser=FASTA_PARSER, threads=0):
     """Import sequences."""
     contigs = {}
-    with xopen(str(contigs_path), threads=0) as fh:
+    for contig in iter_sequences(contigs_path, sequence=sequence, parser=parser, threads=threads):
+        contigs[contig['id']] = contig
+    return contigs
+
+
+def iter_sequences(contigs_path, sequence=True, parser=FASTA_PARSER, threads=0):
+    """Lazily import sequences one at a time.
+
+    Sequences are parsed either by the native bytes-level parser (default) or by Biopython.
+    Compressed files are decompressed by xopen using the given number of threads, e.g. via pigz/igzip.
+    """
+    if(parser == 'native'):
+        records = parse_fasta(contigs_path, threads)
+    elif(parser == 'biopython'):
+        records = parse_fasta_biopython(contigs_path, threads)
+    else:
+        raise ValueError(f'Unknown Fasta parser: {parser}')
+    for title, seq in records:
+        original_id = title.split(None, 1)[0] if title else ''
+        contig = {
+            'id': f"{contigs_path.stem}-{original_id}",
+            'original-id': original_id,
+            'description': title.split(' ', maxsplit=1)[1] if ' ' in title else '',
+            'sequence': seq if sequence else None,
+            'length': len(seq)
+        }
+        log.debug(
+            'imported: id=%s, length=%i, description=%s',
+            contig['id'], contig['length'], contig['description']
+        )
+        yield contig
+
+
+def parse_fasta(contigs_path, threads=0):
+    """Parse Fasta records in large binary chunks, yielding (title, sequence) tuples of upper case sequences."""
+    title = None
+    lines = []
+    rest = b''
+    with xopen(str(contigs_path), 'rb', threads=threads) as fh:
+        while True:
+            chunk = fh.read(FASTA_CHUNK_SIZE)
+            if(chunk):
+                data = rest + chunk
+                last_newline = data.rfind(b'\n')
+                if(last_newline == -1):  # no complete line yet
+                    rest = data
+                    continue
+                data, rest = data[:last_newline + 1], data[last_newline + 1:]
+            else:  # last line without trailing newline
+                data, rest = rest + b'\n' if rest else b'', b''
+
+            position = 0  # data consists of complete lines only
+            while(position < len(data)):
+                if(data.startswith(b'>', position)):
+                    end = data.find(b'\n', position) + 1
+                    if(title is not None):
+                        yield title, join_sequence(lines)
+                    title = data[position + 1:end].decode().rstrip()
+                    lines = []
+                else:
+                    header = data.find(b'\n>', position)
+                    end = len(data) if header == -1 else header + 1
+                    if(title is not None):
+                        lines.append(data[position:end])
+                    elif(data[position:end].strip()):
+                        raise ValueError(f'Sequence data before first header in {contigs_path}')
+                position = end
+            if(not chunk):
+                break
+    if(title is not None):
+        yield title, join_sequence(lines)
+
+
+def join_sequence(lines):
+    """Join raw sequence lines, remove whitespace and convert to upper case in a single pass."""
+    return b''.join(lines).translate(UPPER_CASE, b' \t\r\n').decode()
+
+
+def parse_fasta_biopython(contigs_path, threads=0):
+    """Parse Fasta records via Biopython, yielding (title, sequence) tuples of upper case sequences."""
+    with xopen(str(contigs_path), threads=threads) as fh:
         for record in SeqIO.parse(fh, 'fasta'):
-            seq = str(record.seq).upper()
-            contig = {
-                'id': f"{contigs_path.stem}-{record.id}",
-                'original-id': record.id,
-                'description': record.description.split(' ', maxsplit=1)[1] if ' ' in record.description else '',
-                'sequence': seq if sequence else None,
-                'length': len(seq)
-            }
-            log.info(
-                'imported: id=%s, length=%i, description=%s',
-                contig['id'], contig['length'], contig['description']
-            )
-            contigs[contig['id']] = contig
+            yield record.description, str(record.seq).upper()
+
+
+def index_sequences(contigs_path):
+    """Index sequences without loading them.
+
+    For uncompressed files with regular line lengths, byte offsets are stored per sequence (faidx-style)
+    to fetch sequences via random access. Otherwise, sequences are fetched by streaming the file.
+    """
+    if(is_compressed(contigs_path)):
+        contigs = import_sequences(contigs_path, sequence=False)
+        for contig in contigs.values():
+            contig['offset'] = None
+        return contigs
+
+    contigs = {}
+    contig = None
+    regular = True  # all sequence lines except the last one have equal lengths
+    last_line_bases = None
+    with contigs_path.open('rb') as fh:
+        offset = 0
+        for line in fh:
+            line_bytes = len(line)
+            if(line.startswith(b'>')):
+                title = line[1:].decode().rstrip()
+                original_id = title.split(None, 1)[0] if title else ''
+                contig = {
+                    'id': f"{contigs_path.stem}-{original_id}",
+                    'original-id': original_id,
+                    'description': title.split(' ', maxsplit=1)[1] if ' ' in title else '',
+                    'sequence': None,
+                    'length': 0,
+                    'offset': offset + line_bytes,
+                    'line_bases': 0,
+                    'line_bytes': 0
+                }
+                contigs[contig['id']] = contig
+                last_line_bases = None
+            elif(contig is None):
+                if(line.strip()):
+                    raise ValueError(f'Sequence data before first header in {contigs_path}')
+            else:
+                bases = line.rstrip()
+                line_bases = len(bases)
+                if(line_bases > 0):
+                    if(last_line_bases is not None and last_line_bases != contig['line_bases']):  # shorter or empty line followed by further sequence lines
+                        regular = False
+                    if(contig['line_bases'] == 0):
+                        contig['line_bases'] = line_bases
+                        contig['line_bytes'] = line_bytes
+                    elif(line_bases > contig['line_bases'] or line_bytes - line_bases != contig['line_bytes'] - contig['line_bases']):
+                        regular = False
+                    if(b' ' in bases or b'\t' in bases):  # inner whitespace is not part of the sequence
+                        regular = False
+                        line_bases = len(bases.translate(None, b' \t'))
+                    contig['length'] += line_bases
+                last_line_bases = line_bases
+            offset += line_bytes
+
+    if(not regular):
+        log.debug('irregular line lengths, no random access: path=%s', contigs_path)
+        for contig in contigs.values():
+            contig['offset'] = None
+    for contig in contigs.values():
+        log.debug('indexed: id=%s, length=%i, offset=%s', contig['id'], contig['length'], contig['offset'])
     return contigs
 
 
+def fetch_sequences(contigs_path, contigs, contig_ids=None):
+    """Lazily fetch sequences of indexed contigs, either all or only selected ones, yielding (id, sequence) tuples."""
+    if(contig_ids is None):
+        contig_ids = set(contigs.keys())
+    if(len(contig_ids) == 0):
+        return
+    if(any(contigs[contig_id]['offset'] is None for contig_id in contig_ids)):  # stream sequences
+        for contig in iter_sequences(contigs_path, sequence=True):
+            if(contig['id'] in contig_ids):
+                yield contig['id'], contig['sequence']
+        return
+
+    with contigs_path.open('rb') as fh:
+        for contig_id in sorted(contig_ids, key=lambda k: contigs[k]['offset']):
+            contig = contigs[contig_id]
+            if(contig['length'] == 0):
+                yield contig_id, ''
+                continue
+            full_lines, remaining_bases = divmod(contig['length'], contig['line_bases'])
+            fh.seek(contig['offset'])
+            data = fh.read(full_lines * contig['line_bytes'] + remaining_bases)
+            sequence = data.translate(None, b' \t\r\n').decode().upper()
+            yield contig_id, sequence
+
+
+def is_compressed(file_path):
+    with file_path.open('rb') as fh:
+        magic = fh.read(6)
+    return magic.startswith(b'\x1f\x8b') or magic.startswith(b'BZh') or magic.startswith(b'\xfd7zXZ\x00') or magic.startswith(b'\x28\xb5\x2f\xfd')
+
+
 def export_sequences(contigs, fasta_path, description=False, wrap=False):
     """Write sequences to Fasta file."""
     log.debug('write: path=%s, description=%s, wrap=%s', fasta_path, description, wrap)
@@ -42,17 +216,28 @@ def export_sequences(contigs, fasta_path, description=False, wrap=False):
             else:
                 fh.write(f">{contig['id']}\n")
             if(wrap):
-                fh.write(wrap_sequence(contig['sequence']))
+                tsq.write_wrapped(fh, contig['sequence'], FASTA_LINE_WRAPPING)
             else:
                 fh.write(contig['sequence'])
                 fh.write('\n')
 
 
-def wrap_sequence(sequence):
-    lines = []
-    for i in range(0, len(sequence), FASTA_LINE_WRAPPING):
-        lines.append(sequence[i:i + FASTA_LINE_WRAPPING])
-    return '\n'.join(lines) + '\n'
+def export_sequences_bgzf(writer, contigs, fai_lines, description=False):
+    """Append sequences wrapped to a BGZF Fasta file and collect .fai index lines of uncompressed offsets."""
+    for contig in contigs:
+        if(description):
+            writer.write(f">{contig['id']} {contig['description']}\n")
+        else:
+            writer.write(f">{contig['id']}\n")
+        offset = writer.tell()
+        tsq.write_wrapped(writer, contig['sequence'], FASTA_LINE_WRAPPING)
+        line_bases = min(len(contig['sequence']), FASTA_LINE_WRAPPING)
+        fai_lines.append(f"{contig['id']}\t{len(contig['sequence'])}\t{offset}\t{line_bases}\t{line_bases + 1}\n")
+
+
+def export_fai(fai_lines, fasta_path):
+    with fasta_path.with_name(f'{fasta_path.name}.fai').open('w') as fh:
+        fh.writelines(fai_lines)
 
 
 def import_tsv(database_path):
@@ -80,9 +265,14 @@ def import_json(json_path):
 
 
 def export_json(data, json_path):
+    """Write data atomically to a JSON file via a temporary file replacing the former file."""
     log.info('write json: path=%s, # sequences=%i', json_path, len(data))
-    with open(json_path, 'w') as fh:
+    tmp_path = json_path.with_name(f'{json_path.name}.tmp')
+    with open(tmp_path, 'w') as fh:
         json.dump(data, fh, indent=4)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, json_path)
 
 
 def load_data(json_path):
@@ -92,4 +282,132 @@ def load_data(json_path):
     else:
         log.debug('%s NOT existing', json_path)
         plasmid_dict = {}
+    replay_journal(plasmid_dict, get_journal_path(json_path))
     return plasmid_dict
+
+
+def get_journal_path(json_path):
+    return json_path.with_name(f'{json_path.name}.journal')
+
+
+def replay_journal(data, journal_path):
+    """Apply all completely written journal entries to data.
+
+    Each newline-terminated line of the journal is a single entry of changes written by one update.
+    An unterminated last line of an interrupted update is ignored, as are entries of another journal id than data,
+    i.e. of a journal left behind by an interrupted export already containing its changes.
+    """
+    if(not journal_path.is_file()):
+        return
+    with journal_path.open('rb') as fh:
+        *lines, incomplete_line = fh.read().split(b'\n')
+    if(len(incomplete_line) > 0):
+        log.warning('ignore incomplete journal entry: path=%s, line=%i', journal_path, len(lines) + 1)
+    replayed_entries = 0
+    for line_number, line in enumerate(lines):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            raise ValueError(f'Corrupt journal entry in {journal_path}, line {line_number + 1}')
+        if(entry.get('journal_id', None) != data.get('journal_id', None)):
+            continue
+        for change in entry['changes']:
+            apply_change(data, change)
+        replayed_entries += 1
+    if(replayed_entries < len(lines)):
+        log.warning('ignore stale journal entries: path=%s, # entries=%i', journal_path, len(lines) - replayed_entries)
+    log.info('replayed journal: path=%s, # entries=%i', journal_path, replayed_entries)
+
+
+def apply_change(data, change):
+    *keys, last_key = change['path']
+    for key in keys:
+        data = data[key]
+    if(change.get('deleted', False)):
+        if(isinstance(data, dict)):
+            data.pop(last_key, None)
+    else:
+        data[last_key] = change['value']
+
+
+def get_db_path(output_path):
+    """Return the path of the plasmid database within an output directory, preferring a binary store over JSON."""
+    store_path = output_path.joinpath(DB_STORE)
+    return store_path if store_path.is_file() else output_path.joinpath(DB_JSON)
+
+
+def load_db(db_path):
+    """Load a plasmid database either from JSON or lazily from a binary store."""
+    if(db_path.suffix == '.sqlite'):
+        return ts.load_store(db_path)
+    return load_data(db_path)
+
+
+def export_db(db_data, db_path):
+    """Write a plasmid database entirely either to JSON or to a binary store.
+
+    A JSON database gets a new journal id, so that entries of a former journal not yet removed are not replayed.
+    """
+    if(db_path.suffix == '.sqlite'):
+        ts.export_store(db_data, db_path)
+    else:
+        db_data['journal_id'] = uuid.uuid4().hex
+        if(isinstance(db_data.get('plasmids', None), ts.PlasmidStore)):  # materialize lazily loaded plasmids
+            db_data = {**db_data, 'plasmids': {id: dict(plasmid) for id, plasmid in db_data['plasmids'].items()}}
+        export_json(db_data, db_path)
+        journal_path = get_journal_path(db_path)
+        if(journal_path.is_file()):  # all changes are contained in the new file
+            journal_path.unlink()
+
+
+def update_db(db_data, db_path, changes):
+    """Write changed parts of a plasmid database.
+
+    Changes are key paths into the database, e.g. ('plasmids', id), ('clusters',) or ('clusters', 0, 'found_in').
+    Missing keys are recorded as deletions. For JSON databases, all changes are appended as a single entry to a journal
+    replayed by load_data if its journal id matches the database. Binary stores write only the changed plasmids, clusters and metadata within a single transaction.
+    """
+    if(db_path.suffix == '.sqlite'):
+        ts.update_store(db_data, db_path, changes)
+        return
+    if(not db_path.is_file()):  # new database
+        export_db(db_data, db_path)
+        return
+
+    entry = []
+    for path in changes:
+        value = db_data
+        try:
+            for key in path:
+                value = value[key]
+            entry.append({'path': list(path), 'value': dict(value) if isinstance(value, ts.StoredPlasmid) else value})
+        except (KeyError, IndexError):
+            entry.append({'path': list(path), 'deleted': True})
+    journal_path = get_journal_path(db_path)
+    truncate_journal(journal_path)
+    with journal_path.open('ab') as fh:
+        fh.write(json.dumps({'journal_id': db_data.get('journal_id', None), 'changes': entry}).encode() + b'\n')
+        fh.flush()
+        os.fsync(fh.fileno())
+    log.info('journaled changes: path=%s, # changes=%i', journal_path, len(entry))
+
+
+def truncate_journal(journal_path):
+    """Remove an incomplete last entry of an interrupted update so that new entries start on a new line."""
+    if(not journal_path.is_file() or journal_path.stat().st_size == 0):
+        return
+    with journal_path.open('rb+') as fh:
+        fh.seek(-1, os.SEEK_END)
+        if(fh.read(1) != b'\n'):
+            fh.seek(0)
+            size = fh.read().rfind(b'\n') + 1
+            fh.truncate(size)
+            log.warning('truncated incomplete journal entry: path=%s, size=%i', journal_path, size)
+
+
+def compact_db(db_path):
+    """Merge the journal into a JSON database or reclaim unused space of a binary store."""
+    if(db_path.suffix == '.sqlite'):
+        ts.compact_store(db_path)
+    else:
+        export_db(load_data(db_path), db_path)
@@ -59,7 +59,12 @@ def main():
 
     if(args.subcommand == 'database'):
         cfg.setup_database(args)
-        dm.create_database()
+        if(cfg.db_format):
+            dm.convert_database()
+        elif(cfg.db_compact):
+            dm.compact_database()
+        else:
+            dm.create_database()
 
     if(args.subcommand == 'setup'):
         print('\nSetup started...')
@@ -1,8 +1,9 @@
 import logging
 
-from Bio.Seq import Seq
+import numpy as np
 
 import tadrep.config as cfg
+import tadrep.sequence as tsq
 
 
 log = logging.getLogger('PLASMIDS')
@@ -35,32 +36,46 @@ def detect_reference_plasmids(sample, filtered_hits, reference_plasmids):
 def reconstruct_plasmid(plasmid, contigs):
     log.debug('reconstruct plasmid: genome=%s, id=%s, # contigs=%i', plasmid['genome'], plasmid['id'], len(plasmid['hits']))
     plasmid['hits'] = sorted(plasmid['hits'], key=lambda k: k['reference_plasmid_start'])
-    sorted_plasmid_contigs = []
-    sorted_plasmid_contig_sequences = []
-    for hit in plasmid['hits']:
-        contig = contigs[hit['contig_id']]
-        sorted_plasmid_contigs.append(contig)
-        sorted_plasmid_contig_sequences.append(contig['sequence'] if hit['strand'] == '+' else str(Seq(contig['sequence']).reverse_complement()))
+    sorted_plasmid_contigs = [contigs[hit['contig_id']] for hit in plasmid['hits']]
 
     gap_sequence = 'N' * cfg.gap_sequence_length
-    plasmid['sequence'] = gap_sequence.join(sorted_plasmid_contig_sequences)
+    plasmid['sequence'] = tsq.join_sequences(((contig['sequence'], hit['strand']) for contig, hit in zip(sorted_plasmid_contigs, plasmid['hits'])), gap_sequence)
     plasmid['description'] = f"reference={plasmid['id']} contigs={len(plasmid['hits'])} coverage={plasmid['coverage']:.3f} identity={plasmid['identity']:.3f}"
     log.info('plasmid reconstructed: genome=%s, id=%s, length=%s, description=%s', plasmid['genome'], plasmid['id'], len(plasmid['sequence']), plasmid['description'])
     return sorted_plasmid_contigs
 
 
 def calc_coverage(plasmid, hits):
-    cov_array = [0 for i in range(0,plasmid['length'])]
-    for hit in hits:
-        for i in range(hit['reference_plasmid_start']-1, hit['reference_plasmid_end']):
-            cov_array[i] += 1
-    uncovered_bp = cov_array.count(0)
-    covered_bp = plasmid['length'] - uncovered_bp
+    """Calculate the plasmid coverage as the union of all hit intervals."""
+    intervals = sorted((hit['reference_plasmid_start'], hit['reference_plasmid_end']) for hit in hits if hit['reference_plasmid_start'] <= hit['reference_plasmid_end'])
+    covered_bp = 0
+    current_start, current_end = None, None
+    for start, end in intervals:
+        if(current_end is not None and start <= current_end + 1):  # overlapping or adjacent interval
+            if(end > current_end):
+                current_end = end
+        else:
+            if(current_end is not None):
+                covered_bp += current_end - current_start + 1
+            current_start, current_end = start, end
+    if(current_end is not None):
+        covered_bp += current_end - current_start + 1
+    uncovered_bp = plasmid['length'] - covered_bp
     coverage = covered_bp / plasmid['length']
     log.debug("coverage: cov=%.3f, covered-bp=%i, uncovered-bp=%i", coverage, covered_bp, uncovered_bp)
     return coverage, covered_bp, uncovered_bp
 
 
+def calc_depth(plasmid, hits):
+    """Calculate the per-base hit depth along a plasmid via a difference array."""
+    diff = np.zeros(plasmid['length'] + 1, dtype=np.int32)
+    for hit in hits:
+        if(hit['reference_plasmid_start'] <= hit['reference_plasmid_end']):
+            diff[hit['reference_plasmid_start'] - 1] += 1
+            diff[hit['reference_plasmid_end']] -= 1
+    return np.cumsum(diff[:-1], dtype=np.int32)
+
+
 def calc_identity(hits):
     sum_num_identity = sum([hit['num_identity'] for hit in hits])
     sum_hit_alignment = sum([hit['length'] for hit in hits])
@@ -0,0 +1,219 @@
+import logging
+import math
+
+import numpy as np
+
+import tadrep.sketch as tsk
+
+
+log = logging.getLogger('REPLICON')
+
+
+KMER_SIZE = 16
+MIN_IDENTITY = 0.9
+MATCH_SCORE = 1  # blastn megablast scoring
+MISMATCH_SCORE = -2
+LAMBDA = 1.28  # Karlin-Altschul parameters of the megablast scoring
+K = 0.46
+MAX_GAP = 60  # maximal gap between chained ungapped segments on the sequence and reference
+
+
+def build_index(references):
+    """Index all k-mers of (id, sequence) references by their integer encoding, position and reference."""
+    index = {
+        'ids': [],
+        'codes': []
+    }
+    kmers, reference_indices, positions = [], [], []
+    for reference_index, (id, sequence) in enumerate(references):
+        codes = tsk.NUCLEOTIDE_CODES[np.frombuffer(sequence.encode(), dtype=np.uint8)]
+        index['ids'].append(id)
+        index['codes'].append(codes)
+        if(len(codes) < KMER_SIZE):
+            continue
+        forward, reverse, valid = tsk.calc_kmers(codes, KMER_SIZE)
+        kmer_positions = np.flatnonzero(valid)
+        kmers.append(forward[kmer_positions])
+        reference_indices.append(np.full(len(kmer_positions), reference_index, dtype=np.int64))
+        positions.append(kmer_positions)
+    if(len(kmers) == 0):
+        kmers, reference_indices, positions = [np.zeros(0, dtype=np.uint64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    kmers = np.concatenate(kmers)
+    order = np.argsort(kmers, kind='stable')
+    index['kmers'] = kmers[order]
+    index['references'] = np.concatenate(reference_indices)[order]
+    index['positions'] = np.concatenate(positions)[order]
+    log.info('built index: # references=%i, # k-mers=%i', len(index['ids']), len(index['kmers']))
+    return index
+
+
+def search_sequence(index, sequence):
+    """Search a sequence for indexed references.
+
+    Exact k-mer seeds of both strands are grouped by reference and diagonal. Each diagonal is verified by an
+    ungapped alignment of the reference, trimmed to its maximal scoring segment. Colinear segments of a reference
+    separated by small gaps, e.g. by indels, are chained into a single alignment before its identity is checked,
+    approximating a gapped blastn alignment. Alignments of the same reference are culled by overlap on the reference
+    as by blastn (-culling_limit 1) with references as queries, and the coverage of each reference is the union
+    of all its retained alignments as by blastn (qcovs). Returns (reference id, hit) tuples with 1-based coordinates
+    and start > end on the minus strand as by blastn.
+    """
+    codes = tsk.NUCLEOTIDE_CODES[np.frombuffer(sequence.encode(), dtype=np.uint8)]
+    length = len(codes)
+    if(length < KMER_SIZE or len(index['kmers']) == 0):
+        return []
+    forward, reverse, valid = tsk.calc_kmers(codes, KMER_SIZE)
+    kmer_positions = np.flatnonzero(valid)
+    reverse_codes = np.where(codes < 4, 3 - codes, codes)[::-1]
+
+    alignments = []
+    for strand, kmers, strand_codes, seed_positions in [
+        ('+', forward[kmer_positions], codes, kmer_positions),
+        ('-', reverse[kmer_positions], reverse_codes, length - KMER_SIZE - kmer_positions)  # positions on the reverse complement
+    ]:
+        segments_per_reference = {}
+        for reference_index, diagonal in find_diagonals(index, kmers, seed_positions):
+            segment = align_diagonal(index['codes'][reference_index], strand_codes, diagonal)
+            if(segment is not None):
+                segments_per_reference.setdefault(reference_index, []).append((*segment, diagonal))
+        for reference_index, segments in segments_per_reference.items():
+            for start, end, reference_start, reference_end, matches in chain_segments(segments):  # 0-based, end exclusive positions on the strand sequence and reference
+                alignment_length = max(end - start, reference_end - reference_start)  # gaps count as alignment columns
+                identity = matches / alignment_length
+                if(identity < MIN_IDENTITY):
+                    continue
+                score = MATCH_SCORE * matches + MISMATCH_SCORE * (alignment_length - matches)
+                if(strand == '+'):
+                    hit_start, hit_end = start + 1, end
+                else:
+                    hit_start, hit_end = length - start, length - end + 1
+                hit = {
+                    'start': hit_start,
+                    'end': hit_end,
+                    'strand': strand,
+                    'identity': identity,
+                    'coverage': 0.0,
+                    'bitscore': int((LAMBDA * score - math.log(K)) / math.log(2))
+                }
+                alignments.append((reference_index, reference_start, reference_end - reference_start, score, hit))
+
+    alignments = cull_alignments(alignments)
+    reference_ranges = {}
+    for reference_index, reference_start, reference_length, score, hit in alignments:
+        reference_ranges.setdefault(reference_index, []).append((reference_start, reference_start + reference_length))
+    hits = []
+    for reference_index, reference_start, reference_length, score, hit in alignments:
+        hit['coverage'] = calc_union_length(reference_ranges[reference_index]) / len(index['codes'][reference_index])
+        hits.append((index['ids'][reference_index], hit))
+    return hits
+
+
+def chain_segments(segments):
+    """Chain (start, end, matches, score, diagonal) segments of a single reference and strand into colinear alignments.
+
+    A segment extends a chain if it starts after the chain on both the sequence and the reference, within MAX_GAP
+    positions of the chain end on both. Positions overlapping the chain end are not counted twice as matches.
+    Returns (start, end, reference start, reference end, matches) tuples.
+    """
+    chains = []
+    for start, end, matches, score, diagonal in sorted(segments):
+        reference_start, reference_end = start - diagonal, end - diagonal
+        extended_chains = [
+            chain for chain in chains
+            if(start > chain[0] and reference_start > chain[2] and abs(start - chain[1]) <= MAX_GAP and abs(reference_start - chain[3]) <= MAX_GAP)
+        ]
+        if(len(extended_chains) == 0):
+            chains.append([start, end, reference_start, reference_end, matches])
+            continue
+        chain = max(extended_chains, key=lambda k: k[4])
+        overlap = max(chain[1] - start, chain[3] - reference_start, 0)
+        chain[1] = max(chain[1], end)
+        chain[3] = max(chain[3], reference_end)
+        chain[4] += max(matches - overlap, 0)
+    return [tuple(chain) for chain in chains]
+
+
+def cull_alignments(alignments):
+    """Discard (reference index, reference start, reference length, score, hit) alignments dominated by an overlapping
+    better alignment of the same reference.
+
+    As blastn searches references as queries, alignments are culled per reference by their ranges on the reference.
+    Alignments are processed by descending score, following the Blast+ culling criterion: an alignment can only be
+    dominated if at least half of its range overlaps the dominating alignment, domination is then decided by
+    a weighted criterion of relative score (2x) and range length (1x) differences.
+    """
+    alignments_per_reference = {}
+    for alignment in alignments:
+        alignments_per_reference.setdefault(alignment[0], []).append(alignment)
+
+    retained_alignments = []
+    for reference_index in sorted(alignments_per_reference.keys()):
+        retained_reference_alignments = []
+        for alignment in sorted(alignments_per_reference[reference_index], key=lambda k: (-k[3], k[1], k[4]['start'])):
+            if(any(dominates(retained_alignment, alignment) for retained_alignment in retained_reference_alignments)):
+                continue
+            retained_reference_alignments = [retained_alignment for retained_alignment in retained_reference_alignments if not dominates(alignment, retained_alignment)]
+            retained_reference_alignments.append(alignment)
+        retained_alignments.extend(retained_reference_alignments)
+    return retained_alignments
+
+
+def dominates(alignment_a, alignment_b):
+    begin_a, length_a, score_a, hit_a = alignment_a[1:]
+    begin_b, length_b, score_b, hit_b = alignment_b[1:]
+    overlap = min(begin_a + length_a, begin_b + length_b) - max(begin_a, begin_b)
+    if(2 * overlap < length_b):
+        return False
+    d = 4 * score_a * length_a + 2 * score_a * length_b - 2 * score_b * length_a - 4 * score_b * length_b
+    if((score_a == score_b and begin_a == begin_b and length_a == length_b) or d == 0):  # tie breakers
+        if(score_a != score_b):
+            return score_a > score_b
+        return hit_a['start'] < hit_b['start']
+    return d > 0
+
+
+def calc_union_length(ranges):
+    """Return the number of positions covered by the union of 0-based, end exclusive ranges."""
+    union_length, union_end = 0, 0
+    for start, end in sorted(ranges):
+        if(end > union_end):
+            union_length += end - max(start, union_end)
+            union_end = end
+    return union_length
+
+
+def find_diagonals(index, kmers, seed_positions):
+    """Look up k-mers in the index and return distinct (reference, diagonal) pairs of all seeds."""
+    left = np.searchsorted(index['kmers'], kmers, side='left')
+    right = np.searchsorted(index['kmers'], kmers, side='right')
+    counts = right - left
+    matched = counts > 0
+    if(not matched.any()):
+        return []
+    counts, left, seed_positions = counts[matched], left[matched], seed_positions[matched]
+    preceding = np.cumsum(counts) - counts
+    entries = np.arange(counts.sum()) - np.repeat(preceding, counts) + np.repeat(left, counts)  # all index entries per seed
+    diagonals = np.repeat(seed_positions, counts) - index['positions'][entries]
+    pairs = np.unique(np.stack([index['references'][entries], diagonals], axis=1), axis=0)
+    return pairs.tolist()
+
+
+def align_diagonal(reference_codes, codes, diagonal):
+    """Align a reference without gaps at a diagonal of a sequence and return its maximal scoring segment."""
+    reference_start = max(0, -diagonal)
+    reference_end = min(len(reference_codes), len(codes) - diagonal)
+    if(reference_end <= reference_start):
+        return None
+    reference = reference_codes[reference_start:reference_end]
+    matches = (reference == codes[reference_start + diagonal:reference_end + diagonal]) & (reference < 4)
+    scores = np.where(matches, MATCH_SCORE, MISMATCH_SCORE)
+    cumulative_scores = np.concatenate(([0], np.cumsum(scores)))
+    minimal_scores = np.minimum.accumulate(cumulative_scores)
+    segment_end = int(np.argmax(cumulative_scores - minimal_scores))
+    score = int(cumulative_scores[segment_end] - minimal_scores[segment_end])
+    if(score <= 0):
+        return None
+    segment_start = int(np.argmin(cumulative_scores[:segment_end + 1]))
+    segment_matches = int(matches[segment_start:segment_end].sum())
+    offset = reference_start + diagonal
+    return segment_start + offset, segment_end + offset, segment_matches, score
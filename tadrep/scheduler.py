@@ -0,0 +1,89 @@
+import logging
+import resource
+import threading
+import time
+
+
+log = logging.getLogger('SCHEDULER')
+
+
+# global core budget shared by all concurrent jobs
+condition = threading.Condition()
+total_cores = 0
+free_cores = 0
+pending_size = 0
+
+# utilization statistics
+allocated_core_seconds = 0.0
+start_time = None
+start_cpu_time = None
+
+
+def setup(cores, job_sizes):
+    """Setup a global core budget for a set of jobs with given sizes, e.g. genome file sizes."""
+    global total_cores, free_cores, pending_size, allocated_core_seconds, start_time, start_cpu_time
+    total_cores = cores
+    free_cores = cores
+    pending_size = sum(max(job_size, 1) for job_size in job_sizes)
+    allocated_core_seconds = 0.0
+    start_time = time.monotonic()
+    start_cpu_time = get_cpu_time()
+    log.info('setup: cores=%i, # jobs=%i, total-size=%i', total_cores, len(job_sizes), pending_size)
+
+
+def acquire_cores(job_size):
+    """Block until cores are available and assign a share of all free cores proportional to the job size.
+
+    Free cores are distributed across all jobs not yet started.
+    Hence, large jobs receive more cores and as the queue drains, the remaining jobs receive all idle cores.
+    Shares are only balanced when a job starts: running jobs keep their cores until they finish,
+    so a long job started early does not give up cores to later jobs, nor receive cores released by them.
+    """
+    global free_cores, pending_size
+    job_size = max(job_size, 1)
+    with condition:
+        while(free_cores == 0):
+            condition.wait()
+        cores = round(free_cores * job_size / pending_size) if pending_size > job_size else free_cores
+        cores = min(max(cores, 1), free_cores)
+        free_cores -= cores
+        pending_size = max(pending_size - job_size, 0)
+        log.debug('acquired: cores=%i, job-size=%i, free-cores=%i, pending-size=%i', cores, job_size, free_cores, pending_size)
+    return cores, time.monotonic()
+
+
+def release_cores(cores, acquire_time):
+    """Return cores to the global budget and account for their usage."""
+    global free_cores, allocated_core_seconds
+    with condition:
+        free_cores += cores
+        allocated_core_seconds += cores * (time.monotonic() - acquire_time)
+        log.debug('released: cores=%i, free-cores=%i', cores, free_cores)
+        condition.notify_all()
+
+
+def get_cpu_time():
+    """Return the CPU time of this process and all terminated child processes, e.g. blastn."""
+    cpu_time = 0.0
+    for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]:
+        usage = resource.getrusage(who)
+        cpu_time += usage.ru_utime + usage.ru_stime
+    return cpu_time
+
+
+def get_utilization():
+    """Return wall time, consumed CPU time, CPU utilization and core allocation ratio of the core budget."""
+    wall_time = time.monotonic() - start_time
+    cpu_time = get_cpu_time() - start_cpu_time
+    budget = wall_time * total_cores if wall_time > 0 else 1.0
+    utilization = {
+        'wall_time': wall_time,
+        'cpu_time': cpu_time,
+        'cpu_utilization': cpu_time / budget,
+        'allocation': allocated_core_seconds / budget
+    }
+    log.info(
+        'utilization: cores=%i, wall-time=%.1f s, cpu-time=%.1f s, cpu-utilization=%.3f, allocation=%.3f',
+        total_cores, utilization['wall_time'], utilization['cpu_time'], utilization['cpu_utilization'], utilization['allocation']
+    )
+    return utilization
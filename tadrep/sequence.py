@@ -0,0 +1,58 @@
+import hashlib
+import logging
+
+
+log = logging.getLogger('SEQUENCE')
+
+
+LINE_LENGTH = 60
+CHUNK_LINES = 1024
+
+COMPLEMENT = bytes.maketrans(  # IUPAC nucleotide complements as by Biopython, all other characters are kept
+    b'ACGTUMRWSYKVHDBNacgtumrwsykvhdbn',
+    b'TGCAAKYWSRMBDHVNtgcaakywsrmbdhvn'
+)
+
+
+def reverse_complement(sequence):
+    """Reverse complement a nucleotide sequence."""
+    return reverse_complement_bytes(sequence.encode()).decode()
+
+
+def reverse_complement_bytes(sequence):
+    complement = sequence.translate(COMPLEMENT)
+    return complement[::-1]
+
+
+def calc_canonical_hash(sequence):
+    """Hash the lexicographically smaller of both strands, so that a sequence and its reverse complement share a hash."""
+    forward = sequence.encode()
+    reverse = reverse_complement_bytes(forward)
+    return hashlib.sha256(min(forward, reverse)).hexdigest()
+
+
+def join_sequences(segments, separator=''):
+    """Join (sequence, strand) segments into a single sequence, reverse complementing minus strand segments.
+
+    Segments are appended to a single buffer, so only the joined sequence and a single segment are held in memory at once.
+    """
+    buffer = bytearray()
+    separator = separator.encode()
+    for index, (sequence, strand) in enumerate(segments):
+        if(index > 0):
+            buffer += separator
+        sequence = sequence.encode()
+        buffer += sequence if strand == '+' else reverse_complement_bytes(sequence)
+    return buffer.decode()
+
+
+def write_wrapped(fh, sequence, line_length=LINE_LENGTH):
+    """Write a sequence in lines of fixed length, streaming chunks of lines. Empty sequences are written as an empty line."""
+    if(len(sequence) == 0):
+        fh.write('\n')
+        return
+    chunk_size = line_length * CHUNK_LINES
+    for chunk_start in range(0, len(sequence), chunk_size):
+        chunk = sequence[chunk_start:chunk_start + chunk_size]
+        fh.write('\n'.join(chunk[i:i + line_length] for i in range(0, len(chunk), line_length)))
+        fh.write('\n')
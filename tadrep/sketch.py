@@ -0,0 +1,111 @@
+import logging
+
+import numpy as np
+
+
+log = logging.getLogger('SKETCH')
+
+
+KMER_SIZE = 16
+SCALED = 200
+CHUNK_SIZE = 1_000_000
+
+NUCLEOTIDE_CODES = np.full(256, 4, dtype=np.uint8)  # 2 bit codes of valid nucleotides, 4 for all other characters
+for code, nucleotides in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+    for nucleotide in nucleotides:
+        NUCLEOTIDE_CODES[ord(nucleotide)] = code
+
+
+def sketch_sequence(sequence, kmer_size=KMER_SIZE, scaled=SCALED):
+    """Compute a FracMinHash sketch, i.e. all distinct canonical k-mer hashes below 2^64 / scaled."""
+    codes = NUCLEOTIDE_CODES[np.frombuffer(sequence.encode(), dtype=np.uint8)]
+    max_hash = np.uint64(np.iinfo(np.uint64).max // scaled)
+    hashes = []
+    for chunk_start in range(0, max(len(codes) - kmer_size + 1, 0), CHUNK_SIZE):  # bound memory usage for large sequences
+        chunk = codes[chunk_start:chunk_start + CHUNK_SIZE + kmer_size - 1]
+        kmers = calc_canonical_kmers(chunk, kmer_size)
+        kmer_hashes = mix_hash(kmers)
+        hashes.append(kmer_hashes[kmer_hashes < max_hash])
+    if(len(hashes) == 0):
+        return np.zeros(0, dtype=np.uint64)
+    return np.unique(np.concatenate(hashes))
+
+
+def sketch_sequences(sequences, kmer_size=KMER_SIZE, scaled=SCALED):
+    """Compute a single FracMinHash sketch of multiple sequences, e.g. all contigs of a genome."""
+    return merge_sketches([sketch_sequence(sequence, kmer_size, scaled) for sequence in sequences])
+
+
+def merge_sketches(sketches):
+    """Merge multiple sketches into a single sketch of distinct hashes."""
+    if(len(sketches) == 0):
+        return np.zeros(0, dtype=np.uint64)
+    return np.unique(np.concatenate(sketches))
+
+
+def calc_canonical_kmers(codes, kmer_size):
+    """Encode all valid k-mers as integers and return the minimum of both strands, skipping k-mers with ambiguous nucleotides."""
+    forward, reverse, valid = calc_kmers(codes, kmer_size)
+    return np.minimum(forward, reverse)[valid]
+
+
+def calc_kmers(codes, kmer_size):
+    """Encode the k-mers at all positions and their reverse complements as integers and flag k-mers without ambiguous nucleotides."""
+    kmer_count = len(codes) - kmer_size + 1
+    valid_codes = (codes & 3).astype(np.uint64)
+    forward = np.zeros(kmer_count, dtype=np.uint64)
+    reverse = np.zeros(kmer_count, dtype=np.uint64)
+    for i in range(kmer_size):
+        window = valid_codes[i:i + kmer_count]
+        forward = (forward << np.uint64(2)) | window
+        reverse = reverse | ((np.uint64(3) - window) << np.uint64(2 * i))
+    invalid = np.concatenate(([0], np.cumsum(codes > 3)))  # count ambiguous nucleotides per k-mer window
+    valid = (invalid[kmer_size:] - invalid[:kmer_count]) == 0
+    return forward, reverse, valid
+
+
+def mix_hash(values):
+    """Scramble integer encoded k-mers with the splitmix64 finalizer."""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xbf58476d1ce4e5b9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+
+def export_sketches(sketches, sketch_path, key):
+    """Store sketches of multiple sequences as concatenated hashes with offsets."""
+    ids = list(sketches.keys())
+    sizes = np.array([len(sketches[id]) for id in ids], dtype=np.int64)
+    hashes = np.concatenate([sketches[id] for id in ids]) if len(ids) > 0 else np.zeros(0, dtype=np.uint64)
+    with sketch_path.open('wb') as fh:
+        np.savez(fh, ids=np.array(ids, dtype=str), sizes=sizes, hashes=hashes, key=np.array(key), kmer_size=KMER_SIZE, scaled=SCALED)
+    log.info('exported sketches: path=%s, # sketches=%i, # hashes=%i', sketch_path, len(ids), len(hashes))
+
+
+def import_sketches(sketch_path, key):
+    """Load stored sketches if they were computed with the current key and parameters, otherwise return None."""
+    if(not sketch_path.is_file()):
+        return None
+    with np.load(sketch_path) as data:
+        if(str(data['key']) != key or int(data['kmer_size']) != KMER_SIZE or int(data['scaled']) != SCALED):
+            log.debug('outdated sketches: path=%s', sketch_path)
+            return None
+        sketches = {
+            'ids': data['ids'].tolist(),
+            'sizes': data['sizes'],
+            'hashes': data['hashes']
+        }
+    log.info('imported sketches: path=%s, # sketches=%i', sketch_path, len(sketches['ids']))
+    return sketches
+
+
+def calc_containment(sketches, query_hashes):
+    """Calculate the containment of each sketched sequence within a query sketch."""
+    sketch_indices = np.repeat(np.arange(len(sketches['ids'])), sketches['sizes'])
+    shared = np.isin(sketches['hashes'], query_hashes, assume_unique=True)
+    shared_counts = np.bincount(sketch_indices[shared], minlength=len(sketches['ids']))
+    containment = np.ones(len(sketches['ids']))  # sequences too short to be sketched are always contained
+    sketched = sketches['sizes'] > 0
+    containment[sketched] = shared_counts[sketched] / sketches['sizes'][sketched]
+    return containment
@@ -0,0 +1,104 @@
+import logging
+
+import numpy as np
+
+import tadrep.sketch as tsk
+
+
+log = logging.getLogger('STATS')
+
+
+WINDOW_SIZE = 1000
+KMER_SIZE = 4
+BATCH_SIZE = 1 << 22  # maximal number of nucleotides per batch
+DECIMALS = 4
+
+CODE_C, CODE_G = 1, 2
+
+
+def calc_statistics(sequences, window_size=WINDOW_SIZE, kmer_size=KMER_SIZE):
+    """Calculate composition statistics of a batch of sequences from a single concatenated array of nucleotide codes.
+
+    Returns a dict per sequence with GC content, GC skew and ambiguous nucleotide (N) content,
+    GC content and skew of consecutive windows and the canonical k-mer profile.
+    """
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    codes = tsk.NUCLEOTIDE_CODES[np.frombuffer(''.join(sequences).encode(), dtype=np.uint8)]
+
+    # prefix sums of nucleotide classes, so that counts of arbitrary ranges are differences of two prefix sums
+    gc_prefix = np.concatenate(([0], np.cumsum((codes == CODE_C) | (codes == CODE_G), dtype=np.int64)))
+    skew_prefix = np.concatenate(([0], np.cumsum((codes == CODE_G).astype(np.int64) - (codes == CODE_C))))
+    n_prefix = np.concatenate(([0], np.cumsum(codes > 3, dtype=np.int64)))
+
+    gc, skew, n = [counts.tolist() for counts in count_ranges(offsets[:-1], offsets[1:], gc_prefix, skew_prefix, n_prefix)]
+
+    # windows of all sequences, the last window of a sequence might be shorter
+    window_counts = -(-lengths // window_size)
+    window_sequences = np.repeat(np.arange(len(sequences)), window_counts)
+    window_starts = offsets[window_sequences] + (np.arange(window_counts.sum()) - np.repeat(np.cumsum(window_counts) - window_counts, window_counts)) * window_size
+    window_ends = np.minimum(window_starts + window_size, offsets[window_sequences + 1])
+    window_gc, window_skew = count_ranges(window_starts, window_ends, gc_prefix, skew_prefix)
+    window_offsets = np.concatenate(([0], np.cumsum(window_counts)))
+
+    # canonical k-mers not spanning two sequences
+    kmer_profiles = np.zeros((len(sequences), 4 ** kmer_size), dtype=np.int64)
+    if(len(codes) >= kmer_size):
+        forward, reverse, valid = tsk.calc_kmers(codes, kmer_size)
+        kmer_sequences = np.repeat(np.arange(len(sequences)), lengths)[:len(valid)]
+        valid &= (np.arange(len(valid)) + kmer_size) <= offsets[kmer_sequences + 1]
+        kmers = np.minimum(forward, reverse)[valid].astype(np.int64)
+        kmer_profiles = np.bincount(kmer_sequences[valid] * 4 ** kmer_size + kmers, minlength=len(sequences) * 4 ** kmer_size).reshape(len(sequences), -1)
+    canonical_kmers = get_canonical_kmers(kmer_size)
+    kmer_profiles = kmer_profiles[:, canonical_kmers]
+    kmer_totals = np.maximum(kmer_profiles.sum(axis=1, keepdims=True), 1)
+    kmer_profiles = np.round(kmer_profiles / kmer_totals, DECIMALS)
+
+    statistics = []
+    for i, length in enumerate(lengths.tolist()):
+        window_range = slice(window_offsets[i], window_offsets[i + 1])
+        statistics.append({
+            'gc_content': gc[i] / float(length) if length > 0 else 0.0,
+            'gc_skew': calc_skew(skew[i], gc[i]),
+            'n_content': n[i] / float(length) if length > 0 else 0.0,
+            'composition': {
+                'window_size': window_size,
+                'gc_windows': np.round(window_gc[window_range] / (window_ends[window_range] - window_starts[window_range]), DECIMALS).tolist(),
+                'gc_skew_windows': np.round(np.divide(window_skew[window_range], window_gc[window_range], out=np.zeros(window_counts[i]), where=window_gc[window_range] > 0), DECIMALS).tolist(),
+                'kmer_size': kmer_size,
+                'kmer_profile': kmer_profiles[i].tolist()
+            }
+        })
+    return statistics
+
+
+def count_ranges(starts, ends, *prefix_sums):
+    """Return counts of ranges for each prefix sum."""
+    return [prefix_sum[ends] - prefix_sum[starts] for prefix_sum in prefix_sums]
+
+
+def calc_skew(skew, gc):
+    """Return the GC skew (G - C) / (G + C) of a difference and sum of G and C counts."""
+    return skew / float(gc) if gc > 0 else 0.0
+
+
+def get_canonical_kmers(kmer_size=KMER_SIZE):
+    """Return integer encodings of all canonical k-mers, i.e. k-mers not larger than their reverse complement, in ascending order."""
+    kmers = np.arange(4 ** kmer_size, dtype=np.int64)
+    reverse = np.zeros_like(kmers)
+    for i in range(kmer_size):
+        reverse = (reverse << 2) | (3 - ((kmers >> (2 * i)) & 3))
+    return kmers[kmers <= reverse]
+
+
+def iter_batches(items, lengths, batch_size=BATCH_SIZE):
+    """Group items into consecutive batches of at most batch_size nucleotides or single larger items."""
+    batch, batch_length = [], 0
+    for item, length in zip(items, lengths):
+        if(len(batch) > 0 and batch_length + length > batch_size):
+            yield batch
+            batch, batch_length = [], 0
+        batch.append(item)
+        batch_length += length
+    if(len(batch) > 0):
+        yield batch
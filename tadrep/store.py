@@ -0,0 +1,313 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+
+from collections.abc import MutableMapping
+
+
+log = logging.getLogger('STORE')
+
+
+SEQUENCE_SUFFIX = '.seq'
+COMPRESSION_LEVEL = 1
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS plasmids (id TEXT PRIMARY KEY, position INTEGER NOT NULL, record TEXT NOT NULL, sequence_offset INTEGER, sequence_size INTEGER, hash TEXT)',
+    'CREATE TABLE IF NOT EXISTS clusters (id TEXT PRIMARY KEY, position INTEGER NOT NULL, record TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS found_in (cluster TEXT NOT NULL, genome TEXT NOT NULL, hits TEXT NOT NULL, PRIMARY KEY (cluster, genome))',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)'
+]
+
+
+class StoredPlasmid(dict):
+    """Plasmid record loaded from a store, registering itself as modified on each item assignment."""
+
+    __slots__ = ('store',)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.store.modified[self['id']] = self
+
+
+class PlasmidStore(MutableMapping):
+    """Lazy mapping of plasmid ids to plasmid records of a store.
+
+    Only plasmid ids are read upfront. Records are read on access including their sequence
+    from the packed sequence file. New and modified records are kept until the store is exported.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.sequence_path = store_path.with_suffix(SEQUENCE_SUFFIX)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(store_path), check_same_thread=False)
+        create_schema(self.connection)
+        self.ids = [row[0] for row in self.connection.execute('SELECT id FROM plasmids ORDER BY position')]
+        self.stored_ids = set(self.ids)
+        self.modified = {}  # new or modified records by id
+        self.deleted = set()
+        self.sequences = {}  # stored sequence of loaded records by id to detect sequence modifications
+        self.sequence_fh = None
+
+    def __getitem__(self, id):
+        record = self.modified.get(id, None)
+        if(record is not None):
+            return record
+        if(id not in self.stored_ids or id in self.deleted):
+            raise KeyError(id)
+        with self.lock:
+            row = self.connection.execute('SELECT record, sequence_offset, sequence_size FROM plasmids WHERE id = ?', (id,)).fetchone()
+            record = StoredPlasmid(json.loads(row[0]))
+            if(row[1] is not None):
+                if(self.sequence_fh is None):
+                    self.sequence_fh = self.sequence_path.open('rb')
+                self.sequence_fh.seek(row[1])
+                sequence = zlib.decompress(self.sequence_fh.read(row[2])).decode()
+                dict.__setitem__(record, 'sequence', sequence)
+                self.sequences[id] = (sequence, row[1], row[2])
+        record.store = self
+        return record
+
+    def __setitem__(self, id, record):
+        if(id not in self.stored_ids and id not in self.modified):
+            self.ids.append(id)
+        self.modified[id] = record
+        self.deleted.discard(id)
+
+    def __delitem__(self, id):
+        if(id not in self):
+            raise KeyError(id)
+        self.modified.pop(id, None)
+        if(id in self.stored_ids):
+            self.deleted.add(id)
+        self.ids.remove(id)
+
+    def get_hashes(self):
+        """Return canonical sequence hashes of all plasmids by id from the hash index without reading records or sequences.
+
+        Plasmids stored by former versions without a hash are mapped to None.
+        """
+        with self.lock:
+            hashes = dict(self.connection.execute('SELECT id, hash FROM plasmids'))
+        return {id: self.modified[id].get('hash', None) if id in self.modified else hashes.get(id, None) for id in self.ids}
+
+    def __contains__(self, id):
+        return id in self.modified or (id in self.stored_ids and id not in self.deleted)
+
+    def __iter__(self):
+        return iter(list(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def close(self):
+        if(self.sequence_fh is not None):
+            self.sequence_fh.close()
+            self.sequence_fh = None
+        self.connection.close()
+
+
+def create_schema(connection):
+    """Create all tables if missing and add the hash index to plasmid tables of former versions."""
+    with connection:
+        for statement in SCHEMA:
+            connection.execute(statement)
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(plasmids)')]
+        if('hash' not in columns):
+            connection.execute('ALTER TABLE plasmids ADD COLUMN hash TEXT')
+
+
+def load_store(store_path):
+    """Load a store with lazily loaded plasmids and eagerly loaded clusters, found_in hits and metadata."""
+    plasmids = PlasmidStore(store_path)
+    data = {'plasmids': plasmids}
+    for key, value in plasmids.connection.execute('SELECT key, value FROM meta'):
+        data[key] = json.loads(value)
+
+    clusters = {}
+    for id, record in plasmids.connection.execute('SELECT id, record FROM clusters ORDER BY position'):
+        clusters[id] = json.loads(record)
+    for cluster_id, genome, hits in plasmids.connection.execute('SELECT cluster, genome, hits FROM found_in ORDER BY rowid'):
+        clusters[cluster_id].setdefault('found_in', {})[genome] = json.loads(hits)
+    if(len(clusters) > 0):
+        data['clusters'] = list(clusters.values())
+    log.info('loaded store: path=%s, # plasmids=%i, # clusters=%i', store_path, len(plasmids), len(clusters))
+    return data
+
+
+def export_store(data, store_path):
+    """Write data to a store.
+
+    If plasmids were loaded from the same store, only new, modified and deleted plasmids are written.
+    Sequences are appended to the packed sequence file as separately compressed blocks.
+    Clusters, found_in hits and metadata are replaced entirely.
+    """
+    plasmids = data.get('plasmids', {})
+    incremental = isinstance(plasmids, PlasmidStore) and plasmids.store_path == store_path
+    if(not incremental):  # write a new store from scratch
+        for path in [store_path, store_path.with_suffix(SEQUENCE_SUFFIX)]:
+            if(path.exists()):
+                path.unlink()
+    connection = plasmids.connection if incremental else sqlite3.connect(str(store_path))
+    records = dict(plasmids.modified) if incremental else plasmids
+    deleted_ids = set(plasmids.deleted) if incremental else set()
+    try:
+        create_schema(connection)
+        with connection:
+            write_plasmids(connection, store_path, plasmids, records, deleted_ids, incremental)
+            write_clusters(connection, data.get('clusters', []))
+            connection.execute('DELETE FROM meta')
+            connection.executemany(
+                'INSERT INTO meta (key, value) VALUES (?, ?)',
+                [(key, json.dumps(value)) for key, value in data.items() if key not in ['plasmids', 'clusters']]
+            )
+    finally:
+        if(not incremental):
+            connection.close()
+    if(incremental):  # all pending changes are stored
+        clear_pending(plasmids, records.keys() | deleted_ids)
+    log.info('exported store: path=%s, # plasmids=%i, # written=%i', store_path, len(plasmids), len(records))
+
+
+def update_store(data, store_path, changes):
+    """Write only changed parts of data to a store within a single transaction.
+
+    Changes are key paths into the data as for journaled JSON databases. Plasmids are written per record,
+    clusters per record or per found_in hits and metadata per top-level key. Missing keys are deleted.
+    If plasmids were not loaded from the same store, the store is written entirely.
+    """
+    plasmids = data.get('plasmids', {})
+    if(not isinstance(plasmids, PlasmidStore) or plasmids.store_path != store_path):
+        export_store(data, store_path)
+        return
+
+    plasmid_ids, cluster_paths, meta_keys = set(), [], set()
+    for path in changes:
+        if(path[0] == 'plasmids'):
+            plasmid_ids.update(plasmids.ids if len(path) == 1 else [path[1]])
+            if(len(path) == 1):
+                plasmid_ids.update(plasmids.deleted)
+        elif(path[0] == 'clusters'):
+            cluster_paths.append(path)
+        else:
+            meta_keys.add(path[0])
+    records = {id: plasmids[id] for id in plasmids.ids if id in plasmid_ids}
+    deleted_ids = {id for id in plasmid_ids if id not in plasmids and id in plasmids.stored_ids}
+    clusters = data.get('clusters', [])
+
+    connection = plasmids.connection
+    create_schema(connection)
+    with connection:
+        write_plasmids(connection, store_path, plasmids, records, deleted_ids, True)
+        if(any(len(path) < 3 or path[1] >= len(clusters) for path in cluster_paths)):  # cluster list changed
+            write_clusters(connection, clusters)
+        else:
+            for path in cluster_paths:
+                cluster = clusters[path[1]]
+                if(path[2] == 'found_in'):
+                    write_found_in(connection, cluster)
+                else:
+                    record = json.dumps({k: v for k, v in cluster.items() if k != 'found_in'})
+                    connection.execute('UPDATE clusters SET record = ? WHERE id = ?', (record, cluster['id']))
+        for key in meta_keys:
+            if(key in data):
+                connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, json.dumps(data[key])))
+            else:
+                connection.execute('DELETE FROM meta WHERE key = ?', (key,))
+    clear_pending(plasmids, records.keys() | deleted_ids)
+    log.info('updated store: path=%s, # changes=%i, # written=%i, # deleted=%i', store_path, len(changes), len(records), len(deleted_ids))
+
+
+def write_plasmids(connection, store_path, plasmids, records, deleted_ids, incremental):
+    """Write plasmid records and delete removed plasmids, appending new or modified sequences to the packed sequence file."""
+    next_position = connection.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM plasmids').fetchone()[0]
+    with store_path.with_suffix(SEQUENCE_SUFFIX).open('ab') as fh:
+        for id, plasmid in records.items():
+            sequence = plasmid.get('sequence', None)
+            stored_sequence = plasmids.sequences.get(id, None) if incremental else None
+            if(stored_sequence is not None and stored_sequence[0] is sequence):  # unchanged sequence, reuse block
+                sequence_offset, sequence_size = stored_sequence[1:]
+            elif(sequence is not None):
+                block = zlib.compress(sequence.encode(), COMPRESSION_LEVEL)
+                sequence_offset = fh.tell()
+                sequence_size = len(block)
+                fh.write(block)
+            else:
+                sequence_offset, sequence_size = None, None
+            record = json.dumps({k: v for k, v in plasmid.items() if k != 'sequence'})
+            connection.execute(  # stored plasmids keep their position
+                'INSERT INTO plasmids (id, position, record, sequence_offset, sequence_size, hash) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (id) DO UPDATE SET record = excluded.record, sequence_offset = excluded.sequence_offset, sequence_size = excluded.sequence_size, hash = excluded.hash',
+                (id, next_position, record, sequence_offset, sequence_size, plasmid.get('hash', None))
+            )
+            next_position += 1
+    connection.executemany('DELETE FROM plasmids WHERE id = ?', [(id,) for id in deleted_ids])
+
+
+def write_clusters(connection, clusters):
+    """Replace all clusters and their found_in hits."""
+    connection.execute('DELETE FROM clusters')
+    connection.execute('DELETE FROM found_in')
+    for position, cluster in enumerate(clusters):
+        record = json.dumps({k: v for k, v in cluster.items() if k != 'found_in'})
+        connection.execute('INSERT INTO clusters (id, position, record) VALUES (?, ?, ?)', (cluster['id'], position, record))
+        write_found_in(connection, cluster)
+
+
+def write_found_in(connection, cluster):
+    """Replace the found_in hits of a single cluster."""
+    connection.execute('DELETE FROM found_in WHERE cluster = ?', (cluster['id'],))
+    connection.executemany(
+        'INSERT INTO found_in (cluster, genome, hits) VALUES (?, ?, ?)',
+        [(cluster['id'], genome, json.dumps(hits)) for genome, hits in cluster.get('found_in', {}).items()]
+    )
+
+
+def clear_pending(plasmids, ids):
+    """Mark written or deleted plasmids of a store as stored."""
+    for id in ids:
+        plasmids.modified.pop(id, None)
+        plasmids.sequences.pop(id, None)  # sequence blocks might have moved
+        if(id in plasmids.deleted):
+            plasmids.deleted.discard(id)
+            plasmids.stored_ids.discard(id)
+        else:
+            plasmids.stored_ids.add(id)
+
+
+def compact_store(store_path):
+    """Rewrite the packed sequence file with sequences of stored plasmids only and reclaim space of the SQLite database.
+
+    Sequence blocks are copied without recompression into a new file in plasmid order, which replaces the former file
+    once all offsets are updated.
+    """
+    sequence_path = store_path.with_suffix(SEQUENCE_SUFFIX)
+    compacted_path = sequence_path.with_name(f'{sequence_path.name}.tmp')
+    connection = sqlite3.connect(str(store_path))
+    try:
+        create_schema(connection)
+        rows = connection.execute('SELECT id, sequence_offset, sequence_size FROM plasmids WHERE sequence_offset IS NOT NULL ORDER BY position').fetchall()
+        former_size = sequence_path.stat().st_size if sequence_path.is_file() else 0
+        offsets = []
+        with connection:
+            if(len(rows) > 0):
+                with sequence_path.open('rb') as fh_in, compacted_path.open('wb') as fh_out:
+                    for id, sequence_offset, sequence_size in rows:
+                        fh_in.seek(sequence_offset)
+                        offsets.append((fh_out.tell(), id))
+                        fh_out.write(fh_in.read(sequence_size))
+                    fh_out.flush()
+                    os.fsync(fh_out.fileno())
+            connection.executemany('UPDATE plasmids SET sequence_offset = ? WHERE id = ?', offsets)
+            if(len(rows) > 0):
+                os.replace(compacted_path, sequence_path)
+            elif(sequence_path.is_file()):
+                sequence_path.unlink()
+        connection.execute('VACUUM')
+    finally:
+        connection.close()
+    compacted_size = sequence_path.stat().st_size if sequence_path.is_file() else 0
+    log.info('compacted store: path=%s, # sequences=%i, sequence-size=%i, former-sequence-size=%i', store_path, len(rows), compacted_size, former_size)
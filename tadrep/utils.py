@@ -1,9 +1,11 @@
 import argparse
+import hashlib
 import logging
 import multiprocessing as mp
 import os
 import subprocess as sp
 import sys
+import tempfile
 
 from pathlib import Path
 
@@ -49,6 +51,8 @@ def parse_arguments():
     arg_group_io = db_parser.add_argument_group('Input / Output')
     arg_group_io.add_argument('--type', action='store', default='refseq', choices=['refseq', 'plsdb'], type=str.lower, help="External DB to import (default = 'refseq')")
     arg_group_io.add_argument('--force', '-f', action='store_true', help='Force download and new setup of database')
+    arg_group_io.add_argument('--convert', action='store', default=None, choices=['json', 'sqlite'], help='Convert the plasmid database (db.json/db.sqlite) of the output directory into the given format instead of downloading a database')
+    arg_group_io.add_argument('--compact', action='store_true', help='Compact the plasmid database (db.json/db.sqlite) of the output directory merging all journaled changes instead of downloading a database')
 
     # extraction parser
     extraction_parser = subparsers.add_parser('extract', help='Extract unique plasmid sequences')
@@ -67,6 +71,13 @@ def parse_arguments():
     arg_group_char.add_argument('--db', action='store', default=None, dest='database', help='Import json file from a given database path into working directory')
     arg_group_char.add_argument('--inc-types', action='store', default=None, help='Import inc-types from given path into working directory')
 
+    arg_group_char_parameters = characterization_parser.add_argument_group('Parameter')
+    arg_group_char_parameters.add_argument('--inc-type-engine', action='store', default='blastn', choices=['blastn', 'kmer'], dest='inc_type_engine', help="Inc-type search engine: Blast+ or in-process k-mer index (default = 'blastn')")
+    arg_group_char_parameters.add_argument('--store-translations', action='store_true', dest='store_translations', help='Store CDS amino acid sequences in the database, e.g. for exports (default = translate on demand)')
+
+    arg_group_char_performance = characterization_parser.add_argument_group('Performance')
+    arg_group_char_performance.add_argument('--incremental', action='store_true', help='Only characterize new plasmids or plasmids characterized with other inc-types')
+
     # clustering parser
     clustering_parser = subparsers.add_parser('cluster', help='Cluster related plasmids')
     
@@ -74,12 +85,16 @@ def parse_arguments():
     arg_group_parameters.add_argument('--min-sequence-identity', action='store', type=int, default=90, choices=range(1, 101), metavar='[1-100]', dest='min_sequence_identity', help='Minimal plasmid sequence identity (default = 90%%)')
     arg_group_parameters.add_argument('--max-sequence-length-difference', action='store', type=int, default=1000, choices=range(1, 1_000_001), metavar='[1-1000000]', dest='max_sequence_length_difference', help='Maximal plasmid sequence length difference in basepairs (default = 1000)')
     arg_group_parameters.add_argument('--skip', '-s', action='store_true', help='Skips clustering, one group for each plasmid')
+    arg_group_parameters.add_argument('--collapse-duplicates', action='store_true', dest='collapse_duplicates', help='Skips clustering like --skip, but one group for each distinct plasmid sequence on either strand')
+    arg_group_parameters.add_argument('--engine', action='store', default='cd-hit', choices=['cd-hit', 'sketch'], help="Clustering engine: CD-HIT-EST or in-process greedy clustering of k-mer sketches (default = 'cd-hit')")
+    arg_group_parameters.add_argument('--incremental', action='store_true', help='Only assign plasmids not yet clustered to existing or new clusters, keeping cluster ids and detection results')
 
     # detection parser
     detection_parser = subparsers.add_parser('detect', help='Detect and reconstruct plasmids in draft genomes')
 
     arg_group_io = detection_parser.add_argument_group('Input / Output')
     arg_group_io.add_argument('--genome', '-g', action='store', default=None, nargs="+", help='Draft genome path')
+    arg_group_io.add_argument('--output-format', action='store', default='fasta', choices=['fasta', 'bgzf'], dest='output_format', help="Format of reconstructed plasmid sequences: Fasta files per plasmid or BGZF compressed and indexed multi Fasta files per genome (default = 'fasta')")
 
     arg_group_parameters = detection_parser.add_argument_group('Detection')
     arg_group_parameters.add_argument('--min-contig-coverage', action='store', type=int, default=90, choices=range(1, 101), metavar='[1-100]', dest='min_contig_coverage', help='Minimal contig coverage (default = 90%%)')
@@ -88,6 +103,13 @@ def parse_arguments():
     arg_group_parameters.add_argument('--min-plasmid-identity', action='store', type=int, default=90, choices=range(1, 101), metavar='[1-100]', dest='min_plasmid_identity', help='Minimal plasmid identity (default = 90%%)')
     arg_group_parameters.add_argument('--gap-sequence-length', action='store', type=is_positive, default=10, dest='gap_sequence_length', help="Gap sequence N length (default = 10)")
 
+    arg_group_performance = detection_parser.add_argument_group('Performance')
+    arg_group_performance.add_argument('--batch', action='store_true', help='Search all genomes in a single multi-threaded Blast+ run (recommended for large cohorts of small genomes)')
+    arg_group_performance.add_argument('--shards', action='store', type=int, default=1, help='Split reference plasmids into n shards searched in parallel (recommended for single genomes and large databases, default = 1)')
+    arg_group_performance.add_argument('--incremental', action='store_true', help='Only analyze new or changed genomes and merge them into previous cohort results')
+    arg_group_performance.add_argument('--prefilter', action='store_true', help='Only search reference plasmids sufficiently contained within a genome by k-mer sketches')
+    arg_group_performance.add_argument('--min-containment', action='store', type=int, default=5, choices=range(0, 101), metavar='[0-100]', dest='min_containment', help='Minimal k-mer sketch containment of reference plasmids for the prefilter (default = 5%%)')
+
     # visualization parser
     visualization_parser = subparsers.add_parser('visualize', help='Visualize plasmid coverage of contigs')
     
@@ -144,6 +166,48 @@ def run_cmd(cmd_command, tmp_path):
         sys.exit(f'ERROR: {process.stderr}\nError code: {process.returncode}')
 
 
+def stream_cmd(cmd_command, tmp_path):
+    """Run a command and lazily yield its stdout lines instead of buffering the entire output.
+
+    If the consumer stops early, the still running command is killed and reaped.
+    """
+    with tempfile.TemporaryFile(mode='w+', dir=str(tmp_path)) as stderr_fh:
+        process = sp.Popen(
+            cmd_command,
+            cwd=str(tmp_path),
+            stdout=sp.PIPE,
+            stderr=stderr_fh,
+            universal_newlines=True
+        )
+        completed = False
+        try:
+            with process.stdout:
+                for line in process.stdout:
+                    yield line
+            completed = True
+        finally:
+            if(not completed and process.poll() is None):
+                process.kill()
+            process.wait()
+
+        if(process.returncode != 0):
+            stderr_fh.seek(0)
+            stderr = stderr_fh.read()
+            log.debug('command: %s', cmd_command)
+            log.debug('stderr=%s', stderr)
+            log.warning('command failed! Error-code: %s', process.returncode)
+            sys.exit(f'ERROR: {stderr}\nError code: {process.returncode}')
+
+
+def calc_file_hash(file_path):
+    """Calculate the SHA-256 hash of a file's content."""
+    file_hash = hashlib.sha256()
+    with file_path.open('rb') as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
 def check_file_permission(file, purpose):
     try:
         resolved_path = Path(file).resolve()
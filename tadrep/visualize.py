@@ -10,8 +10,8 @@ log = logging.getLogger('VISUALIZE')
 
 
 def plot():
-    db_path = cfg.output_path.joinpath('db.json')
-    db_data = tio.load_data(db_path)
+    db_path = tio.get_db_path(cfg.output_path)
+    db_data = tio.load_db(db_path)
 
     for cluster in db_data['clusters']:
         detected_genomes = cluster.get('found_in', {})
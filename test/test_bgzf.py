@@ -0,0 +1,42 @@
+import gzip
+import random
+import struct
+
+from pathlib import Path
+
+from Bio import bgzf
+
+import tadrep.bgzf as tbgzf
+
+
+def test_bgzf_writer(tmpdir):
+    random.seed(42)
+    data = ''.join(random.choice('ACGTN\n') for _ in range(200_000))
+    path = Path(tmpdir).joinpath('data.gz')
+    with tbgzf.BgzfWriter(path) as writer:
+        for start in range(0, len(data), 7_000):
+            writer.write(data[start:start + 7_000])
+        assert writer.tell() == len(data)
+    assert gzip.decompress(path.read_bytes()).decode() == data
+    assert path.read_bytes().endswith(tbgzf.EOF_BLOCK)
+
+    gzi = path.with_name('data.gz.gzi').read_bytes()
+    entries = [struct.unpack_from('<2Q', gzi, 8 + 16 * i) for i in range(struct.unpack_from('<Q', gzi)[0])]
+    assert len(entries) == len(data) // tbgzf.MAX_BLOCK_INPUT
+    with bgzf.BgzfReader(str(path)) as reader:
+        for compressed_offset, uncompressed_offset in entries:
+            reader.seek(bgzf.make_virtual_offset(compressed_offset, 0))
+            assert reader.read(100) == data[uncompressed_offset:uncompressed_offset + 100]
+
+
+def test_bgzf_writer_abort(tmpdir):
+    path = Path(tmpdir).joinpath('data.gz')
+    try:
+        with tbgzf.BgzfWriter(path) as writer:
+            writer.write('ACGT' * 100_000)
+            raise ValueError('interrupted')
+    except ValueError:
+        pass
+    assert writer.fh.closed
+    assert not path.exists()  # no truncated file
+    assert not path.with_name('data.gz.gzi').exists()
@@ -65,3 +65,93 @@ def test_hit_filtering():
     # assert without hits
     filtered_hits = tb.filter_contig_hits('test', {}, plasmids)
     assert filtered_hits == {}
+
+
+@patch("tadrep.blast.cfg.min_contig_coverage", 40 / 100)
+@patch("tadrep.blast.cfg.min_contig_identity", 90 / 100)
+def test_streamed_hit_filtering():
+    with Path("test/data/blastn.tsv").open('r') as fh:
+        raw_hits = (hit for qseqid, hit in tb.parse_hits(fh))  # consume hits lazily
+        filtered_hits = tb.filter_contig_hits('test', raw_hits, plasmids)
+    assert filtered_hits.keys() == expected_hits.keys()
+
+    for plasmid_id, hits in expected_hits.items():
+        assert len(filtered_hits[plasmid_id]) == len(hits)
+
+
+def test_shard_splitting():
+    shards = tb.split_shards(plasmids, 2)
+    assert sorted(reference_id for shard in shards for reference_id in shard) == sorted(plasmids.keys())
+    assert shards[0] == ['p3']  # longest plasmid in first shard
+    assert tb.split_shards(plasmids, 1) == [list(plasmids.keys())]
+    assert len(tb.split_shards(plasmids, 10)) == len(plasmids)
+
+
+@patch("tadrep.blast.reference_ordinals", {'p1': 0, 'p2': 1, 'p3': 2})
+def test_hit_culling():
+    def hit(plasmid_id, start, end, score):
+        return {'reference_plasmid_id': plasmid_id, 'contig_start': start, 'contig_end': end, 'score': score, 'evalue': 2.0 ** -score}
+
+    merged_hits = [
+        ('c1', hit('p1', 1, 1000, 500)),  # dominated by better hit of another shard
+        ('c1', hit('p2', 1, 1000, 900)),
+        ('c1', hit('p3', 2001, 3000, 300)),  # no overlap
+        ('c2', hit('p1', 1, 1000, 900)),  # identical hits, lower ordinal wins
+        ('c2', hit('p3', 1, 1000, 900)),
+        ('c3', hit('p3', 1, 500, 400))
+    ]
+    culled_hits = [(qseqid, h['reference_plasmid_id']) for qseqid, h in tb.cull_hits(merged_hits)]
+    assert culled_hits == [('c1', 'p2'), ('c1', 'p3'), ('c2', 'p1'), ('c3', 'p3')]
+
+
+@patch("tadrep.blast.reference_ordinals", {'p1': 0, 'p2': 1, 'p3': 2})
+def test_sharded_hit_culling():
+    def hit(plasmid_id, start, end, score):
+        return ('c1', {'reference_plasmid_id': plasmid_id, 'contig_start': start, 'contig_end': end, 'score': score, 'evalue': 2.0 ** -score})
+
+    hit_a = hit('p1', 800, 1400, 500)  # dominated by hit_b only
+    hit_b = hit('p2', 400, 1100, 600)  # dominated by hit_c
+    hit_c = hit('p3', 1, 1000, 1000)
+    unsharded_hits = tb.cull_hits([hit_a, hit_b, hit_c])  # single culling as by blastn on an unsharded database
+    assert [h['reference_plasmid_id'] for _, h in unsharded_hits] == ['p3', 'p1']
+
+    shard_hits = {'shard-0': [hit_a, hit_b], 'shard-1': [hit_c]}  # unculled hits per shard
+    with patch("tadrep.blast.search_shard", lambda genome_path, db_path, threads, seqidlist_path=None: shard_hits[db_path]):
+        sharded_hits = tb.search_shards(Path('genome.fna'), [('shard-0', None), ('shard-1', None)], 2)
+    assert sharded_hits == unsharded_hits
+
+    culled_shard_hits = tb.cull_hits(tb.cull_hits(shard_hits['shard-0']) + shard_hits['shard-1'])  # culling within and across shards
+    assert [h['reference_plasmid_id'] for _, h in culled_shard_hits] == ['p3']  # hit_a is lost if shards are culled twice
+
+
+def test_batch_demultiplexing(tmpdir):
+    genome_paths = []
+    for genome in ['a', 'b', 'c']:
+        genome_path = Path(tmpdir).joinpath(f'{genome}.fna')
+        genome_path.write_text('>c_1\nACGTACGTAC\n>c_2\nACGTACGTAC\n')
+        genome_paths.append(genome_path)
+
+    def line(qseqid, sseqid, score):
+        return f'{qseqid}\t1\t10\t10\t{sseqid}\t1\t10\t10\t10\tplus\t{2.0 ** -score}\t{score}\t{score}\n'
+
+    blastn_lines = [  # hits in query order, no hits of genome b
+        line('g0_c_1', 'p1', 10),
+        line('g0_c_2', 'p2', 10),
+        line('g2_c_1', 'p1', 20),  # unculled hits of overlapping references
+        line('g2_c_1', 'p2', 19)
+    ]
+    with patch("tadrep.blast.run_blastn", lambda *args, **kwargs: iter(blastn_lines)), patch("tadrep.blast.reference_dbs", [Path('references')]), patch("tadrep.blast.cfg.prefilter", False):
+        hits = [(index, [(hit['contig_id'], hit['reference_plasmid_id']) for hit in genome_hits]) for index, genome_hits in tb.search_contigs_batch(genome_paths, Path(tmpdir).joinpath('batch.fna'), 1)]
+    assert hits == [
+        (0, [('a-c_1', 'p1'), ('a-c_2', 'p2')]),
+        (2, [('c-c_1', 'p1'), ('c-c_1', 'p2')])
+    ]
+
+    selected_reference_ids = {'a': {'p1'}, 'b': {'p1'}, 'c': {'p2'}}  # prefilter selections per genome
+    with patch("tadrep.blast.run_blastn", lambda *args, **kwargs: iter(blastn_lines)), patch("tadrep.blast.reference_dbs", [Path('references')]), patch("tadrep.blast.cfg.prefilter", True), \
+            patch("tadrep.blast.cfg.tmp_path", Path(tmpdir)), patch("tadrep.blast.select_references", lambda genome, genome_hashes: selected_reference_ids[genome]):
+        hits = [(index, [(hit['contig_id'], hit['reference_plasmid_id']) for hit in genome_hits]) for index, genome_hits in tb.search_contigs_batch(genome_paths, Path(tmpdir).joinpath('batch.fna'), 1)]
+    assert hits == [
+        (0, [('a-c_1', 'p1')]),  # hits of references selected for other genomes are removed
+        (2, [('c-c_1', 'p2')])  # not culled by the hit of p1 not selected for genome c
+    ]
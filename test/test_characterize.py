@@ -0,0 +1,46 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import tadrep.cds as tcd
+import tadrep.characterize as tc
+import tadrep.io as tio
+
+
+@patch('tadrep.characterize.cfg.threads', 2)
+def test_parallel_gene_prediction():
+    plasmids = list(tio.load_data(Path('test/data/db.json'))['plasmids'].values())
+    predictions = list(tc.predict_genes(plasmids))
+    assert [plasmid['id'] for plasmid, plasmid_cds in predictions] == [plasmid['id'] for plasmid in plasmids]
+    assert [plasmid_cds for plasmid, plasmid_cds in predictions] == [tc.gene_prediction(plasmid['sequence']) for plasmid in plasmids]
+
+
+def test_characterization_hash():
+    characterization = tc.calc_characterization_hash('ACGT', 'inc-types', 'blastn')
+    assert characterization == tc.calc_characterization_hash('ACGT', 'inc-types', 'blastn')
+    assert characterization != tc.calc_characterization_hash('ACGA', 'inc-types', 'blastn')
+    assert characterization != tc.calc_characterization_hash('ACGT', 'other-inc-types', 'blastn')
+    assert characterization != tc.calc_characterization_hash('ACGT', 'inc-types', 'kmer')
+
+
+def test_lazy_translation():
+    for plasmid in tio.load_data(Path('test/data/db.json'))['plasmids'].values():
+        cds = tc.gene_prediction(plasmid['sequence'])
+        assert tcd.count_cds(cds) == len(plasmid['cds'])
+        assert tcd.translate_cds(plasmid['sequence'], cds) == [hit['aa'] for hit in plasmid['cds']]  # as translated by Pyrodigal
+        tcd.materialize_translations({'sequence': plasmid['sequence'], 'cds': cds})
+        assert cds['aa'] == [hit['aa'] for hit in plasmid['cds']]
+
+
+@patch('tadrep.characterize.cfg.threads', 2)
+@patch('tadrep.characterize.get_inc_types_path', lambda: Path('test/data/inc-types.fasta'))
+def test_kmer_inc_types_agreement():
+    plasmids = list(tio.load_data(Path('test/data/db.json'))['plasmids'].values())
+    inc_types = tc.search_inc_types_kmer(plasmids)
+    additional_types = {'plasmids-p3': {'Col440I'}}  # overlaps Col(pHAD28) but is a separate query for blastn, 93% identity and 86% coverage
+    for plasmid in plasmids:  # agree with stored blastn inc-types
+        kmer_hits = sorted(inc_types.get(plasmid['id'], []), key=lambda k: k['type'])
+        assert {hit['type'] for hit in kmer_hits} - {hit['type'] for hit in plasmid['inc_types']} == additional_types.get(plasmid['id'], set())
+        kmer_hits = [hit for hit in kmer_hits if hit['type'] not in additional_types.get(plasmid['id'], set())]
+        blastn_hits = sorted(plasmid['inc_types'], key=lambda k: k['type'])
+        assert [(hit['type'], hit['start'], hit['end'], hit['strand']) for hit in kmer_hits] == [(hit['type'], hit['start'], hit['end'], hit['strand']) for hit in blastn_hits]
+        assert all(abs(kmer_hit['coverage'] - blastn_hit['coverage']) < 0.01 for kmer_hit, blastn_hit in zip(kmer_hits, blastn_hits))
@@ -0,0 +1,96 @@
+import random
+
+from unittest.mock import patch
+
+import tadrep.cluster as tcl
+import tadrep.sequence as tsq
+
+
+@patch('tadrep.cluster.cfg.threads', 2)
+@patch('tadrep.cluster.cfg.cluster_sequence_identity_threshold', 0.9)
+@patch('tadrep.cluster.cfg.cluster_length_threshold', 1000)
+def test_cluster_sketches():
+    rng = random.Random(42)
+    sequence_a = ''.join(rng.choice('ACGT') for i in range(50_000))
+    sequence_b = ''.join(rng.choice('ACGT') for i in range(40_000))
+    variant_a = ''.join(nt if rng.random() > 0.01 else rng.choice('ACGT') for nt in sequence_a[:49_500])
+    plasmids = [
+        {'id': 'b', 'sequence': sequence_b},
+        {'id': 'a', 'sequence': sequence_a},
+        {'id': 'a-variant', 'sequence': tsq.reverse_complement(variant_a)},
+        {'id': 'a-short', 'sequence': sequence_a[:45_000]},  # exceeds length difference
+        {'id': 'short', 'sequence': 'ACGT' * 3},
+        {'id': 'short-copy', 'sequence': tsq.reverse_complement('ACGT' * 3)}
+    ]
+    clusters = tcl.cluster_sketches(plasmids)
+    assert [(cluster['representative'], cluster['members']) for cluster in clusters] == [
+        ('a', ['a', 'a-variant']),
+        ('a-short', ['a-short']),
+        ('b', ['b']),
+        ('short', ['short', 'short-copy'])
+    ]
+    assert [cluster['id'] for cluster in clusters] == ['p0', 'p1', 'p2', 'p3']
+
+
+@patch('tadrep.cluster.cfg.threads', 2)
+@patch('tadrep.cluster.cfg.cluster_sequence_identity_threshold', 0.9)
+@patch('tadrep.cluster.cfg.cluster_length_threshold', 1000)
+def test_assign_sketches():
+    rng = random.Random(42)
+    sequence_a = ''.join(rng.choice('ACGT') for i in range(50_000))
+    sequence_b = ''.join(rng.choice('ACGT') for i in range(40_000))
+    representatives = [{'id': 'a', 'sequence': sequence_a[:49_500]}]
+    plasmids = [
+        {'id': 'b', 'sequence': sequence_b},
+        {'id': 'a-longer', 'sequence': sequence_a},  # longer than its representative
+        {'id': 'b-copy', 'sequence': sequence_b}
+    ]
+    new_representatives, members = tcl.assign_sketches(plasmids, representatives)
+    assert new_representatives == ['b']
+    assert members == {'a': ['a-longer'], 'b': ['b', 'b-copy']}
+
+
+@patch('tadrep.cluster.cfg.collapse_duplicates', True)
+def test_cluster_duplicates():
+    plasmids = {
+        'a': {'id': 'a', 'sequence': 'AAAC'},
+        'b': {'id': 'b', 'sequence': 'ACGT'},
+        'a-reverse': {'id': 'a-reverse', 'sequence': 'GTTT'},
+        'a-copy': {'id': 'a-copy', 'sequence': 'AAAC', 'hash': tsq.calc_canonical_hash('AAAC')}
+    }
+    clusters = tcl.cluster_duplicates(plasmids)
+    assert clusters == [
+        {'id': 'p0', 'representative': 'a', 'members': ['a', 'a-reverse', 'a-copy']},
+        {'id': 'p1', 'representative': 'b', 'members': ['b']}
+    ]
+    with patch('tadrep.cluster.cfg.collapse_duplicates', False):
+        assert [cluster['members'] for cluster in tcl.cluster_duplicates(plasmids)] == [['a'], ['b'], ['a-reverse'], ['a-copy']]
+
+
+@patch('tadrep.cluster.cfg.skip_cluster', True)
+@patch('tadrep.cluster.cfg.collapse_duplicates', True)
+@patch('tadrep.cluster.cfg.verbose_print', lambda message: None)
+def test_update_clusters():
+    db_data = {
+        'plasmids': {
+            'a': {'id': 'a', 'sequence': 'AAAC'},
+            'b': {'id': 'b', 'sequence': 'ACGT'}
+        },
+        'clusters': [
+            {'id': 'p0', 'representative': 'a', 'members': ['a'], 'found_in': {'genome': []}},
+            {'id': 'p1', 'representative': 'b', 'members': ['b']}
+        ]
+    }
+    assert tcl.update_clusters(db_data) is None  # no new plasmids
+
+    db_data['plasmids']['a-reverse'] = {'id': 'a-reverse', 'sequence': 'GTTT'}
+    changes = tcl.update_clusters(db_data)
+    assert changes == [('clusters', 0, 'members')]  # assigned to existing cluster only
+    assert db_data['clusters'][0] == {'id': 'p0', 'representative': 'a', 'members': ['a', 'a-reverse'], 'found_in': {'genome': []}}
+
+    db_data['plasmids']['c'] = {'id': 'c', 'sequence': 'CCCA'}
+    db_data['plasmids']['c-copy'] = {'id': 'c-copy', 'sequence': 'CCCA'}
+    changes = tcl.update_clusters(db_data)
+    assert changes == [('clusters',)]
+    assert db_data['clusters'][2] == {'id': 'p2', 'representative': 'c', 'members': ['c', 'c-copy']}
+    assert [cluster['members'] for cluster in db_data['clusters'][:2]] == [['a', 'a-reverse'], ['b']]
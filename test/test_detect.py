@@ -0,0 +1,96 @@
+import io
+import os
+
+from pathlib import Path
+from unittest.mock import patch
+
+import tadrep.detect as td
+import tadrep.io as tio
+import tadrep.utils as tu
+
+
+def test_cohort_table(tmpdir):
+    plasmid_genomes = {'p2': {1}, 'p1': {0, 2}}  # sparse presence/absence, no plasmid in genome g3
+    with patch('tadrep.detect.cfg.output_path', Path(tmpdir)):
+        td.write_cohort_table(plasmid_genomes, ['g0', 'g1', 'g2', 'g3'])
+    lines = Path(tmpdir).joinpath('plasmids.distribution.tsv').read_text().splitlines()
+    assert lines == [
+        '\tp2\tp1',
+        'g0\t0\t1',
+        'g1\t1\t0',
+        'g2\t0\t1',
+        'g3\t0\t0'
+    ]
+
+
+def test_summary_order():
+    def plasmid(genome, reference):
+        return {'id': reference, 'reference': reference, 'length': 100, 'genome': genome, 'coverage': 1.0, 'identity': 1.0, 'hits': [{'contig_id': f'{genome}-c1'}]}
+
+    plasmid_genomes, plasmids_detected, completed_genomes = {}, {}, {}
+    fh_summary = io.StringIO()
+    genome_index = 0
+    for index, genome in [(2, 'g2'), (1, 'g1'), (3, 'g3'), (0, 'g0')]:  # completion order
+        completed_genomes[index] = [plasmid(genome, 'p1')]
+        genome_index = td.add_completed_genomes(completed_genomes, genome_index, plasmid_genomes, plasmids_detected, fh_summary)
+        if(index != 0):
+            assert fh_summary.getvalue() == ''  # wait for genome g0
+    assert genome_index == 4
+    assert completed_genomes == {}
+    assert [line.split('\t')[0] for line in fh_summary.getvalue().splitlines()] == ['g0', 'g1', 'g2', 'g3']
+    assert plasmid_genomes == {'p1': {0, 1, 2, 3}}
+    assert list(plasmids_detected['p1']['found_in'].keys()) == ['g0', 'g1', 'g2', 'g3']
+
+
+def test_cohort_setup(tmpdir):
+    genome_paths = []
+    for genome in ['a', 'b']:
+        genome_path = Path(tmpdir).joinpath(f'{genome}.fna')
+        genome_path.write_text(f'>{genome}\nACGTACGTAC\n')
+        genome_paths.append(genome_path)
+    cohort_path = Path(tmpdir).joinpath('cohort.json')
+    hashed_paths = []
+    calc_file_hash = tu.calc_file_hash
+
+    def setup_cohort(genome_paths, reference_hash='references', min_contig_coverage=0.9, output_format='fasta', prefix=None):
+        with patch('tadrep.detect.cfg.cohort_path', cohort_path), patch('tadrep.detect.cfg.incremental', True), patch('tadrep.detect.cfg.threads', 1), \
+                patch('tadrep.detect.cfg.output_format', output_format), patch('tadrep.detect.cfg.prefix', prefix), \
+                patch('tadrep.detect.cfg.genome_path', genome_paths), patch('tadrep.detect.tb.reference_hash', reference_hash), \
+                patch('tadrep.detect.cfg.min_contig_coverage', min_contig_coverage), patch('tadrep.detect.cfg.verbose_print', lambda message: None), \
+                patch('tadrep.detect.tu.calc_file_hash', lambda file_path: hashed_paths.append(file_path) or calc_file_hash(file_path)):
+            cohort, pending_samples = td.setup_cohort()
+        tio.export_json({'genomes': cohort}, cohort_path)
+        return cohort, pending_samples
+
+    cohort, pending_samples = setup_cohort(genome_paths)
+    assert pending_samples == ['a', 'b']
+    assert hashed_paths == genome_paths
+
+    hashed_paths.clear()
+    cohort, pending_samples = setup_cohort(genome_paths)  # unchanged key
+    assert pending_samples == []
+    assert hashed_paths == []  # unchanged size and modification time
+
+    stat = genome_paths[0].stat()
+    os.utime(genome_paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))  # touched but unchanged content
+    cohort, pending_samples = setup_cohort(genome_paths)
+    assert pending_samples == []
+    assert hashed_paths == [genome_paths[0]]
+
+    genome_paths[1].write_text('>b\nACGTACGTACGT\n')  # changed content
+    cohort, pending_samples = setup_cohort(genome_paths)
+    assert pending_samples == ['b']
+
+    cohort, pending_samples = setup_cohort(genome_paths, min_contig_coverage=0.8)  # changed threshold
+    assert pending_samples == ['a', 'b']
+    cohort, pending_samples = setup_cohort(genome_paths, reference_hash='changed', min_contig_coverage=0.8)  # changed reference hash
+    assert pending_samples == ['a', 'b']
+    cohort, pending_samples = setup_cohort(genome_paths, reference_hash='changed', min_contig_coverage=0.8, output_format='bgzf')  # changed output files
+    assert pending_samples == ['a', 'b']
+    cohort, pending_samples = setup_cohort(genome_paths, reference_hash='changed', min_contig_coverage=0.8, output_format='bgzf', prefix='run')
+    assert pending_samples == ['a', 'b']
+
+    genome_paths[0].unlink()  # missing genome path
+    cohort, pending_samples = setup_cohort([], reference_hash='changed', min_contig_coverage=0.8, output_format='bgzf', prefix='run')
+    assert list(cohort.keys()) == ['b']
+    assert pending_samples == []
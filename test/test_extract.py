@@ -0,0 +1,53 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import tadrep.extract as te
+import tadrep.io as tio
+import tadrep.sequence as tsq
+
+
+SEQUENCE = 'ACGTTGCAAGGCTTACCGATCGATTTGACCA' * 10
+
+
+def extract(output_path, files):
+    with patch('tadrep.extract.cfg.output_path', output_path), patch('tadrep.extract.cfg.files_to_extract', files), \
+            patch('tadrep.extract.cfg.threads', 1), patch('tadrep.extract.cfg.file_type', 'plasmid'), \
+            patch('tadrep.extract.cfg.header', None), patch('tadrep.extract.cfg.verbose_print', lambda message: None):
+        te.extract()
+    return tio.load_db(tio.get_db_path(output_path))
+
+
+def test_reverse_complement_duplicates(tmpdir):
+    output_path = Path(tmpdir)
+    first_path = output_path.joinpath('first.fna')
+    first_path.write_text(f'>p1\n{SEQUENCE}\n>p2\n{SEQUENCE[:200]}\n')
+    second_path = output_path.joinpath('second.fna')
+    second_path.write_text(f'>q1\n{tsq.reverse_complement(SEQUENCE)}\n')
+
+    db_data = extract(output_path, [first_path, second_path])
+    plasmids = db_data['plasmids']
+    assert len(plasmids) == 2  # reverse complement stored as source only
+    plasmid = next(plasmid for plasmid in plasmids.values() if plasmid['sequence'] == SEQUENCE)
+    assert plasmid['sources'] == [{'file': 'first.fna', 'id': 'first-p1'}, {'file': 'second.fna', 'id': 'second-q1'}]
+    assert plasmid['hash'] == tsq.calc_canonical_hash(tsq.reverse_complement(SEQUENCE))
+
+
+def test_skip_extracted_files(tmpdir):
+    output_path = Path(tmpdir)
+    input_path = output_path.joinpath('plasmids.fna')
+    input_path.write_text(f'>p1\n{SEQUENCE}\n')
+    db_data = extract(output_path, [input_path])
+    assert len(db_data['plasmids']) == 1
+    assert list(db_data['file_hashes'].values()) == [str(input_path)]
+
+    copy_path = output_path.joinpath('copy.fna')  # identical content under another name
+    copy_path.write_text(input_path.read_text())
+    db_data = extract(output_path, [input_path, copy_path])
+    assert len(db_data['plasmids']) == 1
+    assert list(db_data['file_hashes'].values()) == [str(input_path)]  # no file was extracted again
+    assert next(iter(db_data['plasmids'].values()))['sources'] == [{'file': 'plasmids.fna', 'id': 'plasmids-p1'}]
+
+    input_path.write_text(f'>p1\n{SEQUENCE}\n>p2\n{SEQUENCE[:200]}\n')  # changed content
+    db_data = extract(output_path, [input_path])
+    assert len(db_data['plasmids']) == 2
+    assert len(db_data['file_hashes']) == 2
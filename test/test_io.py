@@ -0,0 +1,83 @@
+import gzip
+
+from pathlib import Path
+from unittest.mock import patch
+
+import tadrep.io as tio
+
+
+FASTA = '>c1 first contig\nACGTac\nGTn\n>c2\n\n>c3  spaced  description\r\nAC GT\r\nac\ttg\r\n>c4\nACGT'
+
+
+def test_parser_parity(tmpdir):
+    fasta_path = Path(tmpdir).joinpath('genome.fna')
+    fasta_path.write_text(FASTA)
+    gz_path = Path(tmpdir).joinpath('genome.fna.gz')
+    with gzip.open(gz_path, 'wt') as fh:
+        fh.write(FASTA)
+
+    expected = list(tio.iter_sequences(fasta_path, parser='biopython'))
+    assert [contig['sequence'] for contig in expected] == ['ACGTACGTN', '', 'ACGTACTG', 'ACGT']
+    for chunk_size in [1, 5, 1 << 20]:
+        with patch('tadrep.io.FASTA_CHUNK_SIZE', chunk_size):
+            assert list(tio.iter_sequences(fasta_path, parser='native')) == expected
+            assert list(tio.iter_sequences(gz_path, parser='native')) == [{**contig, 'id': contig['id'].replace('genome', 'genome.fna')} for contig in expected]
+
+
+def test_parser_plasmids():
+    fasta_path = Path('test/data/plasmids.fna')
+    assert tio.import_sequences(fasta_path, sequence=True, parser='native') == tio.import_sequences(fasta_path, sequence=True, parser='biopython')
+
+
+def test_indexed_fetch(tmpdir):
+    fasta_path = Path(tmpdir).joinpath('genome.fna')
+    for fasta in [FASTA, '>c1\nACGT\nAC\n>c2\nacgt\ngtac\nac\n>c3\n']:  # irregular and regular line lengths
+        fasta_path.write_text(fasta)
+        contigs = tio.index_sequences(fasta_path)
+        expected = {contig['id']: contig['sequence'] for contig in tio.iter_sequences(fasta_path)}
+        assert dict(tio.fetch_sequences(fasta_path, contigs)) == expected
+        assert dict(tio.fetch_sequences(fasta_path, contigs, {'genome-c2'})) == {'genome-c2': expected['genome-c2']}
+
+
+def test_db_journal(tmpdir):
+    db_path = Path(tmpdir).joinpath('db.json')
+    db_data = {'plasmids': {'p1': {'id': 'p1', 'sequence': 'ACGT'}}, 'clusters': [{'id': 'c1'}], 'files': []}
+    tio.update_db(db_data, db_path, [])  # new database is written entirely
+    assert not tio.get_journal_path(db_path).exists()
+
+    db_data['plasmids']['p2'] = {'id': 'p2', 'sequence': 'GG'}
+    db_data['clusters'][0]['found_in'] = {'genome': []}
+    del db_data['files']
+    tio.update_db(db_data, db_path, [('plasmids', 'p2'), ('clusters', 0, 'found_in'), ('files',)])
+    assert tio.load_data(db_path) == db_data
+
+    with tio.get_journal_path(db_path).open('ab') as fh:  # interrupted update
+        fh.write(b'{"changes": [{"path": ["plasmids", "p3"], "val')
+    assert tio.load_data(db_path) == db_data
+    db_data['plasmids']['p1']['length'] = 4
+    tio.update_db(db_data, db_path, [('plasmids', 'p1', 'length')])
+    assert tio.load_data(db_path) == db_data
+
+    tio.compact_db(db_path)
+    assert not tio.get_journal_path(db_path).exists()
+    compacted_data = tio.import_json(db_path)
+    assert compacted_data.pop('journal_id') != db_data.pop('journal_id')  # new journal generation
+    assert compacted_data == db_data
+
+
+def test_db_stale_journal(tmpdir):
+    db_path = Path(tmpdir).joinpath('db.json')
+    db_data = {'plasmids': {'p1': {'id': 'p1', 'sequence': 'ACGT'}}, 'clusters': [{'id': 'c1'}, {'id': 'c2'}]}
+    tio.export_db(db_data, db_path)
+    db_data['clusters'][1]['found_in'] = {'genome': []}
+    tio.update_db(db_data, db_path, [('clusters', 1, 'found_in')])
+    journal = tio.get_journal_path(db_path).read_bytes()
+
+    db_data['clusters'] = [{'id': 'c3'}]  # reclustered
+    tio.export_db(db_data, db_path)
+    tio.get_journal_path(db_path).write_bytes(journal)  # interrupted before removing the journal
+    assert tio.load_data(db_path) == db_data  # positional changes of the former clusters are not replayed
+
+    db_data['clusters'][0]['found_in'] = {'genome': []}
+    tio.update_db(db_data, db_path, [('clusters', 0, 'found_in')])
+    assert tio.load_data(db_path) == db_data
@@ -1,3 +1,5 @@
+import random
+
 from unittest.mock import patch
 
 import tadrep.plasmids as tp
@@ -112,3 +114,29 @@ def test_plasmid_detection():
 
     detected_plasmids = tp.detect_reference_plasmids('test-sample', {}, plasmids)
     assert detected_plasmids == []
+
+
+def calc_coverage_per_base(plasmid, hits):  # former per-base implementation
+    cov_array = [0 for i in range(0, plasmid['length'])]
+    for hit in hits:
+        for i in range(hit['reference_plasmid_start'] - 1, hit['reference_plasmid_end']):
+            cov_array[i] += 1
+    uncovered_bp = cov_array.count(0)
+    covered_bp = plasmid['length'] - uncovered_bp
+    coverage = covered_bp / plasmid['length']
+    return coverage, covered_bp, uncovered_bp, cov_array
+
+
+def test_coverage_parity():
+    rnd = random.Random(42)
+    for length in [1, 10, 1000, 5000]:
+        plasmid = {'id': 'test', 'length': length}
+        for hit_count in [0, 1, 2, 5, 30]:
+            hits = []
+            for i in range(hit_count):
+                start = rnd.randint(1, length)
+                end = rnd.randint(start, length)
+                hits.append({'reference_plasmid_start': start, 'reference_plasmid_end': end})
+            coverage, covered_bp, uncovered_bp, cov_array = calc_coverage_per_base(plasmid, hits)
+            assert tp.calc_coverage(plasmid, hits) == (coverage, covered_bp, uncovered_bp)
+            assert tp.calc_depth(plasmid, hits).tolist() == cov_array
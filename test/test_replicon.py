@@ -0,0 +1,61 @@
+from pathlib import Path
+
+import tadrep.io as tio
+import tadrep.replicon as trp
+import tadrep.sequence as tsq
+
+
+def test_search_sequence():
+    inc_type = next(tio.iter_sequences(Path('test/data/inc-types.fasta')))
+    index = trp.build_index([(inc_type['original-id'], inc_type['sequence'])])
+    flank = 'ACGTTGCA' * 50
+    length = inc_type['length']
+    forward_hits = trp.search_sequence(index, flank + inc_type['sequence'] + flank)
+    reverse_hits = trp.search_sequence(index, flank + tsq.reverse_complement(inc_type['sequence']) + flank)
+    hits = [hit for id, hit in forward_hits + reverse_hits if hit['coverage'] == 1.0]
+    assert sorted((hit['start'], hit['end'], hit['strand']) for hit in hits) == [
+        (401, 400 + length, '+'),
+        (400 + length, 401, '-')
+    ]
+    assert all(hit['identity'] == 1.0 for hit in hits)
+
+    sequence = flank + inc_type['sequence'] + flank + tsq.reverse_complement(inc_type['sequence']) + flank
+    hits = trp.search_sequence(index, sequence)
+    assert [(hit['start'], hit['strand']) for id, hit in hits] == [(401, '+')]  # second copy culled on the reference as by blastn
+
+
+def test_search_mismatches():
+    inc_type = next(tio.iter_sequences(Path('test/data/inc-types.fasta')))
+    index = trp.build_index([(inc_type['original-id'], inc_type['sequence'])])
+    sequence = list(inc_type['sequence'])
+    for position in range(20, len(sequence), 20):  # 95% identity
+        sequence[position] = 'A' if sequence[position] != 'A' else 'C'
+    hits = trp.search_sequence(index, ''.join(sequence))
+    assert max(hit['coverage'] for id, hit in hits) > 0.9
+    assert min(hit['identity'] for id, hit in hits) >= trp.MIN_IDENTITY
+
+
+def test_search_fragments():
+    inc_type = next(tio.iter_sequences(Path('test/data/inc-types.fasta')))
+    index = trp.build_index([(inc_type['original-id'], inc_type['sequence'])])
+    middle = len(inc_type['sequence']) // 2
+    flank = 'ACGTTGCA' * 50
+
+    deletion = inc_type['sequence'][:middle] + inc_type['sequence'][middle + 1:]  # single indel, chained into one alignment
+    hits = trp.search_sequence(index, flank + deletion + flank)
+    assert [(hit['start'], hit['end']) for id, hit in hits] == [(401, 400 + len(deletion))]
+    assert hits[0][1]['coverage'] == 1.0
+
+    sequence = list(inc_type['sequence'])
+    for position in range(middle - 50, middle + 50):  # divergent region between two exact fragments
+        sequence[position] = 'A' if sequence[position] != 'A' else 'C'
+    hits = trp.search_sequence(index, flank + ''.join(sequence) + flank)
+    assert hits == []  # fragments are not reported separately
+
+
+def test_search_overlapping_references():
+    inc_types = list(tio.iter_sequences(Path('test/data/inc-types.fasta')))[:2]
+    index = trp.build_index([(inc_type['original-id'], inc_type['sequence']) for inc_type in inc_types])
+    sequence = inc_types[0]['sequence'] + inc_types[1]['sequence'][:len(inc_types[1]['sequence']) // 2]
+    hits = trp.search_sequence(index, inc_types[1]['sequence'][len(inc_types[1]['sequence']) // 2:] + sequence)
+    assert {id for id, hit in hits if hit['coverage'] == 1.0} == {inc_type['original-id'] for inc_type in inc_types}  # hits of different references are not culled
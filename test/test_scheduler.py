@@ -0,0 +1,51 @@
+import threading
+
+import tadrep.scheduler as tsc
+
+
+def test_proportional_cores():
+    tsc.setup(8, [300, 100])
+    cores, acquire_time = tsc.acquire_cores(300)
+    assert cores == 6  # share of 3/4
+    assert tsc.free_cores == 2
+    remaining_cores, remaining_time = tsc.acquire_cores(100)
+    assert remaining_cores == 2  # last pending job receives all free cores
+    assert tsc.free_cores == 0 and tsc.pending_size == 0
+    tsc.release_cores(cores, acquire_time)
+    tsc.release_cores(remaining_cores, remaining_time)
+    assert tsc.free_cores == 8
+
+
+def test_core_budget():
+    tsc.setup(4, [1] * 10)
+    acquired = [tsc.acquire_cores(1) for i in range(4)]
+    assert all(cores == 1 for cores, acquire_time in acquired)  # at least one core per job
+    assert tsc.free_cores == 0  # entire budget is used
+
+    results = []
+    waiting_job = threading.Thread(target=lambda: results.append(tsc.acquire_cores(1)))
+    waiting_job.start()
+    waiting_job.join(timeout=0.2)
+    assert waiting_job.is_alive()  # blocks until cores are released
+
+    cores, acquire_time = acquired.pop()
+    tsc.release_cores(cores, acquire_time)
+    waiting_job.join(timeout=5)
+    assert not waiting_job.is_alive()
+    assert results[0][0] == 1
+    assert tsc.free_cores == 0
+
+
+def test_drain_cores():
+    tsc.setup(8, [100, 100, 100])
+    first = tsc.acquire_cores(100)
+    second = tsc.acquire_cores(100)
+    assert first[0] + second[0] < 8
+    tsc.release_cores(*first)  # queue drains, released cores go to the last job
+    last = tsc.acquire_cores(100)
+    assert last[0] == 8 - second[0]
+    assert tsc.free_cores == 0
+    for cores, acquire_time in [second, last]:
+        tsc.release_cores(cores, acquire_time)
+    assert tsc.free_cores == 8
+    assert tsc.get_utilization()['allocation'] >= 0
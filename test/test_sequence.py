@@ -0,0 +1,40 @@
+import io
+import random
+import string
+
+from unittest.mock import patch
+
+from Bio.Seq import Seq
+
+import tadrep.sequence as tsq
+
+
+def test_reverse_complement():
+    sequence = string.ascii_letters + string.digits + '*-.'
+    assert tsq.reverse_complement(sequence) == str(Seq(sequence).reverse_complement())
+    assert tsq.reverse_complement('') == ''
+
+
+def test_join_sequences():
+    random.seed(42)
+    segments = [(''.join(random.choice('ACGTN') for _ in range(random.randint(0, 100))), random.choice('+-')) for _ in range(20)]
+    expected = 'NNN'.join(sequence if strand == '+' else str(Seq(sequence).reverse_complement()) for sequence, strand in segments)
+    assert tsq.join_sequences(iter(segments), 'NNN') == expected
+    assert tsq.join_sequences([], 'NNN') == ''
+
+
+@patch('tadrep.sequence.CHUNK_LINES', 3)
+def test_write_wrapped():
+    for length in range(0, 400, 7):
+        sequence = 'ACGT' * 100
+        sequence = sequence[:length]
+        lines = [sequence[i:i + 60] for i in range(0, len(sequence), 60)]
+        fh = io.StringIO()
+        tsq.write_wrapped(fh, sequence, 60)
+        assert fh.getvalue() == '\n'.join(lines) + '\n'
+
+
+def test_canonical_hash():
+    sequence = 'AACGTNRT'
+    assert tsq.calc_canonical_hash(sequence) == tsq.calc_canonical_hash(tsq.reverse_complement(sequence))
+    assert tsq.calc_canonical_hash(sequence) != tsq.calc_canonical_hash(sequence[::-1])
@@ -0,0 +1,26 @@
+import tadrep.stats as tst
+
+
+def test_statistics():
+    sequences = ['GGGCCAAT' * 250, 'ACGTNNNN', '']
+    statistics = tst.calc_statistics(sequences, window_size=1000, kmer_size=2)
+    assert [s['gc_content'] for s in statistics] == [0.625, 0.25, 0.0]
+    assert [s['gc_skew'] for s in statistics] == [0.2, 0.0, 0.0]
+    assert [s['n_content'] for s in statistics] == [0.0, 0.5, 0.0]
+    assert statistics[0]['composition']['gc_windows'] == [0.625, 0.625]
+    assert statistics[0]['composition']['gc_skew_windows'] == [0.2, 0.2]
+    assert statistics[2]['composition']['gc_windows'] == []
+
+
+def test_kmer_profile():
+    statistics = tst.calc_statistics(['AAAA', 'TTTT', 'AC'], kmer_size=2)  # no k-mers spanning sequences
+    canonical_kmers = tst.get_canonical_kmers(2).tolist()
+    assert len(canonical_kmers) == 10
+    assert statistics[0]['composition']['kmer_profile'] == statistics[1]['composition']['kmer_profile']  # reverse complements
+    assert statistics[0]['composition']['kmer_profile'][canonical_kmers.index(0)] == 1.0  # AA
+    assert statistics[2]['composition']['kmer_profile'][canonical_kmers.index(1)] == 1.0  # AC
+
+
+def test_batches():
+    assert list(tst.iter_batches('abcd', [3, 3, 5, 1], batch_size=6)) == [['a', 'b'], ['c', 'd']]
+    assert list(tst.iter_batches('ab', [10, 1], batch_size=6)) == [['a'], ['b']]
@@ -0,0 +1,108 @@
+import json
+
+from pathlib import Path
+
+import tadrep.io as tio
+import tadrep.store as ts
+
+
+def test_store_roundtrip(tmpdir):
+    db_data = tio.load_data(Path('test/data/db.json'))
+    store_path = Path(tmpdir).joinpath('db.sqlite')
+    tio.export_db(db_data, store_path)
+
+    stored_data = tio.load_db(store_path)
+    assert isinstance(stored_data['plasmids'], ts.PlasmidStore)
+    assert list(stored_data['plasmids'].keys()) == list(db_data['plasmids'].keys())
+    json_path = Path(tmpdir).joinpath('db.json')
+    tio.export_db(stored_data, json_path)
+    json_data = json.loads(json_path.read_text())
+    assert json_data.pop('journal_id') == stored_data['journal_id']  # new journal generation
+    assert json_data == db_data
+
+
+def test_store_changes(tmpdir):
+    db_data = tio.load_data(Path('test/data/db.json'))
+    store_path = Path(tmpdir).joinpath('db.sqlite')
+    tio.export_db(db_data, store_path)
+    sequence_size = store_path.with_suffix(ts.SEQUENCE_SUFFIX).stat().st_size
+
+    stored_data = tio.load_db(store_path)
+    ids = list(stored_data['plasmids'].keys())
+    stored_data['plasmids'][ids[0]]['gc_content'] = 0.5  # modify metadata only
+    del stored_data['plasmids'][ids[1]]
+    stored_data['plasmids']['new'] = {'id': 'new', 'sequence': 'ACGT', 'length': 4}
+    stored_data['files'] = ['new.fna']
+    tio.export_db(stored_data, store_path)
+    assert store_path.with_suffix(ts.SEQUENCE_SUFFIX).stat().st_size < sequence_size + 100  # only the new sequence was appended
+
+    stored_data = tio.load_db(store_path)
+    assert list(stored_data['plasmids'].keys()) == [ids[0]] + ids[2:] + ['new']
+    assert stored_data['plasmids'][ids[0]]['gc_content'] == 0.5
+    assert stored_data['plasmids'][ids[0]]['sequence'] == db_data['plasmids'][ids[0]]['sequence']
+    assert stored_data['plasmids']['new']['sequence'] == 'ACGT'
+    assert stored_data['files'] == ['new.fna']
+    assert stored_data['clusters'] == db_data['clusters']
+
+
+def test_store_hashes(tmpdir):
+    db_data = tio.load_data(Path('test/data/db.json'))
+    store_path = Path(tmpdir).joinpath('db.sqlite')
+    tio.export_db(db_data, store_path)
+
+    stored_data = tio.load_db(store_path)
+    ids = list(stored_data['plasmids'].keys())
+    assert stored_data['plasmids'].get_hashes() == {id: None for id in ids}  # plasmids of former versions without hash
+    stored_data['plasmids'][ids[0]]['hash'] = 'abc'
+    stored_data['plasmids']['new'] = {'id': 'new', 'sequence': 'ACGT', 'length': 4, 'hash': 'def'}
+    assert stored_data['plasmids'].get_hashes() == {ids[0]: 'abc', **{id: None for id in ids[1:]}, 'new': 'def'}
+    tio.export_db(stored_data, store_path)
+
+    plasmids = tio.load_db(store_path)['plasmids']
+    assert plasmids.get_hashes() == {ids[0]: 'abc', **{id: None for id in ids[1:]}, 'new': 'def'}
+    assert plasmids.sequences == {}  # no sequence was read
+
+
+def test_store_update(tmpdir):
+    db_data = tio.load_data(Path('test/data/db.json'))
+    store_path = Path(tmpdir).joinpath('db.sqlite')
+    tio.export_db(db_data, store_path)
+
+    stored_data = tio.load_db(store_path)
+    ids = list(stored_data['plasmids'].keys())
+    stored_data['plasmids'][ids[0]]['gc_content'] = 0.5
+    stored_data['plasmids'][ids[1]]['gc_content'] = 0.5  # not listed as change
+    stored_data['clusters'][0]['found_in'] = {'genome': []}
+    stored_data['clusters'][1]['found_in'] = {'genome': []}  # not listed as change
+    stored_data['files'] = ['new.fna']
+    tio.update_db(stored_data, store_path, [('plasmids', ids[0], 'gc_content'), ('clusters', 0, 'found_in'), ('files',)])
+
+    updated_data = tio.load_db(store_path)
+    assert updated_data['plasmids'][ids[0]]['gc_content'] == 0.5
+    assert updated_data['plasmids'][ids[1]]['gc_content'] == db_data['plasmids'][ids[1]]['gc_content']
+    assert updated_data['clusters'][0]['found_in'] == {'genome': []}
+    assert updated_data['clusters'][1].get('found_in', {}) == db_data['clusters'][1].get('found_in', {})
+    assert updated_data['files'] == ['new.fna']
+
+
+def test_store_compaction(tmpdir):
+    db_data = tio.load_data(Path('test/data/db.json'))
+    store_path = Path(tmpdir).joinpath('db.sqlite')
+    sequence_path = store_path.with_suffix(ts.SEQUENCE_SUFFIX)
+    tio.export_db(db_data, store_path)
+    sequence_size = sequence_path.stat().st_size
+
+    stored_data = tio.load_db(store_path)
+    ids = list(stored_data['plasmids'].keys())
+    stored_data['plasmids'][ids[0]]['sequence'] = 'ACGT'  # replaced sequence block
+    del stored_data['plasmids'][ids[1]]
+    tio.export_db(stored_data, store_path)
+    stored_data['plasmids'].close()
+    assert sequence_path.stat().st_size > sequence_size
+
+    tio.compact_db(store_path)
+    assert sequence_path.stat().st_size < sequence_size
+    compacted_data = tio.load_db(store_path)
+    assert list(compacted_data['plasmids'].keys()) == [ids[0]] + ids[2:]
+    assert compacted_data['plasmids'][ids[0]]['sequence'] == 'ACGT'
+    assert all(compacted_data['plasmids'][id]['sequence'] == db_data['plasmids'][id]['sequence'] for id in ids[2:])
@@ -0,0 +1,29 @@
+import subprocess as sp
+import sys
+
+from pathlib import Path
+from unittest.mock import patch
+
+import tadrep.utils as tu
+
+
+def test_stream_cmd_early_stop(tmpdir):
+    processes = []
+    popen = sp.Popen
+
+    def start_process(*args, **kwargs):
+        process = popen(*args, **kwargs)
+        processes.append(process)
+        return process
+
+    cmd = [sys.executable, '-c', 'import time\nfor i in range(10): print(i, flush=True)\ntime.sleep(60)']
+    with patch('tadrep.utils.sp.Popen', start_process):
+        lines = tu.stream_cmd(cmd, Path(tmpdir))
+        assert [next(lines) for i in range(5)] == ['0\n', '1\n', '2\n', '3\n', '4\n']
+        lines.close()  # consumer stops halfway
+    assert processes[0].returncode is not None  # killed and reaped
+    assert processes[0].stdout.closed
+
+    with patch('tadrep.utils.sp.Popen', start_process):
+        assert len(list(tu.stream_cmd([sys.executable, '-c', 'print(1)'], Path(tmpdir)))) == 1
+    assert processes[1].returncode == 0